@@ -0,0 +1,156 @@
+"""
+Activity service for HIVMeet.
+
+Coalesces `last_active` writes: activity timestamps are rounded down to
+LAST_ACTIVE_GRANULARITY_SECONDS and, when the cache is Redis-backed, buffered
+in a Redis hash and persisted by a periodic task with a single bulk
+UPDATE ... FROM (VALUES ...) per batch. Database writes are then
+proportional to active users per interval, not to requests.
+
+Without Redis there is no buffer every process can flush, so timestamps are
+written through, at most once per user and granularity interval.
+"""
+import logging
+import time
+import uuid
+from datetime import datetime, timezone as dt_timezone
+from typing import Dict
+
+from django.conf import settings
+from django.db import connection, transaction
+
+from hivmeet_backend.shared_store import SharedBackend
+
+logger = logging.getLogger('hivmeet.auth')
+
+PENDING_KEY = 'activity:pending'
+FLUSH_BATCH_SIZE = 500
+
+
+class _DirectActivityBackend:
+    """
+    Used when Redis is not configured: an in-process buffer would only be
+    flushed by the process that holds it (not the Celery worker), so each
+    record is written through with one UPDATE, skipped when last_active is
+    already at or past the rounded timestamp.
+    """
+
+    def record(self, member: str, timestamp: int):
+        from .models import User
+        at = datetime.fromtimestamp(timestamp, tz=dt_timezone.utc)
+        User.objects.filter(pk=member, last_active__lt=at).update(last_active=at)
+
+    def drain(self) -> Dict[str, int]:
+        return {}
+
+
+class _RedisActivityBackend:
+    """
+    Redis hash backend (field = user id, value = rounded timestamp).
+    """
+
+    def __init__(self, client):
+        self.client = client
+
+    def record(self, member: str, timestamp: int):
+        self.client.hset(PENDING_KEY, member, timestamp)
+
+    def drain(self) -> Dict[str, int]:
+        # Move the hash aside atomically so writes during the flush are kept
+        flushing_key = f'{PENDING_KEY}:flushing:{uuid.uuid4().hex}'
+        try:
+            self.client.rename(PENDING_KEY, flushing_key)
+        except Exception:
+            # Nothing buffered
+            return {}
+        pipe = self.client.pipeline()
+        pipe.hgetall(flushing_key)
+        pipe.delete(flushing_key)
+        raw, _ = pipe.execute()
+        return {
+            (k.decode() if isinstance(k, bytes) else k): int(v)
+            for k, v in raw.items()
+        }
+
+
+_backend = SharedBackend('activity', _RedisActivityBackend, _DirectActivityBackend)
+
+
+def _get_backend():
+    return _backend.get()
+
+
+class ActivityService:
+    """
+    Service for buffering and persisting user activity timestamps.
+    """
+
+    @staticmethod
+    def get_granularity() -> int:
+        """Resolution, in seconds, of persisted last_active values."""
+        return max(1, getattr(settings, 'LAST_ACTIVE_GRANULARITY_SECONDS', 60))
+
+    @staticmethod
+    def round_timestamp(ts: float) -> int:
+        granularity = ActivityService.get_granularity()
+        return int(ts // granularity) * granularity
+
+    @staticmethod
+    def record(user_id, at=None, known=None) -> datetime:
+        """
+        Record an activity timestamp for a user (buffered, or written through
+        without Redis). Returns the rounded datetime that will be persisted.
+        `known` is the user's loaded last_active: nothing is recorded if it is
+        already at or past the rounded timestamp.
+        """
+        ts = at.timestamp() if at is not None else time.time()
+        rounded = ActivityService.round_timestamp(ts)
+        if known is not None and known.timestamp() >= rounded:
+            return known
+        try:
+            _get_backend().record(str(user_id), rounded)
+        except Exception as e:
+            logger.warning(f"Error recording activity for {user_id}: {str(e)}")
+        return datetime.fromtimestamp(rounded, tz=dt_timezone.utc)
+
+    @staticmethod
+    def flush() -> int:
+        """
+        Persist buffered timestamps to users.last_active.
+        Returns the number of rows updated.
+        """
+        pending = _get_backend().drain()
+        if not pending:
+            return 0
+
+        from .models import User
+        table = connection.ops.quote_name(User._meta.db_table)
+        items = list(pending.items())
+        updated = 0
+
+        try:
+            with transaction.atomic():
+                with connection.cursor() as cursor:
+                    for start in range(0, len(items), FLUSH_BATCH_SIZE):
+                        batch = items[start:start + FLUSH_BATCH_SIZE]
+                        values_sql = ', '.join(['(%s::uuid, %s::timestamptz)'] * len(batch))
+                        params = []
+                        for user_id, ts in batch:
+                            params.extend([user_id, datetime.fromtimestamp(ts, tz=dt_timezone.utc)])
+                        # Never move last_active backwards
+                        cursor.execute(
+                            f"UPDATE {table} AS u SET last_active = v.last_active "
+                            f"FROM (VALUES {values_sql}) AS v(id, last_active) "
+                            f"WHERE u.id = v.id AND u.last_active < v.last_active",
+                            params,
+                        )
+                        updated += cursor.rowcount
+        except Exception:
+            # Put the batch back so the next run retries it
+            backend = _get_backend()
+            for user_id, ts in items:
+                backend.record(user_id, ts)
+            raise
+
+        logger.info(f"Flushed last_active for {updated}/{len(items)} users")
+        return updated
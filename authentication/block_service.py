@@ -0,0 +1,79 @@
+"""
+Block graph service for HIVMeet.
+
+Caches, per user, the union of users they blocked and users who blocked them,
+so block checks do not join the M2M table on every request. Entries are
+invalidated synchronously whenever a block is added or removed.
+"""
+import logging
+import uuid
+from typing import Iterable, Set
+
+from django.core.cache import cache
+from django.db.models import Q
+
+from hivmeet_backend.optimizations import CACHE_TTL
+
+logger = logging.getLogger('hivmeet.auth')
+
+
+def _cache_key(user_id) -> str:
+    return f'block_graph_{user_id}'
+
+
+def _as_uuid(value):
+    return value if isinstance(value, uuid.UUID) else uuid.UUID(str(value))
+
+
+class BlockService:
+    """
+    Service for block relationships between users.
+    """
+
+    @staticmethod
+    def get_blocked_ids(user_id) -> Set[uuid.UUID]:
+        """
+        Get IDs of users that `user_id` blocked or was blocked by.
+        Suitable as an exclusion set for discovery and matching queries.
+        """
+        key = _cache_key(user_id)
+        cached = cache.get(key)
+        if cached is not None:
+            return cached
+
+        from .models import User
+        through = User.blocked_users.through
+        blocked_ids = set()
+        for from_id, to_id in through.objects.filter(
+            Q(from_user_id=user_id) | Q(to_user_id=user_id)
+        ).values_list('from_user_id', 'to_user_id'):
+            blocked_ids.add(to_id if str(from_id) == str(user_id) else from_id)
+
+        cache.set(key, blocked_ids, CACHE_TTL['block_graph'])
+        return blocked_ids
+
+    @staticmethod
+    def is_blocked_between(user_a_id, user_b_id) -> bool:
+        """Check if either user has blocked the other."""
+        return _as_uuid(user_b_id) in BlockService.get_blocked_ids(user_a_id)
+
+    @staticmethod
+    def invalidate(*user_ids: Iterable):
+        """Drop cached block sets (and WebSocket identities) for the given users."""
+        from .ws_identity_service import WebSocketIdentityService
+        cache.delete_many([_cache_key(user_id) for user_id in user_ids])
+        WebSocketIdentityService.invalidate(*user_ids)
+
+    @staticmethod
+    def block(user, target_user):
+        """Block a user; takes effect immediately for both sides."""
+        user.blocked_users.add(target_user)
+        BlockService.invalidate(user.id, target_user.id)
+        logger.info(f"User {user.id} blocked {target_user.id}")
+
+    @staticmethod
+    def unblock(user, target_user):
+        """Unblock a user; takes effect immediately for both sides."""
+        user.blocked_users.remove(target_user)
+        BlockService.invalidate(user.id, target_user.id)
+        logger.info(f"User {user.id} unblocked {target_user.id}")
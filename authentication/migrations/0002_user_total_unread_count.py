@@ -0,0 +1,36 @@
+"""
+Add the per-user total unread counter and backfill it from active matches.
+"""
+from django.db import migrations, models
+
+
+def backfill_total_unread_count(apps, schema_editor):
+    """Sum the unread counts of each user's active matches."""
+    User = apps.get_model('authentication', 'User')
+    Match = apps.get_model('matching', 'Match')
+    totals = {}
+    for user1_id, user2_id, count1, count2 in Match.objects.filter(status='active').values_list(
+        'user1_id', 'user2_id', 'user1_unread_count', 'user2_unread_count'
+    ).iterator():
+        totals[user1_id] = totals.get(user1_id, 0) + count1
+        totals[user2_id] = totals.get(user2_id, 0) + count2
+    for user_id, total in totals.items():
+        if total:
+            User.objects.filter(pk=user_id).update(total_unread_count=total)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('authentication', '0001_initial'),
+        ('matching', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='total_unread_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='Total unread count'),
+        ),
+        migrations.RunPython(backfill_total_unread_count, migrations.RunPython.noop),
+    ]
@@ -185,6 +185,12 @@ class User(AbstractBaseUser, PermissionsMixin):
         help_text=_('Firebase Cloud Messaging tokens for push notifications')
     )
     
+    # Unread messages across all conversations, kept by Match
+    total_unread_count = models.PositiveIntegerField(
+        default=0,
+        verbose_name=_('Total unread count')
+    )
+    
     # Settings
     notification_settings = models.JSONField(
         default=dict,
@@ -209,6 +215,15 @@ class User(AbstractBaseUser, PermissionsMixin):
             models.Index(fields=['verification_status']),
         ]
     
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Birth date as loaded, to rebuild derived data only when it changes
+        # (see profiles.signals)
+        if 'birth_date' in field_names:
+            instance._loaded_birth_date = instance.birth_date
+        return instance
+    
     def __str__(self):
         return f"{self.display_name} ({self.email})"
     
@@ -227,9 +242,13 @@ class User(AbstractBaseUser, PermissionsMixin):
         return self.age >= 18 if self.age else False
     
     def update_last_active(self):
-        """Update last active timestamp."""
-        self.last_active = timezone.now()
-        self.save(update_fields=['last_active'])
+        """
+        Update last active timestamp.
+        The write is buffered and persisted in bulk by the flush_last_active task
+        when Redis is configured, and written through otherwise.
+        """
+        from .activity_service import ActivityService
+        self.last_active = ActivityService.record(self.id, known=self.last_active)
     
     def add_fcm_token(self, token, device_id=None, platform=None):
         """Add or update FCM token for push notifications."""
@@ -0,0 +1,317 @@
+"""
+Push notification dispatcher for HIVMeet.
+
+Notification events are buffered per recipient for
+PUSH_NOTIFICATION_WINDOW_SECONDS, then flushed together: events of the same
+kind are collapsed into a single push ("3 new likes"), recipients and actors
+are loaded in bulk, and the push goes through the configured transport
+(see push_transports). Tokens reported invalid by the transport are pruned
+from User.fcm_tokens.
+
+The buffer and the "flush scheduled" flag must be seen by every process
+(web workers, the Celery worker running the flush). Without Redis, events
+are sent right away instead of being buffered.
+"""
+import json
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.translation import gettext as _
+
+from hivmeet_backend.shared_store import SharedBackend
+
+from .push_transports import PushMessage, get_push_transport
+
+logger = logging.getLogger('hivmeet.auth')
+
+BUFFER_KEY_PREFIX = 'push:buffer:'
+
+# Notification kinds
+MATCH = 'match'
+LIKE = 'like'
+MESSAGE = 'message'
+READ = 'read'
+CALL = 'call'
+
+
+class _LocalBufferBackend:
+    """
+    In-process buffer used when Redis is not configured. Only the process
+    holding it could flush it, so enqueue does not buffer events in it.
+    """
+
+    def __init__(self):
+        self._events = {}
+        self._lock = threading.Lock()
+
+    def push(self, recipient: str, event: dict):
+        with self._lock:
+            self._events.setdefault(recipient, []).append(event)
+
+    def drain(self, recipient: str) -> List[dict]:
+        with self._lock:
+            return self._events.pop(recipient, [])
+
+
+class _RedisBufferBackend:
+    """
+    Redis list per recipient.
+    """
+
+    def __init__(self, client):
+        self.client = client
+
+    def push(self, recipient: str, event: dict):
+        self.client.rpush(f'{BUFFER_KEY_PREFIX}{recipient}', json.dumps(event))
+
+    def drain(self, recipient: str) -> List[dict]:
+        key = f'{BUFFER_KEY_PREFIX}{recipient}'
+        pipe = self.client.pipeline()
+        pipe.lrange(key, 0, -1)
+        pipe.delete(key)
+        raw, _ = pipe.execute()
+        return [json.loads(item) for item in raw]
+
+
+_backend = SharedBackend('notifications', _RedisBufferBackend, _LocalBufferBackend)
+
+
+def _get_backend():
+    return _backend.get()
+
+
+def _scheduled_key(recipient_id) -> str:
+    return f'push_flush_scheduled_{recipient_id}'
+
+
+class NotificationDispatcher:
+    """
+    Service for buffering, collapsing and sending push notifications.
+    """
+
+    @staticmethod
+    def get_window() -> int:
+        """Seconds events are buffered before being sent; 0 sends right away."""
+        return getattr(settings, 'PUSH_NOTIFICATION_WINDOW_SECONDS', 5)
+
+    @staticmethod
+    def enqueue(recipient_id, kind: str, actor_id=None, data: Optional[dict] = None):
+        """
+        Buffer a notification event for a recipient.
+        The first event of a window schedules the flush for that recipient.
+        The event is sent right away if the window is 0 or the buffer is not
+        shared between processes.
+        """
+        window = NotificationDispatcher.get_window()
+        if window <= 0 or not _backend.shared():
+            NotificationDispatcher.send_now(recipient_id, kind, actor_id, data)
+            return
+
+        event = {
+            'kind': kind,
+            'actor_id': str(actor_id) if actor_id else None,
+            'data': {k: str(v) for k, v in (data or {}).items()},
+        }
+        recipient = str(recipient_id)
+        _get_backend().push(recipient, event)
+
+        if cache.add(_scheduled_key(recipient), True, window * 2):
+            from .tasks import flush_push_notifications
+            flush_push_notifications.apply_async(args=[recipient], countdown=window)
+
+    @staticmethod
+    def send_now(recipient_id, kind: str, actor_id=None, data: Optional[dict] = None) -> int:
+        """Send a single event immediately, e.g. incoming calls."""
+        event = {
+            'kind': kind,
+            'actor_id': str(actor_id) if actor_id else None,
+            'data': {k: str(v) for k, v in (data or {}).items()},
+        }
+        return NotificationDispatcher._send({str(recipient_id): [event]})
+
+    @staticmethod
+    def flush(recipient_ids: Iterable) -> int:
+        """
+        Send buffered events for the given recipients.
+        Returns the number of pushes sent.
+        """
+        events_by_recipient = {}
+        for recipient in {str(r) for r in recipient_ids}:
+            cache.delete(_scheduled_key(recipient))
+            events = _get_backend().drain(recipient)
+            if events:
+                events_by_recipient[recipient] = events
+        if not events_by_recipient:
+            return 0
+        return NotificationDispatcher._send(events_by_recipient)
+
+    @staticmethod
+    def _send(events_by_recipient: Dict[str, List[dict]]) -> int:
+        from .models import User
+
+        # Load recipients and actors in one query
+        user_ids = set(events_by_recipient)
+        for events in events_by_recipient.values():
+            user_ids.update(e['actor_id'] for e in events if e['actor_id'])
+        users = {
+            str(user.id): user
+            for user in User.objects.filter(id__in=user_ids).only(
+                'id', 'email', 'display_name', 'fcm_tokens', 'notification_settings', 'is_premium'
+            )
+        }
+
+        photos = NotificationDispatcher._load_match_photos(events_by_recipient)
+        transport = get_push_transport()
+        sent = 0
+
+        for recipient_id, events in events_by_recipient.items():
+            recipient = users.get(recipient_id)
+            if recipient is None:
+                logger.error(f"User not found: {recipient_id}")
+                continue
+
+            tokens = [token['token'] for token in recipient.fcm_tokens or [] if token.get('token')]
+            if not tokens:
+                logger.warning(f"No FCM tokens found for user {recipient.email}")
+                continue
+
+            # Group by kind, keeping arrival order
+            grouped = OrderedDict()
+            for event in events:
+                grouped.setdefault(event['kind'], []).append(event)
+
+            invalid_tokens = set()
+            for kind, kind_events in grouped.items():
+                payload = NotificationDispatcher._build(recipient, kind, kind_events, users, photos)
+                if payload is None:
+                    continue
+                message = PushMessage(tokens=[t for t in tokens if t not in invalid_tokens], **payload)
+                if not message.tokens:
+                    break
+                try:
+                    result = transport.send(message)
+                except Exception as e:
+                    logger.error(f"Error sending {kind} notification to {recipient.email}: {str(e)}")
+                    continue
+                sent += 1
+                invalid_tokens.update(result.invalid_tokens)
+                logger.info(
+                    f"{kind} notification ({len(kind_events)} events) sent to {recipient.email}: "
+                    f"{result.success_count} successful, {result.failure_count} failed"
+                )
+
+            if invalid_tokens:
+                NotificationDispatcher.prune_tokens(recipient.id, invalid_tokens)
+
+        return sent
+
+    @staticmethod
+    def prune_tokens(user_id, invalid_tokens: Iterable[str]):
+        """Remove tokens the push provider rejected as permanently invalid."""
+        from .models import User
+
+        invalid_tokens = set(invalid_tokens)
+        with transaction.atomic():
+            user = User.objects.select_for_update().only('id', 'fcm_tokens').get(id=user_id)
+            remaining = [t for t in user.fcm_tokens or [] if t.get('token') not in invalid_tokens]
+            if len(remaining) != len(user.fcm_tokens or []):
+                user.fcm_tokens = remaining
+                user.save(update_fields=['fcm_tokens'])
+                logger.info(f"Pruned {len(invalid_tokens)} invalid FCM tokens for user {user_id}")
+
+    @staticmethod
+    def _load_match_photos(events_by_recipient) -> Dict[str, str]:
+        """Main photo thumbnails of matched users, for single-match pushes."""
+        actor_ids = {
+            e['actor_id']
+            for events in events_by_recipient.values()
+            for e in events if e['kind'] == MATCH and e['actor_id']
+        }
+        if not actor_ids:
+            return {}
+        from profiles.models import ProfilePhoto
+        return {
+            str(user_id): url
+            for user_id, url in ProfilePhoto.objects.filter(
+                profile__user_id__in=actor_ids, is_main=True
+            ).values_list('profile__user_id', 'thumbnail_url')
+        }
+
+    @staticmethod
+    def _build(recipient, kind, events, users, photos) -> Optional[dict]:
+        """Build title/body/data for one or more collapsed events of a kind."""
+        notification_settings = recipient.notification_settings or {}
+        latest = events[-1]
+        actor = users.get(latest['actor_id'])
+        actor_name = actor.display_name if actor else ''
+        count = len(events)
+        data = dict(latest['data'])
+        if count > 1:
+            data['count'] = str(count)
+
+        if kind == MESSAGE:
+            if not notification_settings.get('new_message_notifications', True):
+                return None
+            senders = {e['actor_id'] for e in events}
+            data.update({'notification_type': 'NEW_MESSAGE', 'sender_id': latest['actor_id'] or '', 'sender_name': actor_name})
+            if count == 1:
+                return {'title': actor_name, 'body': data.get('message_preview', ''), 'data': data}
+            if len(senders) == 1:
+                return {'title': actor_name, 'body': _('%(count)d new messages') % {'count': count}, 'data': data}
+            return {
+                'title': 'HIVMeet',
+                'body': _('%(count)d new messages from %(senders)d people') % {'count': count, 'senders': len(senders)},
+                'data': data,
+            }
+
+        if kind == READ:
+            if not notification_settings.get('message_read_notifications', True):
+                return None
+            data.update({'notification_type': 'MESSAGE_READ', 'reader_id': latest['actor_id'] or '', 'reader_name': actor_name})
+            body = _("Read your message") if count == 1 else _("Read your messages")
+            return {'title': actor_name, 'body': body, 'data': data}
+
+        if kind == LIKE:
+            # Only premium users with like notifications enabled
+            if not recipient.is_premium or not notification_settings.get('profile_like_notifications', True):
+                return None
+            data.update({'notification_type': 'PROFILE_LIKED', 'liker_user_id': latest['actor_id'] or '', 'liker_user_name': actor_name})
+            if count > 1:
+                return {
+                    'title': "Quelqu'un s'intéresse à vous !",
+                    'body': f"{count} personnes ont aimé votre profil",
+                    'data': data,
+                }
+            if data.get('is_super_like') == 'True':
+                return {'title': "Super Like reçu !", 'body': f"{actor_name} vous a envoyé un Super Like 💙", 'data': data}
+            return {'title': "Quelqu'un s'intéresse à vous !", 'body': f"{actor_name} a aimé votre profil", 'data': data}
+
+        if kind == MATCH:
+            data.update({'notification_type': 'NEW_MATCH', 'match_id': latest['actor_id'] or '', 'matched_user_name': actor_name})
+            if count > 1:
+                return {'title': "C'est un Match !", 'body': f"Vous avez {count} nouveaux matchs !", 'data': data}
+            return {
+                'title': "C'est un Match !",
+                'body': f"Vous et {actor_name} vous êtes plu !",
+                'image': photos.get(latest['actor_id']),
+                'data': data,
+            }
+
+        if kind == CALL:
+            call_type = data.get('call_type')
+            call_type_text = _("Audio call") if call_type == 'audio' else _("Video call")
+            data.update({'notification_type': 'INCOMING_CALL', 'caller_id': latest['actor_id'] or '', 'caller_name': actor_name})
+            return {
+                'title': f"{call_type_text} from {actor_name}",
+                'body': _("Tap to answer"),
+                'data': data,
+                'high_priority': True,
+            }
+
+        logger.warning(f"Unknown notification kind: {kind}")
+        return None
@@ -0,0 +1,362 @@
+"""
+Presence service for HIVMeet.
+
+Keeps a registry of online users as a Redis sorted set scored by the
+timestamp of each user's last heartbeat. Heartbeats come from authenticated
+HTTP requests (PresenceMiddleware) and WebSocket connections.
+
+WebSocket connections additionally register sessions (one per device or
+socket) kept alive by the client's ping frames. A user whose last session
+disconnects or stops sending heartbeats for PRESENCE_SESSION_TIMEOUT_SECONDS
+goes offline, and the change is broadcast to the user groups of their
+matches only.
+
+When the default cache is not Redis-backed (development, tests), an
+in-process registry with the same semantics is used instead.
+"""
+import logging
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Set
+
+from django.conf import settings
+
+from hivmeet_backend.shared_store import SharedBackend
+
+logger = logging.getLogger('hivmeet.auth')
+
+PRESENCE_KEY = 'presence:online'
+SESSIONS_KEY = 'presence:sessions'
+USER_SESSIONS_KEY_PREFIX = 'presence:sessions:'
+
+
+class _LocalPresenceBackend:
+    """
+    In-process sorted set used when Redis is not configured.
+    """
+
+    def __init__(self):
+        self._scores = {}
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def touch(self, member: str, score: float):
+        with self._lock:
+            self._scores[member] = score
+
+    def remove(self, member: str):
+        with self._lock:
+            self._scores.pop(member, None)
+
+    def scores(self, members: List[str]) -> List[Optional[float]]:
+        with self._lock:
+            return [self._scores.get(member) for member in members]
+
+    def members_since(self, min_score: float) -> List[str]:
+        with self._lock:
+            return [member for member, score in self._scores.items() if score >= min_score]
+
+    def prune(self, max_score: float):
+        with self._lock:
+            self._scores = {m: s for m, s in self._scores.items() if s >= max_score}
+
+    def touch_session(self, user: str, session: str, score: float, min_score: float) -> int:
+        with self._lock:
+            sessions = self._sessions.setdefault(user, {})
+            live_before = sum(1 for sid, s in sessions.items() if s >= min_score and sid != session)
+            sessions[session] = score
+            return live_before
+
+    def remove_session(self, user: str, session: str, min_score: float) -> int:
+        with self._lock:
+            sessions = self._sessions.get(user, {})
+            sessions.pop(session, None)
+            live = sum(1 for s in sessions.values() if s >= min_score)
+            if not sessions:
+                self._sessions.pop(user, None)
+            return live
+
+    def expire_sessions(self, max_score: float) -> Set[str]:
+        """Drop sessions older than max_score; returns users left without live sessions."""
+        offline = set()
+        with self._lock:
+            for user, sessions in list(self._sessions.items()):
+                expired = [sid for sid, s in sessions.items() if s < max_score]
+                if not expired:
+                    continue
+                for sid in expired:
+                    del sessions[sid]
+                if not sessions:
+                    del self._sessions[user]
+                    offline.add(user)
+        return offline
+
+    def clear(self):
+        with self._lock:
+            self._scores = {}
+            self._sessions = {}
+
+
+class _RedisPresenceBackend:
+    """
+    Redis sorted set backend (member = user id, score = last heartbeat).
+    """
+
+    def __init__(self, client):
+        self.client = client
+
+    def touch(self, member: str, score: float):
+        self.client.zadd(PRESENCE_KEY, {member: score})
+
+    def remove(self, member: str):
+        self.client.zrem(PRESENCE_KEY, member)
+
+    def scores(self, members: List[str]) -> List[Optional[float]]:
+        pipe = self.client.pipeline(transaction=False)
+        for member in members:
+            pipe.zscore(PRESENCE_KEY, member)
+        return pipe.execute()
+
+    def members_since(self, min_score: float) -> List[str]:
+        return [
+            member.decode() if isinstance(member, bytes) else member
+            for member in self.client.zrangebyscore(PRESENCE_KEY, min_score, '+inf')
+        ]
+
+    def prune(self, max_score: float):
+        self.client.zremrangebyscore(PRESENCE_KEY, '-inf', f'({max_score}')
+
+    def touch_session(self, user: str, session: str, score: float, min_score: float) -> int:
+        user_key = f'{USER_SESSIONS_KEY_PREFIX}{user}'
+        pipe = self.client.pipeline()
+        pipe.zcount(user_key, min_score, '+inf')
+        pipe.zscore(user_key, session)
+        pipe.zadd(user_key, {session: score})
+        pipe.zadd(SESSIONS_KEY, {f'{user}:{session}': score})
+        live, previous, _, _ = pipe.execute()
+        if previous is not None and float(previous) >= min_score:
+            live -= 1
+        return live
+
+    def remove_session(self, user: str, session: str, min_score: float) -> int:
+        user_key = f'{USER_SESSIONS_KEY_PREFIX}{user}'
+        pipe = self.client.pipeline()
+        pipe.zrem(user_key, session)
+        pipe.zrem(SESSIONS_KEY, f'{user}:{session}')
+        pipe.zcount(user_key, min_score, '+inf')
+        return pipe.execute()[-1]
+
+    def expire_sessions(self, max_score: float) -> Set[str]:
+        """Drop sessions older than max_score; returns users left without live sessions."""
+        expired = self.client.zrangebyscore(SESSIONS_KEY, '-inf', f'({max_score}')
+        if not expired:
+            return set()
+        pipe = self.client.pipeline()
+        users = set()
+        for member in expired:
+            member = member.decode() if isinstance(member, bytes) else member
+            user, session = member.split(':', 1)
+            users.add(user)
+            pipe.zrem(SESSIONS_KEY, member)
+            pipe.zrem(f'{USER_SESSIONS_KEY_PREFIX}{user}', session)
+        pipe.execute()
+
+        users = sorted(users)
+        pipe = self.client.pipeline(transaction=False)
+        for user in users:
+            pipe.zcard(f'{USER_SESSIONS_KEY_PREFIX}{user}')
+        return {user for user, count in zip(users, pipe.execute()) if not count}
+
+    def clear(self):
+        self.client.delete(PRESENCE_KEY, SESSIONS_KEY)
+
+
+_backend = SharedBackend('presence', _RedisPresenceBackend, _LocalPresenceBackend)
+_last_prune = 0.0
+
+
+def _get_backend():
+    return _backend.get()
+
+
+class PresenceService:
+    """
+    Service for tracking which users are currently online.
+    """
+
+    @staticmethod
+    def get_online_window() -> int:
+        """Seconds since the last heartbeat during which a user counts as online."""
+        return getattr(settings, 'PRESENCE_ONLINE_WINDOW_SECONDS', 300)
+
+    @staticmethod
+    def touch(user_id, at=None):
+        """
+        Record a heartbeat for a user.
+        `at` is an optional datetime, defaults to now.
+        """
+        global _last_prune
+        score = at.timestamp() if at is not None else time.time()
+        try:
+            backend = _get_backend()
+            backend.touch(str(user_id), score)
+
+            # Drop stale members at most once per window per process
+            now = time.time()
+            window = PresenceService.get_online_window()
+            if now - _last_prune > window:
+                _last_prune = now
+                backend.prune(now - window)
+        except Exception as e:
+            logger.warning(f"Error recording presence for {user_id}: {str(e)}")
+
+    @staticmethod
+    def remove(user_id):
+        """Mark a user offline immediately."""
+        try:
+            _get_backend().remove(str(user_id))
+        except Exception as e:
+            logger.warning(f"Error removing presence for {user_id}: {str(e)}")
+
+    @staticmethod
+    def get_online_user_ids() -> Set[str]:
+        """Get IDs (as strings) of every user with a heartbeat inside the online window."""
+        try:
+            min_score = time.time() - PresenceService.get_online_window()
+            return set(_get_backend().members_since(min_score))
+        except Exception as e:
+            logger.warning(f"Error reading online users: {str(e)}")
+            return set()
+
+    @staticmethod
+    def get_online_status(user_ids: Iterable) -> Dict[str, bool]:
+        """
+        Bulk online lookup.
+        Returns a dict mapping str(user_id) -> is_online.
+        """
+        members = [str(user_id) for user_id in user_ids]
+        if not members:
+            return {}
+        try:
+            min_score = time.time() - PresenceService.get_online_window()
+            scores = _get_backend().scores(members)
+        except Exception as e:
+            logger.warning(f"Error reading presence: {str(e)}")
+            return {member: False for member in members}
+        return {
+            member: score is not None and float(score) >= min_score
+            for member, score in zip(members, scores)
+        }
+
+    @staticmethod
+    def is_online(user_id) -> bool:
+        """Check if a single user is online."""
+        return PresenceService.get_online_status([user_id]).get(str(user_id), False)
+
+    @staticmethod
+    def get_session_timeout() -> int:
+        """Seconds without heartbeat after which a WebSocket session is dropped."""
+        return getattr(settings, 'PRESENCE_SESSION_TIMEOUT_SECONDS', 60)
+
+    @staticmethod
+    def heartbeat(user_id, session_id) -> bool:
+        """
+        Register or refresh a WebSocket session (connect and ping frames).
+        Returns True if the user just came online, i.e. had no other live session.
+        """
+        PresenceService.touch(user_id)
+        now = time.time()
+        try:
+            live_before = _get_backend().touch_session(
+                str(user_id), str(session_id), now, now - PresenceService.get_session_timeout()
+            )
+        except Exception as e:
+            logger.warning(f"Error recording presence session for {user_id}: {str(e)}")
+            return False
+        return live_before == 0
+
+    @staticmethod
+    def disconnect(user_id, session_id) -> bool:
+        """
+        Drop a WebSocket session.
+        Returns True if it was the user's last live session (user went offline).
+        """
+        try:
+            live = _get_backend().remove_session(
+                str(user_id), str(session_id), time.time() - PresenceService.get_session_timeout()
+            )
+        except Exception as e:
+            logger.warning(f"Error removing presence session for {user_id}: {str(e)}")
+            return False
+        if live:
+            return False
+        PresenceService.remove(user_id)
+        return True
+
+    @staticmethod
+    def expire_sessions() -> List[str]:
+        """
+        Drop sessions whose heartbeats stopped (crashed clients).
+        Returns IDs of users who went offline as a result.
+        """
+        try:
+            offline = _get_backend().expire_sessions(time.time() - PresenceService.get_session_timeout())
+        except Exception as e:
+            logger.warning(f"Error expiring presence sessions: {str(e)}")
+            return []
+        for user_id in offline:
+            PresenceService.remove(user_id)
+        return sorted(offline)
+
+    @staticmethod
+    def broadcast_change(user_id, status: str) -> int:
+        """
+        Send a presence_update to each active match of the user, on the
+        match partner's user group. Returns the number of matches notified.
+        """
+        from asgiref.sync import async_to_sync
+        from channels.layers import get_channel_layer
+        from django.db.models import Q
+        from django.utils import timezone
+        from matching.models import Match
+
+        try:
+            channel_layer = get_channel_layer()
+        except Exception as e:
+            logger.warning(f"Redis non disponible (Channel Layer): {str(e)}")
+            return 0
+        if channel_layer is None:
+            return 0
+
+        partners = list(
+            Match.objects.filter(
+                Q(user1_id=user_id) | Q(user2_id=user_id), status=Match.ACTIVE
+            ).values_list('id', 'user1_id', 'user2_id')
+        )
+        if not partners:
+            return 0
+
+        timestamp = timezone.now().isoformat()
+
+        async def send_all():
+            for match_id, user1_id, user2_id in partners:
+                partner_id = user2_id if str(user1_id) == str(user_id) else user1_id
+                await channel_layer.group_send(f'user_{partner_id}', {
+                    'type': 'presence_update',
+                    'conversation_id': str(match_id),
+                    'user_id': str(user_id),
+                    'status': status,
+                    'timestamp': timestamp,
+                })
+
+        try:
+            async_to_sync(send_all)()
+        except Exception as e:
+            logger.warning(f"Error broadcasting presence for {user_id}: {str(e)}")
+            return 0
+        return len(partners)
+
+    @staticmethod
+    def clear():
+        """Remove every entry from the registry."""
+        _get_backend().clear()
@@ -0,0 +1,142 @@
+"""
+Push notification transports for HIVMeet.
+
+The transport used by NotificationDispatcher is configured with
+settings.PUSH_NOTIFICATION_TRANSPORT (dotted path). FCMTransport sends via
+Firebase Cloud Messaging; FakePushTransport records pushes in memory for
+tests and local development.
+"""
+import logging
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger('hivmeet.auth')
+
+
+@dataclass
+class PushMessage:
+    """A single push, addressed to every token of one recipient."""
+    tokens: List[str]
+    title: str
+    body: str
+    data: Dict[str, str] = field(default_factory=dict)
+    image: Optional[str] = None
+    high_priority: bool = False
+
+
+@dataclass
+class PushResult:
+    """Outcome of a send: counts plus tokens the provider reported as invalid."""
+    success_count: int = 0
+    failure_count: int = 0
+    invalid_tokens: List[str] = field(default_factory=list)
+
+
+class BasePushTransport:
+    """
+    Interface for push transports.
+    """
+
+    def send(self, message: PushMessage) -> PushResult:
+        raise NotImplementedError
+
+
+class FCMTransport(BasePushTransport):
+    """
+    Firebase Cloud Messaging transport (one multicast per message).
+    """
+
+    # Error codes meaning the token will never work again. INVALID_ARGUMENT
+    # is not one: FCM also returns it for a malformed message (e.g. an
+    # oversized data field), which says nothing about the tokens.
+    INVALID_TOKEN_CODES = {'NOT_FOUND', 'UNREGISTERED', 'registration-token-not-registered'}
+
+    def send(self, message: PushMessage) -> PushResult:
+        from firebase_admin import messaging
+
+        kwargs = {}
+        if message.high_priority:
+            kwargs['android'] = messaging.AndroidConfig(
+                priority='high',
+                ttl=30  # 30 seconds TTL for call notifications
+            )
+            kwargs['apns'] = messaging.APNSConfig(
+                payload=messaging.APNSPayload(
+                    aps=messaging.Aps(
+                        content_available=True,
+                        sound='ringtone.caf'
+                    )
+                )
+            )
+
+        multicast = messaging.MulticastMessage(
+            notification=messaging.Notification(
+                title=message.title,
+                body=message.body,
+                image=message.image,
+            ),
+            data={**message.data, 'click_action': 'FLUTTER_NOTIFICATION_CLICK'},
+            tokens=message.tokens,
+            **kwargs
+        )
+        response = messaging.send_multicast(multicast)
+
+        result = PushResult(
+            success_count=getattr(response, 'success_count', 0),
+            failure_count=getattr(response, 'failure_count', 0),
+        )
+        responses = getattr(response, 'responses', None)
+        if isinstance(responses, (list, tuple)):
+            for token, send_response in zip(message.tokens, responses):
+                if send_response.success:
+                    continue
+                if self._is_invalid_token_error(send_response.exception):
+                    result.invalid_tokens.append(token)
+                else:
+                    logger.warning(f"FCM send failed: {send_response.exception}")
+        return result
+
+    def _is_invalid_token_error(self, exception) -> bool:
+        from firebase_admin import messaging
+
+        if isinstance(exception, (messaging.UnregisteredError, messaging.SenderIdMismatchError)):
+            return True
+        return getattr(exception, 'code', None) in self.INVALID_TOKEN_CODES
+
+
+class FakePushTransport(BasePushTransport):
+    """
+    In-memory transport for tests.
+    Sent messages are appended to `outbox`; tokens listed in
+    `invalid_tokens` are reported back as invalid.
+    """
+
+    outbox: List[PushMessage] = []
+    invalid_tokens: set = set()
+
+    def send(self, message: PushMessage) -> PushResult:
+        FakePushTransport.outbox.append(message)
+        invalid = [token for token in message.tokens if token in FakePushTransport.invalid_tokens]
+        return PushResult(
+            success_count=len(message.tokens) - len(invalid),
+            failure_count=len(invalid),
+            invalid_tokens=invalid,
+        )
+
+    @classmethod
+    def reset(cls):
+        cls.outbox = []
+        cls.invalid_tokens = set()
+
+
+def get_push_transport() -> BasePushTransport:
+    """Instantiate the configured transport."""
+    path = getattr(
+        settings,
+        'PUSH_NOTIFICATION_TRANSPORT',
+        'authentication.push_transports.FCMTransport',
+    )
+    return import_string(path)()
@@ -0,0 +1,54 @@
+"""
+Periodic tasks for authentication app.
+"""
+import logging
+from celery import shared_task
+
+from .activity_service import ActivityService
+
+logger = logging.getLogger('hivmeet.auth')
+
+
+@shared_task
+def flush_last_active():
+    """
+    Persist buffered activity timestamps to users.last_active.
+    Runs every minute.
+    """
+    try:
+        return ActivityService.flush()
+    except Exception as e:
+        logger.error(f"Error flushing last_active: {str(e)}")
+        return 0
+
+
+@shared_task
+def flush_push_notifications(recipient_id):
+    """
+    Send the buffered push notifications of one recipient.
+    Scheduled by NotificationDispatcher.enqueue at the end of the window.
+    """
+    from .notification_service import NotificationDispatcher
+    try:
+        return NotificationDispatcher.flush([recipient_id])
+    except Exception as e:
+        logger.error(f"Error flushing push notifications for {recipient_id}: {str(e)}")
+        return 0
+
+
+@shared_task
+def expire_presence_sessions():
+    """
+    Drop WebSocket presence sessions without recent heartbeats and tell
+    the matches of users who went offline.
+    Runs every 30 seconds.
+    """
+    from .presence_service import PresenceService
+    try:
+        offline = PresenceService.expire_sessions()
+        for user_id in offline:
+            PresenceService.broadcast_change(user_id, 'offline')
+        return len(offline)
+    except Exception as e:
+        logger.error(f"Error expiring presence sessions: {str(e)}")
+        return 0
@@ -1,3 +1,202 @@
-from django.test import TestCase
+import time
+from datetime import date, timedelta
+from unittest.mock import Mock, patch
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from authentication import notification_service
+from authentication.activity_service import ActivityService
+from authentication.notification_service import NotificationDispatcher
+from authentication.presence_service import PresenceService
+from authentication.push_transports import FakePushTransport, FCMTransport, PushMessage
+from authentication.tasks import flush_last_active
+
+
+User = get_user_model()
+
+
+class ActivityServiceTests(TestCase):
+    def setUp(self):
+        ActivityService.flush()
+        self.user = User.objects.create_user(
+            email="activity@test.com",
+            password="testpass123",
+            display_name="Activity",
+            birth_date=date(1990, 1, 1),
+        )
+        self.stale = timezone.now() - timedelta(days=1)
+        User.objects.filter(pk=self.user.pk).update(last_active=self.stale)
+        self.user.refresh_from_db()
+
+    def test_update_last_active_is_written_through_without_redis(self):
+        with self.assertNumQueries(1):
+            self.user.update_last_active()
+        self.user.refresh_from_db()
+        self.assertGreater(self.user.last_active, self.stale)
+        self.assertEqual(self.user.last_active.timestamp() % ActivityService.get_granularity(), 0)
+
+        # Same interval: nothing to write for an up-to-date instance, and the
+        # guarded UPDATE matches no row for a stale one
+        written = self.user.last_active
+        with self.assertNumQueries(0):
+            self.user.update_last_active()
+        ActivityService.record(self.user.id)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.last_active, written)
+
+        # Nothing buffered
+        self.assertEqual(flush_last_active(), 0)
+
+    def test_record_never_moves_last_active_backwards(self):
+        ActivityService.record(self.user.id, at=self.stale - timedelta(hours=1))
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.last_active, self.stale)
+
+    def test_flush_persists_buffer_without_moving_backwards(self):
+        other = User.objects.create_user(
+            email="activity.other@test.com",
+            password="testpass123",
+            display_name="Other",
+            birth_date=date(1990, 1, 1),
+        )
+        User.objects.filter(pk=other.pk).update(last_active=self.stale)
+        buffered = {
+            str(self.user.id): int(timezone.now().timestamp()),
+            str(other.id): int((self.stale - timedelta(hours=1)).timestamp()),
+        }
+        backend = Mock(**{'drain.return_value': buffered})
+
+        with patch('authentication.activity_service._get_backend', return_value=backend):
+            self.assertEqual(ActivityService.flush(), 1)
+
+        self.user.refresh_from_db()
+        other.refresh_from_db()
+        self.assertGreater(self.user.last_active, self.stale)
+        self.assertEqual(other.last_active, self.stale)
+
+
+@override_settings(PUSH_NOTIFICATION_TRANSPORT='authentication.push_transports.FakePushTransport')
+class NotificationDispatcherTests(TestCase):
+    def setUp(self):
+        FakePushTransport.reset()
+        self.recipient = User.objects.create_user(
+            email="push.recipient@test.com",
+            password="testpass123",
+            display_name="Recipient",
+            birth_date=date(1990, 1, 1),
+        )
+        self.recipient.fcm_tokens = [{'token': 'good-token'}, {'token': 'stale-token'}]
+        self.recipient.is_premium = True
+        self.recipient.save(update_fields=['fcm_tokens', 'is_premium'])
+        self.likers = [
+            User.objects.create_user(
+                email=f"push.liker{i}@test.com",
+                password="testpass123",
+                display_name=f"Liker {i}",
+                birth_date=date(1990, 1, 1),
+            )
+            for i in range(3)
+        ]
+        NotificationDispatcher.flush([self.recipient.id])
+        FakePushTransport.reset()
+
+    def test_events_in_window_are_collapsed_into_one_push(self):
+        # The in-process buffer stands in for Redis: this test is one process
+        with patch.object(notification_service._backend, 'is_shared', True), patch(
+            'authentication.tasks.flush_push_notifications.apply_async'
+        ) as mocked_schedule:
+            for liker in self.likers:
+                NotificationDispatcher.enqueue(self.recipient.id, notification_service.LIKE, actor_id=liker.id)
+
+        # Only the first event of the window schedules a flush
+        mocked_schedule.assert_called_once()
+        self.assertEqual(FakePushTransport.outbox, [])
+
+        self.assertEqual(NotificationDispatcher.flush([self.recipient.id]), 1)
+
+        self.assertEqual(len(FakePushTransport.outbox), 1)
+        push = FakePushTransport.outbox[0]
+        self.assertIn('3', push.body)
+        self.assertEqual(push.data['notification_type'], 'PROFILE_LIKED')
+        self.assertEqual(push.data['count'], '3')
+
+        # Buffer is empty afterwards
+        self.assertEqual(NotificationDispatcher.flush([self.recipient.id]), 0)
+
+    def test_events_are_sent_right_away_without_shared_buffer(self):
+        with patch('authentication.tasks.flush_push_notifications.apply_async') as mocked_schedule:
+            NotificationDispatcher.enqueue(self.recipient.id, notification_service.LIKE, actor_id=self.likers[0].id)
+
+        mocked_schedule.assert_not_called()
+        self.assertEqual(len(FakePushTransport.outbox), 1)
+        self.assertEqual(NotificationDispatcher.flush([self.recipient.id]), 0)
+
+    def test_invalid_tokens_are_pruned_after_send(self):
+        FakePushTransport.invalid_tokens = {'stale-token'}
+
+        NotificationDispatcher.send_now(
+            self.recipient.id, notification_service.CALL, actor_id=self.likers[0].id,
+            data={'call_type': 'audio', 'match_id': 'match-1'},
+        )
+
+        self.assertEqual(len(FakePushTransport.outbox), 1)
+        self.assertTrue(FakePushTransport.outbox[0].high_priority)
+        self.recipient.refresh_from_db()
+        self.assertEqual([t['token'] for t in self.recipient.fcm_tokens], ['good-token'])
+
+    def test_fcm_prunes_only_unregistered_tokens(self):
+        from firebase_admin import exceptions, messaging
+
+        responses = [
+            Mock(success=False, exception=messaging.UnregisteredError('gone')),
+            Mock(success=False, exception=messaging.SenderIdMismatchError('other project')),
+            Mock(success=False, exception=exceptions.InvalidArgumentError('data too large')),
+            Mock(success=True, exception=None),
+        ]
+        push = PushMessage(tokens=['gone', 'mismatch', 'valid-1', 'valid-2'], title='t', body='b')
+        with patch('firebase_admin.messaging.send_multicast') as mock_send:
+            mock_send.return_value = Mock(success_count=1, failure_count=3, responses=responses)
+            result = FCMTransport().send(push)
+
+        self.assertEqual(result.invalid_tokens, ['gone', 'mismatch'])
+
+    def test_disabled_notification_settings_skip_push(self):
+        self.recipient.notification_settings = {'new_message_notifications': False}
+        self.recipient.save(update_fields=['notification_settings'])
+
+        with override_settings(PUSH_NOTIFICATION_WINDOW_SECONDS=0):
+            NotificationDispatcher.enqueue(
+                self.recipient.id, notification_service.MESSAGE, actor_id=self.likers[0].id,
+                data={'conversation_id': 'c1', 'message_preview': 'Hi'},
+            )
+
+        self.assertEqual(FakePushTransport.outbox, [])
+
+
+class PresenceSessionTests(TestCase):
+    def setUp(self):
+        PresenceService.clear()
+
+    def test_user_goes_offline_with_last_session(self):
+        self.assertTrue(PresenceService.heartbeat("user-1", "phone"))
+        self.assertFalse(PresenceService.heartbeat("user-1", "laptop"))
+        self.assertFalse(PresenceService.heartbeat("user-1", "phone"))
+        self.assertTrue(PresenceService.is_online("user-1"))
+
+        self.assertFalse(PresenceService.disconnect("user-1", "phone"))
+        self.assertTrue(PresenceService.is_online("user-1"))
+        self.assertTrue(PresenceService.disconnect("user-1", "laptop"))
+        self.assertFalse(PresenceService.is_online("user-1"))
+
+    def test_sessions_without_heartbeat_expire(self):
+        PresenceService.heartbeat("user-1", "phone")
+        PresenceService.heartbeat("user-2", "phone")
+
+        with patch("authentication.presence_service.time.time", return_value=time.time() + 120):
+            PresenceService.heartbeat("user-2", "laptop")
+            self.assertEqual(PresenceService.expire_sessions(), ["user-1"])
+
+        self.assertFalse(PresenceService.is_online("user-1"))
+        self.assertTrue(PresenceService.is_online("user-2"))
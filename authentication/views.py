@@ -30,6 +30,7 @@ from .utils import (
     send_password_reset_email,
     send_welcome_email
 )
+from .ws_identity_service import WebSocketIdentityService
 
 import logging
 import secrets
@@ -521,6 +522,10 @@ def logout_view(request):
     """
     try:
         refresh_token = request.data.get('refresh_token')
+
+        # The access token can no longer open WebSockets
+        if request.auth is not None:
+            WebSocketIdentityService.revoke(request.auth)
         
         if refresh_token:
             # Blacklist the refresh token
@@ -0,0 +1,129 @@
+"""
+Cached identity of WebSocket connections.
+
+Connecting a socket authenticates its JWT, loads the user and checks the
+conversation against the user's matches. Clients reconnect all at once
+after a deploy or a network change, so the outcome is cached per access
+token (keyed by its jti) for CACHE_TTL['ws_identity'] seconds: the user and
+the conversations they may join, with the peer of each. A reconnect with
+the same token then costs one cache read and no query.
+
+Entries are dropped when access changes:
+- a match created or ended (unmatch, block) or a block added or removed
+  invalidates the users involved: their entries loaded before that moment
+  are ignored;
+- logout revokes the access token of the request for the rest of its
+  lifetime.
+A deactivated user is refused once their entry expires.
+"""
+import logging
+import time
+import uuid
+from typing import Iterable, Optional
+
+from django.core.cache import cache
+from django.db.models import Q
+
+from hivmeet_backend.optimizations import CACHE_TTL
+
+logger = logging.getLogger('hivmeet.auth')
+
+# Marks a token revoked by logout, in place of its identity
+REVOKED = 'revoked'
+
+
+def _identity_key(jti) -> str:
+    return f'ws_identity_{jti}'
+
+
+def _invalidated_key(user_id) -> str:
+    return f'ws_identity_invalidated_{user_id}'
+
+
+class WebSocketIdentityService:
+    """
+    Service for the identity cache of WebSocket connections.
+    """
+
+    @staticmethod
+    def get_cached(access_token) -> Optional[dict]:
+        """
+        Cached identity of a validated access token: {'user', 'conversations'
+        (conversation ID -> peer ID), 'loaded_at'}. None on a miss, or if the
+        token was revoked (see load).
+        """
+        jti = access_token.get('jti')
+        if not jti:
+            return None
+        identity_key = _identity_key(jti)
+        invalidated_key = _invalidated_key(access_token['user_id'])
+        values = cache.get_many([identity_key, invalidated_key])
+
+        identity = values.get(identity_key)
+        if not isinstance(identity, dict):
+            return None
+        if identity['loaded_at'] <= values.get(invalidated_key, 0):
+            return None
+        return identity
+
+    @staticmethod
+    def load(access_token) -> Optional[dict]:
+        """
+        Load the identity of a validated access token from the database and
+        cache it. Returns None if the token was revoked or its user is gone
+        or inactive.
+        """
+        from matching.models import Match
+        from .block_service import BlockService
+        from .models import User
+
+        jti = access_token.get('jti')
+        if jti and cache.get(_identity_key(jti)) == REVOKED:
+            return None
+
+        # Taken before reading, so an invalidation during the load wins
+        loaded_at = time.time()
+        user = User.objects.filter(id=access_token['user_id'], is_active=True).first()
+        if user is None:
+            return None
+
+        blocked_ids = BlockService.get_blocked_ids(user.id)
+        conversations = {}
+        for match_id, user1_id, user2_id in Match.objects.filter(
+            Q(user1_id=user.id) | Q(user2_id=user.id),
+            status=Match.ACTIVE,
+        ).values_list('id', 'user1_id', 'user2_id'):
+            peer_id = user2_id if user1_id == user.id else user1_id
+            if peer_id not in blocked_ids:
+                conversations[str(match_id)] = peer_id
+
+        identity = {'user': user, 'conversations': conversations, 'loaded_at': loaded_at}
+        if jti:
+            cache.set(_identity_key(jti), identity, CACHE_TTL['ws_identity'])
+        return identity
+
+    @staticmethod
+    def get_peer_id(identity: dict, conversation_id) -> Optional[uuid.UUID]:
+        """Peer of a conversation the identity may join, None if it may not."""
+        try:
+            conversation_id = str(uuid.UUID(str(conversation_id)))
+        except ValueError:
+            return None
+        return identity['conversations'].get(conversation_id)
+
+    @staticmethod
+    def invalidate(*user_ids: Iterable):
+        """Ignore the cached identities of users loaded until now."""
+        now = time.time()
+        cache.set_many({_invalidated_key(user_id): now for user_id in user_ids}, CACHE_TTL['ws_identity'])
+
+    @staticmethod
+    def revoke(access_token):
+        """Refuse an access token until it expires (logout)."""
+        jti = access_token.get('jti')
+        if not jti:
+            return
+        remaining = int(access_token.get('exp', 0) - time.time())
+        if remaining > 0:
+            cache.set(_identity_key(jti), REVOKED, remaining)
+            logger.info(f"WebSocket identity revoked for user {access_token.get('user_id')}")
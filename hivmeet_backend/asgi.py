@@ -21,10 +21,12 @@ os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'hivmeet_backend.settings')
 django.setup()
 
 # Import WebSocket consumers after Django setup
-from messaging.consumers import ConversationConsumer
+from messaging.consumers import ConversationConsumer, UserConsumer
 
 # WebSocket URL patterns
 websocket_urlpatterns = [
+    # One socket per user, conversations multiplexed with subscribe frames
+    path('ws/', UserConsumer.as_asgi()),
     path('ws/conversations/<uuid:conversation_id>/', ConversationConsumer.as_asgi()),
 ]
 
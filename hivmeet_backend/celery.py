@@ -5,6 +5,7 @@ File: hivmeet_backend/celery.py
 import os
 from celery import Celery
 from celery.schedules import crontab
+from django.conf import settings
 
 # Set the default Django settings module
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'hivmeet_backend.settings')
@@ -45,8 +46,37 @@ app.conf.beat_schedule = {
         'task': 'subscriptions.tasks.clean_old_webhook_events',
         'schedule': crontab(hour=2, minute=0, day_of_week=1),  # Weekly on Monday at 2 AM
     },
+    # Authentication tasks
+    'flush-last-active': {
+        'task': 'authentication.tasks.flush_last_active',
+        'schedule': crontab(minute='*'),  # Every minute
+    },
+    'expire-presence-sessions': {
+        'task': 'authentication.tasks.expire_presence_sessions',
+        'schedule': 30.0,  # Every 30 seconds
+    },
+    # Messaging tasks
+    'maintain-message-partitions': {
+        'task': 'messaging.tasks.maintain_message_partitions',
+        'schedule': crontab(hour=3, minute=0),  # Daily at 3 AM
+    },
+    'prune-sync-changes': {
+        'task': 'messaging.tasks.prune_sync_changes',
+        'schedule': crontab(hour=3, minute=30),  # Daily at 3:30 AM
+    },
 }
 
+
+@app.on_after_configure.connect
+def add_setting_schedules(sender, **kwargs):
+    """Beat entries whose interval is a Django setting, read once settings are loaded."""
+    # Matching tasks
+    sender.conf.beat_schedule['relay-outbox'] = {
+        'task': 'matching.tasks.relay_outbox',
+        'schedule': settings.OUTBOX_RELAY_INTERVAL_SECONDS,  # Every second by default
+    }
+
+
 # Debug task
 @app.task(bind=True)
 def debug_task(self):
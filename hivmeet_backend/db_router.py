@@ -0,0 +1,135 @@
+"""
+Primary/replica database routing for HIVMeet.
+
+Reads issued while serving an HTTP request go to one of the configured
+replicas (settings.DATABASE_REPLICAS). Everything else goes to the primary:
+writes, reads inside a transaction, reads after the request has written,
+and all code running outside a request (Celery tasks, management commands,
+WebSocket consumers).
+
+Read-your-writes: once a request writes, the user is pinned to the primary
+for DATABASE_PRIMARY_PIN_SECONDS. The pin is stored in the cache (keyed by
+user id) and in a cookie, so e.g. like-then-refresh reads consistent state.
+"""
+import contextvars
+import random
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+
+PRIMARY_DB = 'default'
+PIN_COOKIE_NAME = 'hivmeet_db_pin'
+
+# Per-request routing state, None outside of a request
+_request_state = contextvars.ContextVar('hivmeet_db_request_state', default=None)
+
+
+def _pin_cache_key(user_id) -> str:
+    return f'db_primary_pin_{user_id}'
+
+
+def get_pin_seconds() -> int:
+    return getattr(settings, 'DATABASE_PRIMARY_PIN_SECONDS', 10)
+
+
+def is_pinned_to_primary(user_id) -> bool:
+    """Check if a user recently wrote and must read from the primary."""
+    return bool(user_id) and bool(cache.get(_pin_cache_key(user_id)))
+
+
+def pin_to_primary(user_id):
+    """Pin a user to the primary for the read-your-writes window."""
+    if user_id:
+        cache.set(_pin_cache_key(user_id), True, get_pin_seconds())
+
+
+class PrimaryReplicaRouter:
+    """
+    Route request reads to replicas, everything else to the primary.
+    """
+
+    def _replicas(self):
+        return list(getattr(settings, 'DATABASE_REPLICAS', []))
+
+    def db_for_read(self, model, **hints):
+        state = _request_state.get()
+        replicas = self._replicas()
+        if state is None or not replicas:
+            return PRIMARY_DB
+        if state['pinned'] or state['wrote']:
+            return PRIMARY_DB
+        # Reads inside a transaction must see its own writes
+        if connections[PRIMARY_DB].in_atomic_block:
+            return PRIMARY_DB
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        state = _request_state.get()
+        if state is not None:
+            state['wrote'] = True
+        return PRIMARY_DB
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {PRIMARY_DB, *self._replicas()}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas are populated by replication, never migrated directly
+        if db in self._replicas():
+            return False
+        return None
+
+
+class ReplicaPinningMiddleware:
+    """
+    Set up per-request routing state and maintain read-your-writes pins.
+    Must run before any middleware that touches the database.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        user_id = self._get_user_id(request)
+        pinned = self._has_pin_cookie(request) or is_pinned_to_primary(user_id)
+        state = {'pinned': pinned, 'wrote': False}
+        token = _request_state.set(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            _request_state.reset(token)
+
+        if state['wrote']:
+            # request.user is set by now, including DRF token authentication
+            user = getattr(request, 'user', None)
+            if user is not None and user.is_authenticated:
+                user_id = user.id
+            pin_to_primary(user_id)
+            response.set_cookie(
+                PIN_COOKIE_NAME,
+                str(int(time.time()) + get_pin_seconds()),
+                max_age=get_pin_seconds(),
+                httponly=True,
+                samesite='Lax',
+            )
+        return response
+
+    def _has_pin_cookie(self, request) -> bool:
+        try:
+            return int(request.COOKIES.get(PIN_COOKIE_NAME, 0)) > time.time()
+        except (TypeError, ValueError):
+            return False
+
+    def _get_user_id(self, request):
+        """Resolve the user id from the JWT without touching the database."""
+        auth_header = request.META.get('HTTP_AUTHORIZATION', '')
+        if not auth_header.startswith('Bearer '):
+            return None
+        try:
+            from rest_framework_simplejwt.tokens import AccessToken
+            return AccessToken(auth_header.split(' ', 1)[1]).get('user_id')
+        except Exception:
+            return None
@@ -19,3 +19,23 @@ class PremiumStatusMiddleware:
         
         response = self.get_response(request)
         return response
+
+
+class PresenceMiddleware:
+    """
+    Record a presence heartbeat and buffered activity for every authenticated request.
+    Runs after the view so DRF token authentication has set request.user.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+
+        user = getattr(request, 'user', None)
+        if user is not None and user.is_authenticated:
+            from authentication.presence_service import PresenceService
+            PresenceService.touch(user.id)
+            user.update_last_active()
+
+        return response
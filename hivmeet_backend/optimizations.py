@@ -20,6 +20,8 @@ CACHE_TTL = {
     'match_count': 600,       # 10 minutes
     'resource_list': 3600,    # 1 hour
     'subscription_plans': 86400,  # 24 hours
+    'block_graph': 3600,      # 1 hour (invalidated on block/unblock)
+    'ws_identity': 30,        # 30 seconds (invalidated on unmatch, block, logout)
 }
 
 
@@ -72,6 +74,8 @@ class QueryOptimizations:
     @staticmethod
     def optimize_discovery_query(user, queryset):
         """Optimize discovery queries."""
+        from authentication.block_service import BlockService
+
         # Get user preferences
         profile = user.profile
         
@@ -83,7 +87,7 @@ class QueryOptimizations:
         ).exclude(
             user=user
         ).exclude(
-            user__in=user.blocked_users.all()
+            user_id__in=BlockService.get_blocked_ids(user.id)
         )
         
         # Apply preference filters
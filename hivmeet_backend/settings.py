@@ -65,6 +65,7 @@ AUTHENTICATION_BACKENDS = [
 FRONTEND_URL = config('FRONTEND_URL', default='http://localhost:3000')
 
 MIDDLEWARE = [
+    'hivmeet_backend.db_router.ReplicaPinningMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -74,6 +75,7 @@ MIDDLEWARE = [
     'hivmeet_backend.security.RateLimitMiddleware',  # Middleware de limitation de debit
     'subscriptions.middleware.PremiumRequiredMiddleware',
     'hivmeet_backend.middleware.PremiumStatusMiddleware',
+    'hivmeet_backend.middleware.PresenceMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'django.middleware.locale.LocaleMiddleware',
@@ -114,6 +116,17 @@ DATABASES = {
     )
 }
 
+# Read replicas: comma-separated URLs, exposed as aliases replica_1, replica_2, ...
+# Request reads go to a replica; users are pinned to the primary for a short window after writing
+DATABASE_REPLICAS = []
+for _index, _replica_url in enumerate(config('DATABASE_REPLICA_URLS', default='', cast=Csv()), start=1):
+    DATABASES[f'replica_{_index}'] = dj_database_url.parse(_replica_url)
+    DATABASES[f'replica_{_index}']['TEST'] = {'MIRROR': 'default'}
+    DATABASE_REPLICAS.append(f'replica_{_index}')
+
+DATABASE_ROUTERS = ['hivmeet_backend.db_router.PrimaryReplicaRouter']
+DATABASE_PRIMARY_PIN_SECONDS = config('DATABASE_PRIMARY_PIN_SECONDS', default=10, cast=int)
+
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -260,6 +273,9 @@ CELERY_ENABLE_UTC = True
 
 from celery.schedules import crontab
 
+# Outbox relay: seconds between runs (also read by hivmeet_backend/celery.py)
+OUTBOX_RELAY_INTERVAL_SECONDS = config('OUTBOX_RELAY_INTERVAL_SECONDS', default=1, cast=float)
+
 CELERY_BEAT_SCHEDULE = {
     'check-subscription-expirations': {
         'task': 'subscriptions.tasks.check_subscription_expirations',
@@ -285,8 +301,41 @@ CELERY_BEAT_SCHEDULE = {
         'task': 'subscriptions.tasks.clean_old_webhook_events',
         'schedule': crontab(hour=2, minute=0, day_of_week=1),  # Weekly on Monday at 2 AM
     },
+    'flush-last-active': {
+        'task': 'authentication.tasks.flush_last_active',
+        'schedule': crontab(minute='*'),  # Every minute
+    },
+    'expire-presence-sessions': {
+        'task': 'authentication.tasks.expire_presence_sessions',
+        'schedule': 30.0,  # Every 30 seconds
+    },
+    'relay-outbox': {
+        'task': 'matching.tasks.relay_outbox',
+        'schedule': timedelta(seconds=OUTBOX_RELAY_INTERVAL_SECONDS),
+    },
+    'maintain-message-partitions': {
+        'task': 'messaging.tasks.maintain_message_partitions',
+        'schedule': crontab(hour=3, minute=0),  # Daily at 3 AM
+    },
+    'prune-sync-changes': {
+        'task': 'messaging.tasks.prune_sync_changes',
+        'schedule': crontab(hour=3, minute=30),  # Daily at 3:30 AM
+    },
 }
 
+# Outbox relay: max events published per run
+OUTBOX_RELAY_BATCH_SIZE = config('OUTBOX_RELAY_BATCH_SIZE', default=200, cast=int)
+
+# Resolution of persisted users.last_active; writes are buffered and flushed in bulk
+LAST_ACTIVE_GRANULARITY_SECONDS = config('LAST_ACTIVE_GRANULARITY_SECONDS', default=60, cast=int)
+
+# Push notifications: events are buffered per recipient and collapsed before sending
+PUSH_NOTIFICATION_TRANSPORT = config(
+    'PUSH_NOTIFICATION_TRANSPORT',
+    default='authentication.push_transports.FCMTransport'
+)
+PUSH_NOTIFICATION_WINDOW_SECONDS = config('PUSH_NOTIFICATION_WINDOW_SECONDS', default=5, cast=int)
+
 # Firebase configuration
 
 # Configuration Firebase (restaurer chemin original)
@@ -336,6 +385,11 @@ else:
         }
     }
 
+# Presence: a user is online if they sent a heartbeat within this window
+PRESENCE_ONLINE_WINDOW_SECONDS = config('PRESENCE_ONLINE_WINDOW_SECONDS', default=300, cast=int)
+# WebSocket presence sessions without a ping for this long are dropped
+PRESENCE_SESSION_TIMEOUT_SECONDS = config('PRESENCE_SESSION_TIMEOUT_SECONDS', default=60, cast=int)
+
 # Django Channels configuration
 CHANNEL_LAYERS = {
     'default': {
@@ -355,6 +409,26 @@ CHANNEL_LAYERS_FALLBACK = {
     }
 }
 
+# WebSocket messages are written in batches of up to MAX_BATCH, or after MAX_DELAY_MS
+MESSAGE_WRITE_BUFFER_MAX_BATCH = config('MESSAGE_WRITE_BUFFER_MAX_BATCH', default=100, cast=int)
+MESSAGE_WRITE_BUFFER_MAX_DELAY_MS = config('MESSAGE_WRITE_BUFFER_MAX_DELAY_MS', default=5, cast=int)
+
+# Messages are partitioned by month; partitions older than ARCHIVE_AFTER_MONTHS
+# are exported to gzipped JSONL files under MESSAGE_ARCHIVE_DIR and dropped
+MESSAGE_PARTITION_MONTHS_AHEAD = config('MESSAGE_PARTITION_MONTHS_AHEAD', default=3, cast=int)
+MESSAGE_ARCHIVE_AFTER_MONTHS = config('MESSAGE_ARCHIVE_AFTER_MONTHS', default=12, cast=int)
+MESSAGE_ARCHIVE_DIR = config('MESSAGE_ARCHIVE_DIR', default=str(BASE_DIR / 'archive' / 'messages'))
+
+# Storage class of message media; the default stores under MEDIA_ROOT, set
+# e.g. storages.backends.gcloud.GoogleCloudStorage (django-storages) for cloud storage
+MESSAGE_MEDIA_STORAGE = config('MESSAGE_MEDIA_STORAGE', default='django.core.files.storage.FileSystemStorage')
+
+# Delta sync: changes are kept SYNC_CHANGE_RETENTION_DAYS (older cursors get a
+# full resync); changes younger than SYNC_SETTLE_SECONDS are sent again on the
+# next sync, as transactions still in flight may commit lower sequence numbers
+SYNC_CHANGE_RETENTION_DAYS = config('SYNC_CHANGE_RETENTION_DAYS', default=30, cast=int)
+SYNC_SETTLE_SECONDS = config('SYNC_SETTLE_SECONDS', default=5, cast=int)
+
 # Session configuration
 SESSION_ENGINE = 'django.contrib.sessions.backends.db'
 
@@ -0,0 +1,64 @@
+"""
+Backends of services whose state must be shared between processes (web
+workers, Celery workers): activity buffer, push notification buffer,
+presence registry.
+
+They use the Redis connection of the default cache when it is
+django_redis. Otherwise (development, tests, or Redis unreachable at
+startup) each service gets its local backend, whose state is only seen by
+the current process; services check `is_shared` where that matters.
+"""
+import logging
+import threading
+from typing import Callable
+
+from django.conf import settings
+
+logger = logging.getLogger('hivmeet')
+
+
+def get_redis_client(purpose: str):
+    """Redis client of the default cache, None if the cache is not Redis."""
+    cache_backend = settings.CACHES.get('default', {}).get('BACKEND', '')
+    if not cache_backend.startswith('django_redis'):
+        return None
+    try:
+        from django_redis import get_redis_connection
+        return get_redis_connection('default')
+    except Exception as e:
+        logger.warning(f"Redis non disponible ({purpose}): {str(e)}")
+        return None
+
+
+class SharedBackend:
+    """
+    Backend of a service, built on first use: `redis_factory(client)` when
+    Redis is available, else `local_factory()`.
+    """
+
+    def __init__(self, purpose: str, redis_factory: Callable, local_factory: Callable):
+        self.purpose = purpose
+        self.redis_factory = redis_factory
+        self.local_factory = local_factory
+        self.is_shared = False
+        self._backend = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        if self._backend is None:
+            with self._lock:
+                if self._backend is None:
+                    self._backend = self._build()
+        return self._backend
+
+    def _build(self):
+        client = get_redis_client(self.purpose)
+        if client is None:
+            return self.local_factory()
+        self.is_shared = True
+        return self.redis_factory(client)
+
+    def shared(self) -> bool:
+        """True if the backend state is seen by every process."""
+        self.get()
+        return self.is_shared
@@ -4,7 +4,7 @@ Admin configuration for matching app.
 from django.contrib import admin
 from django.utils.html import format_html
 from django.utils.translation import gettext_lazy as _
-from .models import Like, Dislike, Match, ProfileView, Boost, DailyLikeLimit
+from .models import Like, Dislike, Match, ProfileView, Boost, DailyLikeLimit, OutboxEvent
 
 
 @admin.register(Like)
@@ -72,4 +72,10 @@ class DailyLikeLimitAdmin(admin.ModelAdmin):
     list_display = ['user', 'date', 'likes_count', 'super_likes_count', 'rewinds_count']
     list_filter = ['date']
     search_fields = ['user__email']
-    date_hierarchy = 'date'
\ No newline at end of file
+    date_hierarchy = 'date'
+
+@admin.register(OutboxEvent)
+class OutboxEventAdmin(admin.ModelAdmin):
+    list_display = ['id', 'kind', 'attempts', 'created_at']
+    list_filter = ['kind']
+    readonly_fields = ['kind', 'payload', 'attempts', 'last_error', 'created_at']
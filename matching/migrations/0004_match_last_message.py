@@ -0,0 +1,38 @@
+"""
+Add Match.last_message so the conversation list does not look up the
+latest message of every conversation, and backfill it.
+"""
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def backfill_last_message(apps, schema_editor):
+    """Point every match with messages at its latest one."""
+    Match = apps.get_model('matching', 'Match')
+    Message = apps.get_model('messaging', 'Message')
+    latest = Message.objects.filter(match=models.OuterRef('pk')).order_by('-created_at', '-id').values('pk')[:1]
+    Match.objects.filter(last_message__isnull=True).update(last_message=models.Subquery(latest))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('matching', '0003_outboxevent'),
+        ('messaging', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='match',
+            name='last_message',
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name='+',
+                to='messaging.message',
+                verbose_name='Last message',
+            ),
+        ),
+        migrations.RunPython(backfill_last_message, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,68 @@
+"""
+Add per-participant read watermarks to Match, backfilled from the latest
+message each participant received with status read.
+"""
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def backfill_read_watermarks(apps, schema_editor):
+    """Point each watermark at the latest read message received by that user."""
+    Match = apps.get_model('matching', 'Match')
+    Message = apps.get_model('messaging', 'Message')
+    for reader, sender in (('user1', 'user2'), ('user2', 'user1')):
+        latest_read = Message.objects.filter(
+            match=models.OuterRef('pk'),
+            sender=models.OuterRef(f'{sender}_id'),
+            status='read',
+        ).order_by('-created_at', '-id')
+        Match.objects.update(**{
+            f'{reader}_last_read_message': models.Subquery(latest_read.values('pk')[:1]),
+            f'{reader}_last_read_at': models.Subquery(latest_read.values('read_at')[:1]),
+        })
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('matching', '0004_match_last_message'),
+        ('messaging', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='match',
+            name='user1_last_read_message',
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name='+',
+                to='messaging.message',
+                verbose_name='User 1 last read message',
+            ),
+        ),
+        migrations.AddField(
+            model_name='match',
+            name='user1_last_read_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='User 1 last read at'),
+        ),
+        migrations.AddField(
+            model_name='match',
+            name='user2_last_read_message',
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name='+',
+                to='messaging.message',
+                verbose_name='User 2 last read message',
+            ),
+        ),
+        migrations.AddField(
+            model_name='match',
+            name='user2_last_read_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='User 2 last read at'),
+        ),
+        migrations.RunPython(backfill_read_watermarks, migrations.RunPython.noop),
+    ]
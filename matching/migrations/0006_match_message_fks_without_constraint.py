@@ -0,0 +1,55 @@
+"""
+Drop the database constraints of Match FKs to messages, which cannot
+reference a partitioned table (see messaging 0003).
+"""
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('matching', '0005_match_read_watermarks'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='match',
+            name='last_message',
+            field=models.ForeignKey(
+                blank=True,
+                db_constraint=False,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name='+',
+                to='messaging.message',
+                verbose_name='Last message',
+            ),
+        ),
+        migrations.AlterField(
+            model_name='match',
+            name='user1_last_read_message',
+            field=models.ForeignKey(
+                blank=True,
+                db_constraint=False,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name='+',
+                to='messaging.message',
+                verbose_name='User 1 last read message',
+            ),
+        ),
+        migrations.AlterField(
+            model_name='match',
+            name='user2_last_read_message',
+            field=models.ForeignKey(
+                blank=True,
+                db_constraint=False,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name='+',
+                to='messaging.message',
+                verbose_name='User 2 last read message',
+            ),
+        ),
+    ]
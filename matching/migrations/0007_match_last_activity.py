@@ -0,0 +1,39 @@
+# Generated by Django 4.2.7 on 2026-10-18 23:41
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('matching', '0006_match_message_fks_without_constraint'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='match',
+            name='matches_user1_i_5acf57_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='match',
+            name='matches_user2_i_727ce0_idx',
+        ),
+        migrations.AddField(
+            model_name='match',
+            name='last_activity_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, verbose_name='Last activity at'),
+        ),
+        migrations.RunSQL(
+            "UPDATE matches SET last_activity_at = COALESCE(last_message_at, created_at)",
+            migrations.RunSQL.noop,
+        ),
+        migrations.AddIndex(
+            model_name='match',
+            index=models.Index(fields=['user1', 'status', '-last_activity_at', '-id'], name='matches_user1_i_02ef24_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='match',
+            index=models.Index(fields=['user2', 'status', '-last_activity_at', '-id'], name='matches_user2_i_c8478b_idx'),
+        ),
+    ]
@@ -1,11 +1,12 @@
 """
 Matching models for HIVMeet.
 """
-from django.db import models
+from django.db import models, transaction
+from django.db.models.functions import Greatest
 from django.contrib.auth import get_user_model
 from django.utils.translation import gettext_lazy as _
 from django.utils import timezone
-from django.db.models import Q
+from django.db.models import F, Q
 import uuid
 from datetime import timedelta
 
@@ -181,12 +182,62 @@ class Match(models.Model):
         verbose_name=_('Last message at')
     )
     
+    # Sort key of the conversation list: last message, else match creation
+    last_activity_at = models.DateTimeField(
+        default=timezone.now,
+        verbose_name=_('Last activity at')
+    )
+    
     last_message_preview = models.CharField(
         max_length=100,
         blank=True,
         verbose_name=_('Last message preview')
     )
     
+    # Messages are partitioned by month, so no database constraint on message FKs
+    last_message = models.ForeignKey(
+        'messaging.Message',
+        null=True,
+        blank=True,
+        on_delete=models.SET_NULL,
+        related_name='+',
+        db_constraint=False,
+        verbose_name=_('Last message')
+    )
+    
+    # Read watermarks: last message each user has read, and when
+    user1_last_read_message = models.ForeignKey(
+        'messaging.Message',
+        null=True,
+        blank=True,
+        on_delete=models.SET_NULL,
+        related_name='+',
+        db_constraint=False,
+        verbose_name=_('User 1 last read message')
+    )
+    
+    user1_last_read_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        verbose_name=_('User 1 last read at')
+    )
+    
+    user2_last_read_message = models.ForeignKey(
+        'messaging.Message',
+        null=True,
+        blank=True,
+        on_delete=models.SET_NULL,
+        related_name='+',
+        db_constraint=False,
+        verbose_name=_('User 2 last read message')
+    )
+    
+    user2_last_read_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        verbose_name=_('User 2 last read at')
+    )
+    
     # Unread counts for each user
     user1_unread_count = models.PositiveIntegerField(
         default=0,
@@ -215,8 +266,8 @@ class Match(models.Model):
         db_table = 'matches'
         unique_together = ['user1', 'user2']
         indexes = [
-            models.Index(fields=['user1', 'status', '-last_message_at']),
-            models.Index(fields=['user2', 'status', '-last_message_at']),
+            models.Index(fields=['user1', 'status', '-last_activity_at', '-id']),
+            models.Index(fields=['user2', 'status', '-last_activity_at', '-id']),
             models.Index(fields=['status', '-created_at']),
         ]
     
@@ -231,21 +282,110 @@ class Match(models.Model):
         """Get unread count for a specific user."""
         return self.user1_unread_count if user == self.user1 else self.user2_unread_count
     
-    def increment_unread(self, for_user):
-        """Increment unread count for a user."""
-        if for_user == self.user1:
-            self.user1_unread_count += 1
-        else:
-            self.user2_unread_count += 1
-        self.save(update_fields=['user1_unread_count', 'user2_unread_count'])
+    def _unread_field(self, user):
+        user_id = getattr(user, 'pk', user)
+        return 'user1_unread_count' if user_id == self.user1_id else 'user2_unread_count'
+    
+    def increment_unread(self, for_user, by=1):
+        """
+        Atomically increment unread count for a user, and their total.
+        """
+        field = self._unread_field(for_user)
+        with transaction.atomic():
+            Match.objects.filter(pk=self.pk).update(**{field: F(field) + by})
+            User.objects.filter(pk=getattr(for_user, 'pk', for_user)).update(
+                total_unread_count=F('total_unread_count') + by
+            )
+        # In-memory value is best effort, the database holds the truth
+        setattr(self, field, getattr(self, field) + by)
     
     def reset_unread(self, for_user):
-        """Reset unread count for a user."""
-        if for_user == self.user1:
-            self.user1_unread_count = 0
-        else:
-            self.user2_unread_count = 0
-        self.save(update_fields=['user1_unread_count', 'user2_unread_count'])
+        """
+        Atomically reset unread count for a user, and subtract it from their total.
+        """
+        field = self._unread_field(for_user)
+        with transaction.atomic():
+            # Lock the row so the subtracted count is the one being cleared
+            current = Match.objects.select_for_update().filter(
+                pk=self.pk
+            ).values_list(field, flat=True).first()
+            if current:
+                Match.objects.filter(pk=self.pk).update(**{field: 0})
+                User.objects.filter(pk=getattr(for_user, 'pk', for_user)).update(
+                    total_unread_count=Greatest(F('total_unread_count') - current, 0)
+                )
+        setattr(self, field, 0)
+    
+    def _read_fields(self, user):
+        prefix = 'user1' if getattr(user, 'pk', user) == self.user1_id else 'user2'
+        return f'{prefix}_last_read_message', f'{prefix}_last_read_at'
+    
+    def get_read_watermark(self, user):
+        """Get (last read message, read at) for a user, (None, None) if nothing read."""
+        message_field, at_field = self._read_fields(user)
+        return getattr(self, message_field), getattr(self, at_field)
+    
+    def has_read(self, user, message):
+        """Check if a user has read a message; their own messages count as read."""
+        if message.sender_id == getattr(user, 'pk', user):
+            return True
+        last_read, _read_at = self.get_read_watermark(user)
+        if last_read is None:
+            return False
+        return (last_read.created_at, str(last_read.id)) >= (message.created_at, str(message.id))
+    
+    def advance_read_watermark(self, user, message):
+        """
+        Move a user's read watermark forward to `message` in one UPDATE.
+        Returns False if the watermark already covered it.
+        """
+        if self.has_read(user, message):
+            return False
+        message_field, at_field = self._read_fields(user)
+        read_at = timezone.now()
+        # Never move backwards if a concurrent request got further
+        updated = Match.objects.filter(
+            Q(**{f'{message_field}__isnull': True}) |
+            Q(**{f'{message_field}__created_at__lt': message.created_at}) |
+            Q(**{f'{message_field}__created_at': message.created_at, f'{message_field}__lt': message.pk}),
+            pk=self.pk,
+        ).update(**{message_field: message, at_field: read_at})
+        if updated:
+            setattr(self, message_field, message)
+            setattr(self, at_field, read_at)
+        return bool(updated)
+    
+    def record_message(self, message, preview, unread=None):
+        """
+        Store last message info and increment unread counts in a single
+        UPDATE (plus the recipients' totals).
+        `unread` maps recipient ids to increments, by default 1 for the
+        recipient of `message`.
+        """
+        if unread is None:
+            recipient_id = self.user2_id if message.sender_id == self.user1_id else self.user1_id
+            unread = {recipient_id: 1}
+        increments = {self._unread_field(user_id): count for user_id, count in unread.items() if count}
+        with transaction.atomic():
+            Match.objects.filter(pk=self.pk).update(
+                last_message=message,
+                last_message_at=message.created_at,
+                last_activity_at=message.created_at,
+                last_message_preview=preview,
+                updated_at=timezone.now(),
+                **{field: F(field) + count for field, count in increments.items()}
+            )
+            for user_id, count in unread.items():
+                if count:
+                    User.objects.filter(pk=user_id).update(
+                        total_unread_count=F('total_unread_count') + count
+                    )
+        self.last_message = message
+        self.last_message_at = message.created_at
+        self.last_activity_at = message.created_at
+        self.last_message_preview = preview
+        for field, count in increments.items():
+            setattr(self, field, getattr(self, field) + count)
     
     @classmethod
     def get_match_between(cls, user1, user2):
@@ -616,4 +756,55 @@ class InteractionHistory(models.Model):
             # Update the timestamp
             existing.created_at = timezone.now()
             existing.save(update_fields=['created_at'])
-            return existing, False
\ No newline at end of file
+            return existing, False
+
+class OutboxEvent(models.Model):
+    """
+    Side effect (WebSocket event or push notification) recorded in the same
+    transaction as the change that caused it, and published later by the
+    outbox relay. Rows from rolled-back transactions never exist.
+    """
+    
+    CHANNEL = 'channel'
+    PUSH = 'push'
+    
+    KIND_CHOICES = [
+        (CHANNEL, _('Channel layer event')),
+        (PUSH, _('Push notification')),
+    ]
+    
+    id = models.BigAutoField(primary_key=True)
+    
+    kind = models.CharField(
+        max_length=20,
+        choices=KIND_CHOICES,
+        verbose_name=_('Kind')
+    )
+    
+    payload = models.JSONField(
+        verbose_name=_('Payload')
+    )
+    
+    attempts = models.PositiveSmallIntegerField(
+        default=0,
+        verbose_name=_('Attempts')
+    )
+    
+    last_error = models.TextField(
+        blank=True,
+        verbose_name=_('Last error')
+    )
+    
+    created_at = models.DateTimeField(
+        auto_now_add=True,
+        verbose_name=_('Created at')
+    )
+    
+    class Meta:
+        verbose_name = _('Outbox Event')
+        verbose_name_plural = _('Outbox Events')
+        db_table = 'outbox_events'
+        ordering = ['id']
+    
+    def __str__(self):
+        return f"{self.kind} #{self.id}"
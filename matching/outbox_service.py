@@ -0,0 +1,130 @@
+"""
+Transactional outbox for realtime and push side effects.
+
+Signal handlers record OutboxEvent rows in the same transaction as the
+like/match that caused them, instead of talking to Redis or Celery inline.
+The relay (matching.tasks.relay_outbox) publishes pending rows in batches
+and deletes them once published: delivery is at-least-once, and nothing is
+published for rolled-back transactions.
+"""
+import logging
+from typing import Dict, List, Optional, Tuple
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import transaction
+
+from .models import OutboxEvent
+
+logger = logging.getLogger('hivmeet.matching')
+
+# Events failing this many times are left in the table for inspection
+MAX_ATTEMPTS = 10
+
+
+class OutboxService:
+    """
+    Service for recording and relaying outbox events.
+    """
+
+    @staticmethod
+    def channel_event(group: str, event: dict) -> Tuple[str, dict]:
+        """Build a channel layer group_send event."""
+        return OutboxEvent.CHANNEL, {'group': group, 'event': event}
+
+    @staticmethod
+    def push_event(recipient_id, kind: str, actor_id=None, data: Optional[dict] = None) -> Tuple[str, dict]:
+        """Build a push notification event (see NotificationDispatcher)."""
+        return OutboxEvent.PUSH, {
+            'recipient_id': str(recipient_id),
+            'kind': kind,
+            'actor_id': str(actor_id) if actor_id else None,
+            'data': {k: str(v) for k, v in (data or {}).items()},
+        }
+
+    @staticmethod
+    def record(*events: Tuple[str, dict]) -> List[OutboxEvent]:
+        """Write events in the current transaction (single INSERT)."""
+        return OutboxEvent.objects.bulk_create([
+            OutboxEvent(kind=kind, payload=payload) for kind, payload in events
+        ])
+
+    @staticmethod
+    def relay(batch_size: Optional[int] = None) -> int:
+        """
+        Publish one batch of pending events.
+        Returns the number of events published.
+        """
+        if batch_size is None:
+            batch_size = getattr(settings, 'OUTBOX_RELAY_BATCH_SIZE', 200)
+
+        with transaction.atomic():
+            # skip_locked lets several relays run side by side
+            events = list(
+                OutboxEvent.objects.select_for_update(skip_locked=True)
+                .filter(attempts__lt=MAX_ATTEMPTS)
+                .order_by('id')[:batch_size]
+            )
+            if not events:
+                return 0
+
+            errors = {}
+            channel_events = [e for e in events if e.kind == OutboxEvent.CHANNEL]
+            if channel_events:
+                errors.update(OutboxService._publish_channel_events(channel_events))
+
+            for event in events:
+                if event.kind != OutboxEvent.PUSH:
+                    continue
+                try:
+                    OutboxService._publish_push_event(event)
+                except Exception as e:
+                    errors[event.id] = str(e)
+
+            failed = [e for e in events if e.id in errors]
+            for event in failed:
+                event.attempts += 1
+                event.last_error = errors[event.id]
+            if failed:
+                OutboxEvent.objects.bulk_update(failed, ['attempts', 'last_error'])
+                logger.warning(f"Outbox relay: {len(failed)} events failed, will retry")
+
+            published_ids = [e.id for e in events if e.id not in errors]
+            OutboxEvent.objects.filter(id__in=published_ids).delete()
+
+        return len(published_ids)
+
+    @staticmethod
+    def _publish_channel_events(events: List[OutboxEvent]) -> Dict[int, str]:
+        """Send all channel events in one event loop pass; returns errors by id."""
+        try:
+            channel_layer = get_channel_layer()
+        except Exception as e:
+            logger.warning(f"Redis non disponible (Channel Layer): {str(e)}")
+            channel_layer = None
+        if channel_layer is None:
+            return {event.id: 'Channel layer unavailable' for event in events}
+
+        async def send_all():
+            errors = {}
+            for event in events:
+                try:
+                    await channel_layer.group_send(event.payload['group'], event.payload['event'])
+                except Exception as e:
+                    errors[event.id] = str(e)
+            return errors
+
+        return async_to_sync(send_all)()
+
+    @staticmethod
+    def _publish_push_event(event: OutboxEvent):
+        from authentication.notification_service import NotificationDispatcher
+
+        payload = event.payload
+        NotificationDispatcher.enqueue(
+            payload['recipient_id'],
+            payload['kind'],
+            actor_id=payload.get('actor_id'),
+            data=payload.get('data'),
+        )
@@ -7,6 +7,7 @@ from django.utils.translation import gettext_lazy as _
 from django.db.models import Q
 
 from .models import Like, Match, Boost, InteractionHistory
+from authentication.presence_service import PresenceService
 from profiles.models import Profile
 from profiles.serializers import PublicProfileSerializer
 from subscriptions.utils import is_premium_user, get_premium_limits
@@ -300,9 +301,14 @@ class DiscoveryProfileSerializer(serializers.Serializer):
         return photos
 
     def get_is_online(self, obj):
-        """Check if user is online."""
-        from django.utils import timezone
-        return (timezone.now() - obj.user.last_active).total_seconds() < 300
+        """
+        Check if user is online.
+        Uses the bulk presence lookup passed by the view when available.
+        """
+        online_status = self.context.get('online_status')
+        if online_status is not None:
+            return online_status.get(str(obj.user_id), False)
+        return PresenceService.is_online(obj.user_id)
 
     def get_distance_km(self, obj):
         """Get distance from current user."""
@@ -537,7 +543,7 @@ class InteractionHistorySerializer(serializers.Serializer):
         request = self.context.get('request')
         return DiscoveryProfileSerializer(
             obj.target_user.profile,
-            context={'request': request}
+            context={'request': request, 'online_status': self.context.get('online_status')}
         ).data
     
     def get_is_matched(self, obj):
@@ -16,6 +16,9 @@ from typing import List, Optional, Tuple, TYPE_CHECKING
 if TYPE_CHECKING:
     from authentication.models import User as UserType
 
+from authentication.block_service import BlockService
+from authentication.presence_service import PresenceService
+from profiles.compatibility_service import CompatibilityBucketService
 from profiles.models import Profile
 from .models import Like, Dislike, Match, ProfileView, Boost, DailyLikeLimit, InteractionHistory
 from .interaction_service import InteractionService
@@ -125,24 +128,19 @@ class RecommendationService:
             ).values_list('to_user_id', flat=True)
         )
         
-        blocked_user_ids_list = list(user.blocked_users.values_list('id', flat=True))
-        blocked_by_ids_list = list(
-            User.objects.filter(
-                blocked_users=user
-            ).values_list('id', flat=True)
-        )
+        # Blocked in either direction (cached block graph)
+        blocked_ids = BlockService.get_blocked_ids(user.id)
         
         # Combine all excluded user IDs
         excluded_ids = set(interacted_user_ids_list) | set(legacy_liked_ids_list) | set(legacy_disliked_ids_list) | \
-                      set(blocked_user_ids_list) | set(blocked_by_ids_list) | {user.id}
+                      blocked_ids | {user.id}
         
         # LOG 2: Profils exclus
         logger.info(f"🚫 Excluding {len(excluded_ids)} profiles:")
         logger.info(f"   - Active interactions (is_revoked=False): {len(interacted_user_ids_list)}")
         logger.info(f"   - Legacy likes: {len(legacy_liked_ids_list)}")
         logger.info(f"   - Legacy dislikes: {len(legacy_disliked_ids_list)}")
-        logger.info(f"   - Blocked users: {len(blocked_user_ids_list)}")
-        logger.info(f"   - Blocked by: {len(blocked_by_ids_list)}")
+        logger.info(f"   - Blocked (either direction): {len(blocked_ids)}")
         
         # Base query
         query = Profile.objects.select_related('user').prefetch_related('photos').filter(
@@ -176,21 +174,12 @@ class RecommendationService:
         )
         logger.info(f"   After user's age filter ({user_profile.age_min_preference}-{user_profile.age_max_preference}): {query.count()} profiles")
         
-        # Apply gender preferences (mutual)
-        # If genders_sought is empty list, it means "all" - no filter applied
-        if user_profile.genders_sought:
-            query = query.filter(gender__in=user_profile.genders_sought)
-            logger.info(f"   After user's gender filter (seeking {user_profile.genders_sought}): {query.count()} profiles")
-        
-        # Apply mutual gender compatibility (target profile seeks user's gender)
-        # Accept if: genders_sought is empty ([]), is NULL, or contains user's gender
-        if user_profile.gender and user_profile.gender != 'prefer_not_to_say':
-            query = query.filter(
-                Q(genders_sought__contains=[user_profile.gender]) |  # Contains user's gender
-                Q(genders_sought=[]) |  # Empty list means "all"
-                Q(genders_sought__isnull=True)  # NULL means no preference set (accept all)
-            )
-            logger.info(f"   After mutual gender compatibility (target seeks {user_profile.gender} OR all): {query.count()} profiles")
+        # Apply gender preferences (mutual) and birth-year band via compatibility buckets
+        # Only buckets that can be mutually compatible are queried (indexed lookup);
+        # empty genders_sought on either side means "all"
+        compatible_buckets = CompatibilityBucketService.get_compatible_buckets(user_profile)
+        query = query.filter(compatibility_bucket__in=compatible_buckets)
+        logger.info(f"   After compatibility buckets ({len(compatible_buckets)} buckets, seeking {user_profile.genders_sought or 'all'}): {query.count()} profiles")
         
         # Apply relationship type preferences
         # If relationship_types_sought is empty list, it means "all" - no filter applied
@@ -214,11 +203,11 @@ class RecommendationService:
             query = query.filter(user__is_verified=True)
             logger.info(f"   After verified_only filter: {query.count()} profiles ⚠️")
         
-        # Apply "online only" filter (last active within 5 minutes)
+        # Apply "online only" filter (intersect with the presence registry)
         if user_profile.online_only:
-            cutoff_time = timezone.now() - timedelta(minutes=5)
-            query = query.filter(user__last_active__gte=cutoff_time)
-            logger.info(f"   After online_only filter (last 5 min): {query.count()} profiles ⚠️")
+            online_user_ids = PresenceService.get_online_user_ids()
+            query = query.filter(user_id__in=online_user_ids)
+            logger.info(f"   After online_only filter ({len(online_user_ids)} users online): {query.count()} profiles ⚠️")
         
         # Apply boost priority
         active_boosts = Boost.objects.filter(
@@ -3,87 +3,39 @@ Signals for matching app.
 """
 from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
-from channels.layers import get_channel_layer
-from asgiref.sync import async_to_sync
 import logging
-from contextlib import contextmanager
 
+from authentication import notification_service
 from .models import Match, Like, Boost
-from .tasks import send_match_notification
+from .outbox_service import OutboxService
 
 logger = logging.getLogger('hivmeet.matching')
 
 
-def get_channel_layer_safe():
-    """
-    Get channel layer with error handling for when Redis is not available.
-    Returns None if Redis is not running.
-    """
-    try:
-        return get_channel_layer()
-    except Exception as e:
-        logger.warning(f"Redis non disponible: {str(e)}")
-        return None
-
-
-@contextmanager
-def channel_layer_context():
-    """
-    Context manager for safely using channel layer.
-    Yields None if Redis is not available.
-    """
-    layer = None
-    try:
-        layer = get_channel_layer()
-    except Exception as e:
-        logger.warning(f"Redis non disponible (Channel Layer): {str(e)}")
-    yield layer
-
-
 @receiver(post_save, sender=Match)
 def handle_new_match(sender, instance, created, **kwargs):
     """
     Handle new match creation.
+    Push and real-time notifications go through the outbox, in the same transaction.
     """
     if created:
-        # Send notifications to both users
         try:
-            # Send push notifications
-            send_match_notification.delay(
-                instance.user1.id,
-                instance.user2.id
-            )
-            send_match_notification.delay(
-                instance.user2.id,
-                instance.user1.id
+            OutboxService.record(
+                OutboxService.push_event(instance.user1_id, notification_service.MATCH, actor_id=instance.user2_id),
+                OutboxService.push_event(instance.user2_id, notification_service.MATCH, actor_id=instance.user1_id),
+                OutboxService.channel_event(f"user_{instance.user1_id}", {
+                    "type": "new_match",
+                    "match_id": str(instance.id),
+                    "matched_user_id": str(instance.user2_id)
+                }),
+                OutboxService.channel_event(f"user_{instance.user2_id}", {
+                    "type": "new_match",
+                    "match_id": str(instance.id),
+                    "matched_user_id": str(instance.user1_id)
+                }),
             )
-            
-            # Send real-time notifications if users are online
-            # This would use WebSockets/Channels - use context manager for safety
-            with channel_layer_context() as channel_layer:
-                if channel_layer:
-                    try:
-                        async_to_sync(channel_layer.group_send)(
-                            f"user_{instance.user1.id}",
-                            {
-                                "type": "new_match",
-                                "match_id": str(instance.id),
-                                "matched_user_id": str(instance.user2.id)
-                            }
-                        )
-                        async_to_sync(channel_layer.group_send)(
-                            f"user_{instance.user2.id}",
-                            {
-                                "type": "new_match",
-                                "match_id": str(instance.id),
-                                "matched_user_id": str(instance.user1.id)
-                            }
-                        )
-                    except Exception as e:
-                        logger.warning(f"Erreur envoi notification temps reel: {str(e)}")
-                
         except Exception as e:
-            logger.error(f"Error sending match notifications: {str(e)}")
+            logger.error(f"Error recording match notifications: {str(e)}")
 
 
 @receiver(post_save, sender=Like)
@@ -149,29 +101,19 @@ def handle_boost_activation(sender, instance, created, **kwargs):
 
 @receiver(post_save, sender=Like)
 def handle_like_notification(sender, instance, created, **kwargs):
-    """Send notification for likes and super likes."""
+    """Send notification for likes and super likes (via the outbox)."""
     if created:
-        from .tasks import send_like_notification
-        
-        # Send notification to target user
-        send_like_notification.delay(
-            instance.from_user.id,
-            instance.to_user.id,
-            instance.like_type == Like.SUPER
+        notification_type = "super_like" if instance.like_type == Like.SUPER else "like"
+        OutboxService.record(
+            OutboxService.push_event(
+                instance.to_user_id,
+                notification_service.LIKE,
+                actor_id=instance.from_user_id,
+                data={'is_super_like': instance.like_type == Like.SUPER},
+            ),
+            OutboxService.channel_event(f"user_{instance.to_user_id}", {
+                "type": notification_type,
+                "from_user_id": str(instance.from_user_id),
+                "like_id": str(instance.id)
+            }),
         )
-        
-        # Send real-time notification if target user is online - use safe channel layer
-        with channel_layer_context() as channel_layer:
-            if channel_layer:
-                try:
-                    notification_type = "super_like" if instance.like_type == Like.SUPER else "like"
-                    async_to_sync(channel_layer.group_send)(
-                        f"user_{instance.to_user.id}",
-                        {
-                            "type": notification_type,
-                            "from_user_id": str(instance.from_user.id),
-                            "like_id": str(instance.id)
-                        }
-                    )
-                except Exception as e:
-                    logger.warning(f"Erreur envoi notification like: {str(e)}")
\ No newline at end of file
@@ -1,9 +1,15 @@
-from django.test import TestCase
+from django.test import TestCase, override_settings
 from django.contrib.auth import get_user_model
+from django.db import transaction
 from datetime import date
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
 from rest_framework.test import APITestCase, APIClient
 from rest_framework import status
 from profiles.models import Profile
+from authentication.push_transports import FakePushTransport
+from matching.models import Like, OutboxEvent
+from matching.outbox_service import OutboxService
 
 User = get_user_model()
 
@@ -66,3 +72,64 @@ class DiscoveryAPITest(APITestCase):
         # Both users should have valid profiles in discovery
         self.assertTrue(self.male_profile.allow_in_discovery)
         self.assertTrue(self.female_profile.allow_in_discovery)
+
+
+@override_settings(
+    CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}},
+    PUSH_NOTIFICATION_TRANSPORT='authentication.push_transports.FakePushTransport',
+    PUSH_NOTIFICATION_WINDOW_SECONDS=0,
+)
+class OutboxRelayTest(TestCase):
+    """Like side effects go through the transactional outbox"""
+    
+    def setUp(self):
+        FakePushTransport.reset()
+        self.liker = User.objects.create_user(
+            email='outbox.liker@example.com',
+            password='testpass123',
+            display_name='Liker',
+            birth_date=date(1990, 1, 1)
+        )
+        self.target = User.objects.create_user(
+            email='outbox.target@example.com',
+            password='testpass123',
+            display_name='Target',
+            birth_date=date(1992, 1, 1)
+        )
+        self.target.is_premium = True
+        self.target.fcm_tokens = [{'token': 'target-token'}]
+        self.target.save(update_fields=['is_premium', 'fcm_tokens'])
+        OutboxEvent.objects.all().delete()
+    
+    def test_like_records_outbox_rows_without_publishing(self):
+        Like.objects.create(from_user=self.liker, to_user=self.target)
+        
+        kinds = sorted(OutboxEvent.objects.values_list('kind', flat=True))
+        self.assertEqual(kinds, [OutboxEvent.CHANNEL, OutboxEvent.PUSH])
+        self.assertEqual(FakePushTransport.outbox, [])
+    
+    def test_rolled_back_like_leaves_no_outbox_rows(self):
+        try:
+            with transaction.atomic():
+                Like.objects.create(from_user=self.liker, to_user=self.target)
+                raise RuntimeError('rollback')
+        except RuntimeError:
+            pass
+        
+        self.assertFalse(OutboxEvent.objects.exists())
+    
+    def test_relay_publishes_and_deletes_events(self):
+        channel_layer = get_channel_layer()
+        channel_name = async_to_sync(channel_layer.new_channel)()
+        async_to_sync(channel_layer.group_add)(f'user_{self.target.id}', channel_name)
+        
+        like = Like.objects.create(from_user=self.liker, to_user=self.target)
+        
+        self.assertEqual(OutboxService.relay(), 2)
+        self.assertFalse(OutboxEvent.objects.exists())
+        
+        event = async_to_sync(channel_layer.receive)(channel_name)
+        self.assertEqual(event['type'], 'like')
+        self.assertEqual(event['like_id'], str(like.id))
+        self.assertEqual(len(FakePushTransport.outbox), 1)
+        self.assertEqual(FakePushTransport.outbox[0].data['liker_user_id'], str(self.liker.id))
@@ -1,10 +1,13 @@
 from datetime import date, timedelta
+from unittest.mock import patch
 
 from django.contrib.auth import get_user_model
 from django.test import TestCase
 from django.utils import timezone
 from rest_framework.test import APIClient
 
+from authentication.block_service import BlockService
+from authentication.presence_service import PresenceService
 from matching.daily_likes_service import DailyLikesService
 from matching.models import InteractionHistory, Like
 from matching.services import MatchingService, RecommendationService
@@ -16,6 +19,7 @@ User = get_user_model()
 class DiscoveryFilterDeterministicTests(TestCase):
     def setUp(self):
         self.client = APIClient()
+        PresenceService.clear()
 
     def _create_user_with_profile(
         self,
@@ -47,6 +51,7 @@ class DiscoveryFilterDeterministicTests(TestCase):
         user.is_verified = is_verified
         user.last_active = timezone.now() - timedelta(minutes=online_minutes_ago)
         user.save(update_fields=["email_verified", "is_active", "is_verified", "last_active"])
+        PresenceService.touch(user.id, at=user.last_active)
 
         profile = user.profile
         profile.gender = gender
@@ -141,6 +146,60 @@ class DiscoveryFilterDeterministicTests(TestCase):
         self.assertIn(compatible.id, result_ids)
         self.assertNotIn(not_mutual.id, result_ids)
 
+    def test_compatibility_bucket_maintained_on_save_and_used_by_discovery(self):
+        seeker = self._create_user_with_profile(
+            "seeker.bucket@test.com",
+            "Seeker Bucket",
+            1990,
+            "male",
+            genders_sought=["female"],
+        )
+        target = self._create_user_with_profile(
+            "target.bucket@test.com",
+            "Target Bucket",
+            1992,
+            "female",
+            genders_sought=["male", "non_binary"],
+        )
+        self.assertEqual(seeker.profile.compatibility_bucket, "m:f:1990")
+        self.assertEqual(target.profile.compatibility_bucket, "f:mn:1990")
+
+        result_ids = {p.user_id for p in RecommendationService.get_recommendations(seeker, limit=100)}
+        self.assertIn(target.id, result_ids)
+
+        # Partial save of genders_sought must refresh the bucket too
+        target.profile.genders_sought = ["female"]
+        target.profile.save(update_fields=["genders_sought"])
+        target.profile.refresh_from_db()
+        self.assertEqual(target.profile.compatibility_bucket, "f:f:1990")
+
+        result_ids = {p.user_id for p in RecommendationService.get_recommendations(seeker, limit=100)}
+        self.assertNotIn(target.id, result_ids)
+
+    def test_compatibility_bucket_rebuilt_only_when_birth_date_changes(self):
+        user = self._create_user_with_profile(
+            "birth.bucket@test.com",
+            "Birth Bucket",
+            1990,
+            "male",
+            genders_sought=["female"],
+        )
+        user = User.objects.get(pk=user.pk)
+
+        with patch("profiles.compatibility_service.CompatibilityBucketService.rebuild") as mocked_rebuild:
+            user.display_name = "Renamed"
+            user.save()
+        mocked_rebuild.assert_not_called()
+
+        user.birth_date = date(2000, 6, 1)
+        user.save()
+        user.profile.refresh_from_db()
+        self.assertEqual(user.profile.compatibility_bucket, "m:f:2000")
+
+        with patch("profiles.compatibility_service.CompatibilityBucketService.rebuild") as mocked_rebuild:
+            user.save()
+        mocked_rebuild.assert_not_called()
+
     def test_distance_filter_includes_boundary_and_excludes_outside(self):
         seeker = self._create_user_with_profile(
             "seeker.distance@test.com",
@@ -262,6 +321,55 @@ class DiscoveryFilterDeterministicTests(TestCase):
         self.assertNotIn(not_verified.id, result_ids)
         self.assertNotIn(offline.id, result_ids)
 
+    def test_online_filter_uses_presence_registry(self):
+        seeker = self._create_user_with_profile(
+            "seeker.presence@test.com",
+            "Seeker Presence",
+            1990,
+            "male",
+            genders_sought=["female"],
+        )
+        seeker.profile.online_only = True
+        seeker.profile.save(update_fields=["online_only"])
+
+        stale_row = self._create_user_with_profile(
+            "stale.presence@test.com",
+            "Stale Row",
+            1990,
+            "female",
+            genders_sought=["male"],
+            online_minutes_ago=30,
+        )
+        # last_active column lags behind, but a fresh heartbeat was recorded
+        PresenceService.touch(stale_row.id)
+
+        went_offline = self._create_user_with_profile(
+            "gone.presence@test.com",
+            "Gone",
+            1990,
+            "female",
+            genders_sought=["male"],
+        )
+        PresenceService.remove(went_offline.id)
+
+        result_ids = {p.user_id for p in RecommendationService.get_recommendations(seeker, limit=100)}
+
+        self.assertIn(stale_row.id, result_ids)
+        self.assertNotIn(went_offline.id, result_ids)
+
+    def test_presence_bulk_lookup_and_middleware_heartbeat(self):
+        online = self._create_user_with_profile("online.bulk@test.com", "Online", 1990, "female")
+        offline = self._create_user_with_profile(
+            "offline.bulk@test.com", "Offline", 1990, "female", online_minutes_ago=30
+        )
+
+        status_by_id = PresenceService.get_online_status([online.id, offline.id])
+        self.assertEqual(status_by_id, {str(online.id): True, str(offline.id): False})
+
+        self.client.force_authenticate(user=offline)
+        self.client.get("/api/v1/discovery/filters/get")
+        self.assertTrue(PresenceService.is_online(offline.id))
+
     def test_exclusions_self_blocked_and_interacted(self):
         seeker = self._create_user_with_profile(
             "seeker.exclude@test.com",
@@ -315,6 +423,42 @@ class DiscoveryFilterDeterministicTests(TestCase):
         self.assertNotIn(interacted.id, result_ids)
         self.assertIn(visible.id, result_ids)
 
+    def test_block_endpoint_invalidates_block_graph_immediately(self):
+        seeker = self._create_user_with_profile(
+            "seeker.blockgraph@test.com",
+            "Seeker Block Graph",
+            1990,
+            "male",
+            genders_sought=["female"],
+        )
+        target = self._create_user_with_profile(
+            "target.blockgraph@test.com",
+            "Target Block Graph",
+            1990,
+            "female",
+            genders_sought=["male"],
+        )
+
+        # Warm the cached block set for both sides
+        self.assertFalse(BlockService.is_blocked_between(seeker.id, target.id))
+        self.assertFalse(BlockService.is_blocked_between(target.id, seeker.id))
+
+        self.client.force_authenticate(user=target)
+        response = self.client.post(f"/api/v1/user-settings/blocks/{seeker.id}")
+        self.assertEqual(response.status_code, 201)
+
+        self.assertTrue(BlockService.is_blocked_between(seeker.id, target.id))
+        self.assertIn(target.id, BlockService.get_blocked_ids(seeker.id))
+        result_ids = {p.user_id for p in RecommendationService.get_recommendations(seeker, limit=100)}
+        self.assertNotIn(target.id, result_ids)
+
+        response = self.client.delete(f"/api/v1/user-settings/blocks/{seeker.id}")
+        self.assertEqual(response.status_code, 204)
+
+        self.assertFalse(BlockService.is_blocked_between(seeker.id, target.id))
+        result_ids = {p.user_id for p in RecommendationService.get_recommendations(seeker, limit=100)}
+        self.assertIn(target.id, result_ids)
+
     def test_filters_endpoint_validates_and_normalizes_all_keyword(self):
         user = self._create_user_with_profile(
             "filters.endpoint@test.com",
@@ -11,6 +11,7 @@ from django.db import transaction
 import logging
 from django.utils import timezone
 
+from authentication.presence_service import PresenceService
 from .services import RecommendationService, MatchingService
 from .daily_likes_service import DailyLikesService
 from .interaction_service import InteractionService
@@ -85,10 +86,11 @@ def get_discovery_profiles(request):
     logger.info(f"✅ Recommendations service returned: {len(profiles)} profiles")
     
     # Serialize profiles with request context for proper URL handling
+    online_status = PresenceService.get_online_status([profile.user_id for profile in profiles])
     serializer = DiscoveryProfileSerializer(
         profiles, 
         many=True,
-        context={'request': request}
+        context={'request': request, 'online_status': online_status}
     )
     
     # LOG 4: Réponse finale
@@ -12,6 +12,7 @@ from django.db.models import Q, Count, Case, When
 from django.utils import timezone
 import logging
 
+from authentication.presence_service import PresenceService
 from .models import InteractionHistory, Match, DailyLikeLimit
 from .serializers import InteractionHistorySerializer, InteractionStatsSerializer
 from .interaction_service import InteractionService
@@ -99,10 +100,11 @@ def get_my_likes(request):
     page = paginator.paginate_queryset(interactions, request)
     
     # Serialize
+    online_status = PresenceService.get_online_status([interaction.target_user_id for interaction in page])
     serializer = InteractionHistorySerializer(
         page,
         many=True,
-        context={'request': request}
+        context={'request': request, 'online_status': online_status}
     )
     
     logger.info(f"✅ Returning {len(serializer.data)} likes for user {request.user.id} (matched_only={matched_only})")
@@ -147,10 +149,11 @@ def get_my_passes(request):
     page = paginator.paginate_queryset(interactions, request)
     
     # Serialize
+    online_status = PresenceService.get_online_status([interaction.target_user_id for interaction in page])
     serializer = InteractionHistorySerializer(
         page,
         many=True,
-        context={'request': request}
+        context={'request': request, 'online_status': online_status}
     )
     
     logger.info(f"✅ Returning {len(serializer.data)} passes for user {request.user.id}")
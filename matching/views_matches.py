@@ -38,7 +38,7 @@ class MatchListView(generics.ListAPIView):
         # Apply filters
         sort = self.request.query_params.get('sort', 'recent_activity')
         if sort == 'recent_activity':
-            queryset = queryset.order_by('-last_message_at', '-created_at')
+            queryset = queryset.order_by('-last_activity_at', '-id')
         else:
             queryset = queryset.order_by('-created_at')
         
@@ -61,6 +61,10 @@ def unmatch_user(request, match_id):
             status=Match.ACTIVE
         )
         
+        # Unread messages of a deleted match no longer count towards totals
+        match.reset_unread(match.user1_id)
+        match.reset_unread(match.user2_id)
+
         # Mark as deleted rather than actually deleting
         match.status = Match.DELETED
         match.save()
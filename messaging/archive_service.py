@@ -0,0 +1,289 @@
+"""
+Monthly partitions and cold archival of messages.
+
+The messages table is range-partitioned by created_at, one partition per
+month (messages_pYYYY_MM) plus messages_default (see migration messaging
+0003). ensure_partitions() creates the coming months ahead of time.
+archive_partitions() exports partitions older than
+MESSAGE_ARCHIVE_AFTER_MONTHS to gzipped JSONL files, one per conversation and
+month under MESSAGE_ARCHIVE_DIR (with their reactions), then drops them.
+get_archived_messages() reads those files back for very old history.
+"""
+import gzip
+import json
+import logging
+import os
+import re
+from datetime import date, datetime, timezone as dt_timezone
+from itertools import groupby
+from operator import itemgetter
+from typing import List, Optional, Tuple
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from matching.models import Match
+from .models import Message, MessageClientId, MessageReaction
+
+logger = logging.getLogger('hivmeet.messaging')
+
+DEFAULT_PARTITION = 'messages_default'
+
+_PARTITION_RE = re.compile(r'^messages_p(\d{4})_(\d{2})$')
+_ARCHIVE_MONTH_RE = re.compile(r'^(\d{4})-(\d{2})$')
+
+# Columns kept in archive files
+ARCHIVED_FIELDS = (
+    'id', 'client_message_id', 'match_id', 'sender_id', 'message_type', 'content',
+    'media_url', 'media_thumbnail_url', 'media_file_path', 'media_status', 'media_info', 'status',
+    'created_at', 'delivered_at', 'read_at', 'is_deleted_by_sender', 'is_deleted_by_recipient',
+)
+
+# Reactions are kept in a list on each archived message
+ARCHIVED_REACTION_FIELDS = ('user_id', 'emoji', 'created_at')
+
+_DATETIME_FIELDS = ('created_at', 'delivered_at', 'read_at')
+
+
+def add_months(month: date, count: int) -> date:
+    """First day of the month `count` months after `month`."""
+    index = month.year * 12 + month.month - 1 + count
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month: date) -> str:
+    return f'messages_p{month:%Y_%m}'
+
+
+def month_start(month: date) -> datetime:
+    """Partition bound of a month (partitions are in UTC)."""
+    return datetime(month.year, month.month, 1, tzinfo=dt_timezone.utc)
+
+
+def _current_month() -> date:
+    return timezone.now().date().replace(day=1)
+
+
+class MessageArchiveService:
+    """
+    Service for message partition maintenance and the cold archive.
+    """
+
+    @staticmethod
+    def get_archive_dir() -> str:
+        return getattr(settings, 'MESSAGE_ARCHIVE_DIR', os.path.join(settings.BASE_DIR, 'archive', 'messages'))
+
+    @staticmethod
+    def get_archive_after_months() -> int:
+        return getattr(settings, 'MESSAGE_ARCHIVE_AFTER_MONTHS', 12)
+
+    @staticmethod
+    def is_partitioned() -> bool:
+        """False on databases where messaging 0003 did not run (e.g. tests)."""
+        if connection.vendor != 'postgresql':
+            return False
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table "
+                "WHERE partrelid = to_regclass('messages'))"
+            )
+            return cursor.fetchone()[0]
+
+    @staticmethod
+    def list_partitions() -> List[date]:
+        """Months with a partition, oldest first."""
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT inhrelid::regclass::text FROM pg_inherits "
+                "WHERE inhparent = 'messages'::regclass"
+            )
+            names = [row[0] for row in cursor.fetchall()]
+        months = []
+        for name in names:
+            found = _PARTITION_RE.match(name)
+            if found:
+                months.append(date(int(found.group(1)), int(found.group(2)), 1))
+        return sorted(months)
+
+    @staticmethod
+    def ensure_partitions(months_ahead: Optional[int] = None) -> List[str]:
+        """
+        Create partitions for the current and next months_ahead months, and
+        for months whose rows ended up in the default partition.
+        Returns the names of created partitions.
+        """
+        if not MessageArchiveService.is_partitioned():
+            return []
+        if months_ahead is None:
+            months_ahead = getattr(settings, 'MESSAGE_PARTITION_MONTHS_AHEAD', 3)
+
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT DISTINCT date_trunc('month', created_at) FROM {DEFAULT_PARTITION}")
+            wanted = {row[0].date() for row in cursor.fetchall()}
+        current = _current_month()
+        wanted.update(add_months(current, i) for i in range(months_ahead + 1))
+
+        existing = set(MessageArchiveService.list_partitions())
+        created = []
+        for month in sorted(wanted - existing):
+            MessageArchiveService._create_partition(month)
+            created.append(partition_name(month))
+        if created:
+            logger.info(f"Created message partitions: {', '.join(created)}")
+        return created
+
+    @staticmethod
+    def _create_partition(month: date):
+        """Create a month partition, moving its rows out of the default partition."""
+        name = partition_name(month)
+        start, end = month.isoformat(), add_months(month, 1).isoformat()
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(f"CREATE TABLE {name} (LIKE messages INCLUDING DEFAULTS INCLUDING CONSTRAINTS)")
+            cursor.execute(
+                f"WITH moved AS (DELETE FROM {DEFAULT_PARTITION} "
+                f"WHERE created_at >= %s AND created_at < %s RETURNING *) "
+                f"INSERT INTO {name} SELECT * FROM moved",
+                [start, end],
+            )
+            cursor.execute(f"ALTER TABLE messages ATTACH PARTITION {name} FOR VALUES FROM ('{start}') TO ('{end}')")
+
+    @staticmethod
+    def archive_partitions(after_months: Optional[int] = None) -> List[str]:
+        """
+        Export partitions older than after_months to the archive and drop them.
+        Returns the names of archived partitions.
+        """
+        if not MessageArchiveService.is_partitioned():
+            return []
+        if after_months is None:
+            after_months = MessageArchiveService.get_archive_after_months()
+
+        cutoff = add_months(_current_month(), -after_months)
+        archived = []
+        for month in MessageArchiveService.list_partitions():
+            if month >= cutoff:
+                break
+            messages = Message.objects.filter(
+                created_at__gte=month_start(month),
+                created_at__lt=month_start(add_months(month, 1)),
+            )
+            count = MessageArchiveService.export_messages(month, messages)
+
+            name = partition_name(month)
+            with transaction.atomic(), connection.cursor() as cursor:
+                MessageArchiveService.release_references(messages)
+                cursor.execute(f"ALTER TABLE messages DETACH PARTITION {name}")
+                cursor.execute(f"DROP TABLE {name}")
+            archived.append(name)
+            logger.info(f"Archived message partition {name} ({count} messages)")
+        return archived
+
+    @staticmethod
+    def release_references(messages):
+        """
+        Drop what points to messages about to be deleted with their partition.
+        Foreign keys to messages have no database constraint, so the last
+        message and read watermarks of matches are cleared here: a watermark
+        on a missing row could never be advanced again. Archived messages
+        count as read anyway.
+        """
+        message_ids = messages.values('id')
+        Match.objects.filter(last_message__in=message_ids).update(last_message=None)
+        Match.objects.filter(user1_last_read_message__in=message_ids).update(user1_last_read_message=None)
+        Match.objects.filter(user2_last_read_message__in=message_ids).update(user2_last_read_message=None)
+        MessageReaction.objects.filter(message__in=message_ids).delete()
+        MessageClientId.objects.filter(message_id__in=message_ids).delete()
+
+    @staticmethod
+    def export_messages(month: date, messages) -> int:
+        """
+        Write messages of a month to <archive dir>/<YYYY-MM>/<match id>.jsonl.gz.
+        Returns the number of messages written.
+        """
+        month_dir = os.path.join(MessageArchiveService.get_archive_dir(), f'{month:%Y-%m}')
+        os.makedirs(month_dir, exist_ok=True)
+
+        reactions = {}
+        for reaction in MessageReaction.objects.filter(
+            message__in=messages.values('id'),
+        ).order_by('created_at').values('message_id', *ARCHIVED_REACTION_FIELDS):
+            reactions.setdefault(reaction.pop('message_id'), []).append(reaction)
+
+        count = 0
+        rows = messages.order_by('match_id', 'created_at', 'id').values(*ARCHIVED_FIELDS)
+        for match_id, match_rows in groupby(rows.iterator(chunk_size=2000), key=itemgetter('match_id')):
+            path = os.path.join(month_dir, f'{match_id}.jsonl.gz')
+            with gzip.open(f'{path}.tmp', 'wt', encoding='utf-8') as archive:
+                for row in match_rows:
+                    row['reactions'] = reactions.get(row['id'], [])
+                    archive.write(json.dumps(row, cls=DjangoJSONEncoder) + '\n')
+                    count += 1
+            # Files only appear under their final name once complete
+            os.replace(f'{path}.tmp', path)
+        return count
+
+    @staticmethod
+    def may_have_archive(match) -> bool:
+        """Cheap check, without disk access: is the conversation old enough?"""
+        cutoff = add_months(_current_month(), -MessageArchiveService.get_archive_after_months())
+        return match.created_at.date() < cutoff
+
+    @staticmethod
+    def get_archived_messages(
+        user,
+        match,
+        before: Optional[Tuple[datetime, str]] = None,
+        limit: int = 50,
+    ) -> List[Message]:
+        """
+        Archived messages of a conversation visible to the user, newest first,
+        older than the (created_at, id) position `before`. Returned messages
+        are unsaved, flagged is_archived, and count as read.
+        """
+        root = MessageArchiveService.get_archive_dir()
+        if limit <= 0 or not os.path.isdir(root):
+            return []
+
+        months = sorted((name for name in os.listdir(root) if _ARCHIVE_MONTH_RE.match(name)), reverse=True)
+        results = []
+        for month in months:
+            if before and month > f'{before[0]:%Y-%m}':
+                continue
+            path = os.path.join(root, month, f'{match.id}.jsonl.gz')
+            if not os.path.exists(path):
+                continue
+
+            with gzip.open(path, 'rt', encoding='utf-8') as archive:
+                messages = [MessageArchiveService._load(json.loads(line)) for line in archive]
+            messages = [
+                msg for msg in messages
+                if MessageArchiveService._is_visible(msg, user)
+                and (before is None or (msg.created_at, str(msg.id)) < before)
+            ]
+            messages.sort(key=lambda msg: (msg.created_at, str(msg.id)), reverse=True)
+            results.extend(messages)
+            if len(results) >= limit:
+                break
+        return results[:limit]
+
+    @staticmethod
+    def _load(row: dict) -> Message:
+        reactions = row.pop('reactions', [])
+        for field in _DATETIME_FIELDS:
+            if row.get(field):
+                row[field] = parse_datetime(row[field])
+        message = Message(**row)
+        message.is_archived = True
+        message.archived_reactions = reactions
+        if message.status != Message.READ:
+            message.status = Message.READ
+        return message
+
+    @staticmethod
+    def _is_visible(message: Message, user) -> bool:
+        if str(message.sender_id) == str(user.id):
+            return not message.is_deleted_by_sender
+        return not message.is_deleted_by_recipient
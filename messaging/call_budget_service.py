@@ -0,0 +1,148 @@
+"""
+Daily call budget and active call registry.
+
+Seconds of call used per day are a cache counter per user whose key holds
+the (UTC) date: a new day starts from a new key, and old counters just
+expire. Ending an answered call adds its duration to both participants'
+counters with one atomic incr; a missing counter (first call of the day,
+cache eviction) is rebuilt once from the calls table.
+
+Users in a call hold an active_call key, taken with cache.add when the call
+is initiated and released when it ends, so overlapping calls are rejected
+without a query. Keys expire after ACTIVE_CALL_TTL_SECONDS in case a call
+is never ended. A call is saved after its claim, so a holder without an
+active call row is only taken over once CLAIM_GRACE_SECONDS have passed:
+before that, its row may not be committed yet.
+"""
+import logging
+from datetime import date, datetime, time, timedelta, timezone as dt_timezone
+from typing import Iterable
+
+from django.core.cache import cache
+from django.db.models import Q, Sum
+from django.utils import timezone
+
+from .models import Call
+
+logger = logging.getLogger('hivmeet.messaging')
+
+# Call time allowed per user and day
+DAILY_LIMIT_SECONDS = 30 * 60
+
+# Counters outlive their day a little, for calls ending after midnight
+BUDGET_TTL_SECONDS = 2 * 24 * 3600
+
+ACTIVE_CALL_TTL_SECONDS = 2 * 3600
+
+CLAIM_GRACE_SECONDS = 60
+
+ACTIVE_STATUSES = [Call.INITIATED, Call.RINGING, Call.ANSWERED]
+
+
+def _budget_key(user_id, day: date) -> str:
+    return f'call_budget_{user_id}_{day:%Y%m%d}'
+
+
+def _active_call_key(user_id) -> str:
+    return f'active_call_{user_id}'
+
+
+def _holder(value):
+    """Claim stored in an active_call key (older keys hold the bare call ID)."""
+    if isinstance(value, str):
+        return {'call_id': value, 'claimed_at': 0}
+    return value
+
+
+def _day_of(moment: datetime) -> date:
+    return moment.astimezone(dt_timezone.utc).date()
+
+
+class CallBudgetService:
+    """
+    Service for the daily call budget and the active call registry.
+    """
+
+    @staticmethod
+    def get_used_seconds(user_id, day: date = None) -> int:
+        """Seconds of call a user used on a day (default: today)."""
+        day = day or _day_of(timezone.now())
+        used = cache.get(_budget_key(user_id, day))
+        if used is None:
+            used = CallBudgetService._rebuild(user_id, day)
+        return used
+
+    @staticmethod
+    def get_remaining_seconds(user_id) -> int:
+        return max(DAILY_LIMIT_SECONDS - CallBudgetService.get_used_seconds(user_id), 0)
+
+    @staticmethod
+    def _rebuild(user_id, day: date) -> int:
+        """Load a counter from the calls table (includes calls already saved)."""
+        start = datetime.combine(day, time.min, tzinfo=dt_timezone.utc)
+        used = Call.objects.filter(
+            Q(caller_id=user_id) | Q(callee_id=user_id),
+            initiated_at__gte=start,
+            initiated_at__lt=start + timedelta(days=1),
+            status=Call.ENDED,
+        ).aggregate(total=Sum('duration_seconds'))['total'] or 0
+        # Keep a counter set concurrently rather than overwrite it
+        cache.add(_budget_key(user_id, day), used, BUDGET_TTL_SECONDS)
+        return cache.get(_budget_key(user_id, day), used)
+
+    @staticmethod
+    def record_call_end(call: Call):
+        """Charge an ended call to both participants and release them."""
+        if call.status == Call.ENDED and call.duration_seconds:
+            day = _day_of(call.initiated_at or timezone.now())
+            for user_id in (call.caller_id, call.callee_id):
+                try:
+                    cache.incr(_budget_key(user_id, day), call.duration_seconds)
+                except ValueError:
+                    # No counter yet: the rebuilt one includes this call
+                    CallBudgetService._rebuild(user_id, day)
+        CallBudgetService.release(call)
+
+    @staticmethod
+    def claim(call: Call) -> bool:
+        """
+        Register both participants as in the call.
+        Returns False (and registers no one) if either is in another call.
+        """
+        claimed = []
+        for user_id in (call.caller_id, call.callee_id):
+            if not CallBudgetService._claim_user(user_id, call.id):
+                CallBudgetService._release_users(claimed, call.id)
+                return False
+            claimed.append(user_id)
+        return True
+
+    @staticmethod
+    def _claim_user(user_id, call_id) -> bool:
+        key = _active_call_key(user_id)
+        now = timezone.now().timestamp()
+        claim = {'call_id': str(call_id), 'claimed_at': now}
+        if cache.add(key, claim, ACTIVE_CALL_TTL_SECONDS):
+            return True
+        # Slow path, only on conflict: the registered call may have ended
+        # without going through record_call_end
+        registered = _holder(cache.get(key))
+        if registered and registered['call_id'] != str(call_id):
+            if now - registered['claimed_at'] < CLAIM_GRACE_SECONDS:
+                return False
+            if Call.objects.filter(id=registered['call_id'], status__in=ACTIVE_STATUSES).exists():
+                return False
+        cache.set(key, claim, ACTIVE_CALL_TTL_SECONDS)
+        return True
+
+    @staticmethod
+    def release(call: Call):
+        CallBudgetService._release_users((call.caller_id, call.callee_id), call.id)
+
+    @staticmethod
+    def _release_users(user_ids: Iterable, call_id):
+        keys = [_active_call_key(user_id) for user_id in user_ids]
+        # Only release keys this call still holds
+        held = [key for key, value in cache.get_many(keys).items() if _holder(value)['call_id'] == str(call_id)]
+        if held:
+            cache.delete_many(held)
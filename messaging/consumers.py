@@ -6,414 +6,407 @@ Handles:
 - Typing indicators
 - Presence status (online/offline)
 - WebRTC call signaling (ICE candidates, offer, answer)
+
+UserConsumer multiplexes everything over a single socket per user: it joins
+the user_<id> group (matches, likes, calls, new messages) and the
+conversation groups the client subscribes to. ConversationConsumer keeps
+the one-socket-per-conversation protocol for older clients.
+
+Frames are JSON text unless the client negotiates the MessagePack
+subprotocol (see ws_codec).
 """
 
+import asyncio
 import json
 import logging
 from urllib.parse import parse_qs
 
+from asgiref.sync import sync_to_async
 from channels.db import database_sync_to_async
 from channels.generic.websocket import AsyncWebsocketConsumer
-from django.contrib.auth import get_user_model
-from django.core.cache import cache
-from django.db.models import Q
 from django.utils import timezone
 from rest_framework_simplejwt.tokens import AccessToken
 from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
 
-from matching.models import Match
+from authentication.presence_service import PresenceService
+from authentication.ws_identity_service import WebSocketIdentityService
 from .models import Message
 from .services import MessageService
+from .signaling_service import BATCH_WINDOW_SECONDS, normalize_candidates
+from .typing_service import TypingService
+from .write_buffer import get_write_buffer
+from .ws_codec import BINARY_SUBPROTOCOL, FrameError, decode_binary, encode_binary, encode_frames, encode_json
 
 logger = logging.getLogger('hivmeet.messaging.websocket')
-User = get_user_model()
 
 
-class ConversationConsumer(AsyncWebsocketConsumer):
+def conversation_group(conversation_id) -> str:
+    """Channel layer group of a conversation."""
+    return f'conversation_{conversation_id}'
+
+
+def user_group(user_id) -> str:
+    """Channel layer group of a user (all of their sockets)."""
+    return f'user_{user_id}'
+
+
+class BaseMessagingConsumer(AsyncWebsocketConsumer):
     """
-    WebSocket consumer for real-time conversation management.
-    
-    Handles:
-    - Real-time message delivery
-    - Typing indicators
-    - Presence status
-    - WebRTC signaling
+    Authentication, conversation frames and conversation group events
+    shared by the messaging consumers.
     """
 
-    async def connect(self):
-        """Handle WebSocket connection."""
-        try:
-            # Extract conversation_id from URL
-            self.conversation_id = self.scope['url_route']['kwargs'].get('conversation_id')
-            
-            if not self.conversation_id:
-                await self.close(code=4001)  # Conversation not found
-                return
-            
-            # Authenticate user via JWT
-            await self._authenticate_user()
-            
-            if not hasattr(self, 'user') or not self.user:
-                await self.close(code=4000)  # Invalid token
-                return
-            
-            # Verify user has access to this conversation
-            match = await self._get_active_match()
-            if not match:
-                await self.close(code=4001)  # Conversation not found
-                return
-            
-            self.match = match
-            self.group_name = f'conversation_{self.conversation_id}'
-            
-            # Join room group
-            await self.channel_layer.group_add(
-                self.group_name,
-                self.channel_name
-            )
-            
+    # MessagePack frames, negotiated at connect
+    binary = False
+    # Batched ice.candidates frames, opted into with ?ice_batches=1; other
+    # sockets get one ice.candidate frame per candidate
+    ice_batches = False
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # ICE candidates waiting for their batch, and the batch flush tasks,
+        # per (conversation, call)
+        self._pending_ice = {}
+        self._ice_flushes = {}
+
+    async def _accept(self):
+        """Accept the connection, with the binary subprotocol if offered."""
+        query = parse_qs(self.scope.get('query_string', b'').decode())
+        self.ice_batches = (query.get('ice_batches') or ['0'])[0] == '1'
+        if BINARY_SUBPROTOCOL in self.scope.get('subprotocols', []):
+            self.binary = True
+            await self.accept(subprotocol=BINARY_SUBPROTOCOL)
+        else:
             await self.accept()
-            
-            # Set presence status to online
-            await self._set_presence_online()
-            
-            # Broadcast that user is now online
-            await self.channel_layer.group_send(
-                self.group_name,
-                {
-                    'type': 'presence_update',
-                    'user_id': str(self.user.id),
-                    'status': 'online',
-                    'timestamp': timezone.now().isoformat(),
-                }
-            )
-            
-            logger.info(
-                f'User {self.user.id} connected to conversation {self.conversation_id}'
-            )
-            
-        except Exception as e:
-            logger.error(f'Connection error: {str(e)}', exc_info=True)
-            await self.close(code=4999)  # Internal error
 
-    async def disconnect(self, close_code):
-        """Handle WebSocket disconnection."""
-        try:
-            if not hasattr(self, 'group_name'):
-                return
-            
-            # Leave room group
-            await self.channel_layer.group_discard(
-                self.group_name,
-                self.channel_name
-            )
-            
-            # Set presence status to offline
-            if hasattr(self, 'user'):
-                await self._set_presence_offline()
-                
-                # Broadcast that user is now offline
-                await self.channel_layer.group_send(
-                    self.group_name,
-                    {
-                        'type': 'presence_update',
-                        'user_id': str(self.user.id),
-                        'status': 'offline',
-                        'timestamp': timezone.now().isoformat(),
-                    }
-                )
-                
-                logger.info(
-                    f'User {self.user.id} disconnected from conversation {self.conversation_id}'
-                )
-        
-        except Exception as e:
-            logger.error(f'Disconnection error: {str(e)}', exc_info=True)
+    async def send_frame(self, payload):
+        """Encode and send a frame in the negotiated format."""
+        if self.binary:
+            await self.send(bytes_data=encode_binary(payload))
+        else:
+            await self.send(text_data=encode_json(payload))
+
+    async def _forward(self, event, frame_type, *fields):
+        """Send the frame of a group event, as pre-encoded by the sender if it was."""
+        frames = event.get('frames')
+        if frames:
+            if self.binary:
+                await self.send(bytes_data=frames['binary'])
+            else:
+                await self.send(text_data=frames['json'])
+            return
+        await self.send_frame({'type': frame_type, **{field: event.get(field) for field in fields}})
 
-    async def receive(self, text_data):
+    async def _broadcast(self, conversation_id, handler, frame):
+        """Send a frame to a conversation group, encoded once for all subscribers."""
+        await self.channel_layer.group_send(
+            conversation_group(conversation_id),
+            {**frame, 'type': handler, 'frames': encode_frames(frame)},
+        )
+
+    async def receive(self, text_data=None, bytes_data=None):
         """Handle incoming WebSocket messages."""
         try:
-            data = json.loads(text_data)
-            message_type = data.get('type')
-            
-            if message_type == 'message.send':
-                await self._handle_message_send(data)
-            elif message_type == 'typing.start':
-                await self._handle_typing_start(data)
-            elif message_type == 'typing.stop':
-                await self._handle_typing_stop(data)
-            elif message_type == 'ping':
-                await self.send(text_data=json.dumps({
-                    'type': 'pong',
-                    'timestamp': timezone.now().isoformat(),
-                }))
-            elif message_type == 'ice.candidate':
-                await self._handle_ice_candidate(data)
-            elif message_type == 'offer':
-                await self._handle_offer(data)
-            elif message_type == 'answer':
-                await self._handle_answer(data)
+            if bytes_data is not None:
+                data = decode_binary(bytes_data)
             else:
-                logger.warning(f'Unknown message type: {message_type}')
-                
+                data = json.loads(text_data)
+            await self._handle_frame(data.get('type'), data)
+
         except json.JSONDecodeError:
             logger.warning('Invalid JSON received')
-            await self.send(text_data=json.dumps({
-                'type': 'error',
-                'message': 'Invalid JSON',
-                'code': 'INVALID_JSON',
-            }))
+            await self._send_error('Invalid JSON', 'INVALID_JSON')
+        except FrameError:
+            logger.warning('Invalid binary frame received')
+            await self._send_error('Invalid frame', 'INVALID_FRAME')
         except Exception as e:
             logger.error(f'Error processing message: {str(e)}', exc_info=True)
-            await self.send(text_data=json.dumps({
-                'type': 'error',
-                'message': 'Server error',
-                'code': 'INTERNAL_ERROR',
-            }))
+            await self._send_error('Server error', 'INTERNAL_ERROR')
+
+    async def _handle_frame(self, message_type, data):
+        raise NotImplementedError
+
+    async def _handle_conversation_frame(self, conversation_id, message_type, data):
+        """Dispatch a frame scoped to a conversation."""
+        if message_type == 'message.send':
+            await self._handle_message_send(conversation_id, data)
+        elif message_type == 'typing.start':
+            await self._handle_typing_start(conversation_id, data)
+        elif message_type == 'typing.stop':
+            await self._handle_typing_stop(conversation_id, data)
+        elif message_type in ('ice.candidate', 'ice.candidates'):
+            await self._handle_ice_candidate(conversation_id, data)
+        elif message_type == 'offer':
+            await self._handle_offer(conversation_id, data)
+        elif message_type == 'answer':
+            await self._handle_answer(conversation_id, data)
+        else:
+            logger.warning(f'Unknown message type: {message_type}')
+
+    async def _send_pong(self):
+        await self.send_frame({
+            'type': 'pong',
+            'timestamp': timezone.now().isoformat(),
+        })
+
+    async def _send_error(self, message, code, **extra):
+        await self.send_frame({
+            'type': 'error',
+            'message': message,
+            'code': code,
+            **extra,
+        })
+
+    async def _broadcast_presence(self, conversation_id, status):
+        await self._broadcast(conversation_id, 'presence_update', {
+            'type': 'presence.update',
+            'conversation_id': str(conversation_id),
+            'user_id': str(self.user.id),
+            'status': status,
+            'timestamp': timezone.now().isoformat(),
+        })
 
     # Message handlers
-    async def _handle_message_send(self, data):
+    async def _handle_message_send(self, conversation_id, data):
         """Handle real-time message sending."""
         try:
             content = data.get('content', '').strip()
             client_message_id = data.get('client_message_id')
-            
+
             if not content:
-                await self.send(text_data=json.dumps({
-                    'type': 'error',
-                    'message': 'Message cannot be empty',
-                    'code': 'EMPTY_MESSAGE',
-                }))
+                await self._send_error('Message cannot be empty', 'EMPTY_MESSAGE')
                 return
-            
+
+            # Acknowledge once queued, message.created follows once stored
+            await self.send_frame({
+                'type': 'message.queued',
+                'conversation_id': str(conversation_id),
+                'client_message_id': client_message_id,
+            })
+
             # Create message in database
             message = await self._create_message(
+                conversation_id,
                 content=content,
                 client_message_id=client_message_id,
             )
-            
+
             if not message:
-                await self.send(text_data=json.dumps({
-                    'type': 'error',
-                    'message': 'Failed to create message',
-                    'code': 'CREATION_FAILED',
-                }))
+                await self._send_error('Failed to create message', 'CREATION_FAILED')
                 return
-            
+
             # Broadcast message to group
-            await self.channel_layer.group_send(
-                self.group_name,
-                {
-                    'type': 'message_created',
-                    'message_id': str(message.id),
-                    'conversation_id': str(message.match_id),
-                    'sender_id': str(message.sender_id),
-                    'content': message.content,
-                    'message_type': message.message_type,
-                    'sent_at': message.created_at.isoformat(),
-                    'client_message_id': client_message_id,
-                }
-            )
-            
+            await self._broadcast(conversation_id, 'message_created', {
+                'type': 'message.created',
+                'message_id': str(message.id),
+                'conversation_id': str(message.match_id),
+                'sender_id': str(message.sender_id),
+                'content': message.content,
+                'message_type': message.message_type,
+                'sent_at': message.created_at.isoformat(),
+                'client_message_id': client_message_id,
+            })
+
             logger.info(f'Message created: {message.id}')
-            
+
         except Exception as e:
             logger.error(f'Error sending message: {str(e)}', exc_info=True)
-            await self.send(text_data=json.dumps({
-                'type': 'error',
-                'message': 'Failed to send message',
-                'code': 'SEND_FAILED',
-            }))
+            await self._send_error('Failed to send message', 'SEND_FAILED')
 
-    async def _handle_typing_start(self, data):
+    async def _handle_typing_start(self, conversation_id, data):
         """Handle typing indicator start."""
         try:
-            # Set typing indicator in cache (TTL 10 seconds)
-            cache_key = f'typing_{self.conversation_id}_{self.user.id}'
-            cache.set(cache_key, True, timeout=10)
-            
+            # Ephemeral and throttled, most keystroke events stop here. Cache
+            # round-trips run off the event loop; they do not touch the
+            # database, so any worker thread will do
+            if not await sync_to_async(TypingService.start, thread_sensitive=False)(conversation_id, self.user.id):
+                return
+
             # Broadcast to group
-            await self.channel_layer.group_send(
-                self.group_name,
-                {
-                    'type': 'typing_indicator',
-                    'user_id': str(self.user.id),
-                    'status': 'typing',
-                }
-            )
-            
+            await self._broadcast(conversation_id, 'typing_indicator', {
+                'type': 'typing.indicator',
+                'conversation_id': str(conversation_id),
+                'user_id': str(self.user.id),
+                'status': 'typing',
+            })
+
         except Exception as e:
             logger.error(f'Error handling typing start: {str(e)}')
 
-    async def _handle_typing_stop(self, data):
+    async def _handle_typing_stop(self, conversation_id, data):
         """Handle typing indicator stop."""
         try:
-            # Clear typing indicator from cache
-            cache_key = f'typing_{self.conversation_id}_{self.user.id}'
-            cache.delete(cache_key)
-            
+            if not await sync_to_async(TypingService.stop, thread_sensitive=False)(conversation_id, self.user.id):
+                return
+
             # Broadcast to group
-            await self.channel_layer.group_send(
-                self.group_name,
-                {
-                    'type': 'typing_indicator',
-                    'user_id': str(self.user.id),
-                    'status': 'stopped',
-                }
-            )
-            
+            await self._broadcast(conversation_id, 'typing_indicator', {
+                'type': 'typing.indicator',
+                'conversation_id': str(conversation_id),
+                'user_id': str(self.user.id),
+                'status': 'stopped',
+            })
+
         except Exception as e:
             logger.error(f'Error handling typing stop: {str(e)}')
 
-    async def _handle_ice_candidate(self, data):
-        """Handle WebRTC ICE candidate."""
+    async def _handle_ice_candidate(self, conversation_id, data):
+        """
+        Handle WebRTC ICE candidates (one, or a `candidates` list). Candidates
+        received within BATCH_WINDOW_SECONDS are relayed as one batch.
+        """
+        candidates = normalize_candidates(data)
+        if not candidates:
+            return
+
+        key = (conversation_id, data.get('call_id'))
+        self._pending_ice.setdefault(key, []).extend(candidates)
+        if key not in self._ice_flushes:
+            self._ice_flushes[key] = asyncio.ensure_future(self._flush_ice_later(key))
+
+    async def _flush_ice_later(self, key):
+        await asyncio.sleep(BATCH_WINDOW_SECONDS)
+        await self._flush_ice(key)
+
+    async def _flush_ice(self, key):
+        """Relay the pending ICE candidates of a (conversation, call)."""
+        self._ice_flushes.pop(key, None)
+        candidates = self._pending_ice.pop(key, [])
+        if not candidates:
+            return
+
+        conversation_id, call_id = key
         try:
-            candidate = data.get('candidate')
-            sdp_mid = data.get('sdpMid')
-            sdp_m_line_index = data.get('sdpMLineIndex')
-            
-            if not candidate:
-                return
-            
-            # Broadcast to group
-            await self.channel_layer.group_send(
-                self.group_name,
-                {
-                    'type': 'ice_candidate',
-                    'from_user_id': str(self.user.id),
-                    'candidate': candidate,
-                    'sdpMid': sdp_mid,
-                    'sdpMLineIndex': sdp_m_line_index,
-                }
-            )
-            
+            await self._broadcast(conversation_id, 'ice_candidates', {
+                'type': 'ice.candidates',
+                'conversation_id': str(conversation_id),
+                'call_id': str(call_id) if call_id else None,
+                'from_user_id': str(self.user.id),
+                'candidates': candidates,
+            })
         except Exception as e:
             logger.error(f'Error handling ICE candidate: {str(e)}')
 
-    async def _handle_offer(self, data):
+    async def _flush_all_ice(self):
+        """Relay pending ICE candidates without waiting, e.g. on disconnect."""
+        for key, task in list(self._ice_flushes.items()):
+            task.cancel()
+            await self._flush_ice(key)
+
+    async def _handle_offer(self, conversation_id, data):
         """Handle WebRTC offer."""
         try:
             offer = data.get('offer')
             call_id = data.get('call_id')
-            
+
             if not offer:
                 return
-            
+
             # Broadcast to group
-            await self.channel_layer.group_send(
-                self.group_name,
-                {
-                    'type': 'webrtc_offer',
-                    'from_user_id': str(self.user.id),
-                    'call_id': call_id,
-                    'offer': offer,
-                }
-            )
-            
+            await self._broadcast(conversation_id, 'webrtc_offer', {
+                'type': 'webrtc.offer',
+                'conversation_id': str(conversation_id),
+                'from_user_id': str(self.user.id),
+                'call_id': call_id,
+                'offer': offer,
+            })
+
         except Exception as e:
             logger.error(f'Error handling offer: {str(e)}')
 
-    async def _handle_answer(self, data):
+    async def _handle_answer(self, conversation_id, data):
         """Handle WebRTC answer."""
         try:
             answer = data.get('answer')
             call_id = data.get('call_id')
-            
+
             if not answer:
                 return
-            
+
             # Broadcast to group
-            await self.channel_layer.group_send(
-                self.group_name,
-                {
-                    'type': 'webrtc_answer',
-                    'from_user_id': str(self.user.id),
-                    'call_id': call_id,
-                    'answer': answer,
-                }
-            )
-            
+            await self._broadcast(conversation_id, 'webrtc_answer', {
+                'type': 'webrtc.answer',
+                'conversation_id': str(conversation_id),
+                'from_user_id': str(self.user.id),
+                'call_id': call_id,
+                'answer': answer,
+            })
+
         except Exception as e:
             logger.error(f'Error handling answer: {str(e)}')
 
     # Group event handlers (from channel_layer.group_send)
     async def message_created(self, event):
         """Handle message created event from group."""
-        await self.send(text_data=json.dumps({
-            'type': 'message.created',
-            'message_id': event['message_id'],
-            'conversation_id': event['conversation_id'],
-            'sender_id': event['sender_id'],
-            'content': event['content'],
-            'message_type': event.get('message_type', 'text'),
-            'sent_at': event['sent_at'],
-            'client_message_id': event.get('client_message_id'),
-        }))
+        await self._forward(
+            event, 'message.created',
+            'message_id', 'conversation_id', 'sender_id', 'content', 'message_type', 'sent_at', 'client_message_id',
+        )
 
     async def typing_indicator(self, event):
         """Handle typing indicator event from group."""
         # Don't send own typing status back to self
         if event['user_id'] == str(self.user.id) and event['status'] == 'typing':
             return
-        
-        await self.send(text_data=json.dumps({
-            'type': 'typing.indicator',
-            'user_id': event['user_id'],
-            'status': event['status'],
-        }))
+
+        await self._forward(event, 'typing.indicator', 'conversation_id', 'user_id', 'status')
 
     async def presence_update(self, event):
         """Handle presence update event from group."""
         # Don't send own presence back to self
         if event['user_id'] == str(self.user.id):
             return
-        
-        await self.send(text_data=json.dumps({
-            'type': 'presence.update',
-            'user_id': event['user_id'],
-            'status': event['status'],
-            'timestamp': event['timestamp'],
-        }))
 
-    async def ice_candidate(self, event):
-        """Handle ICE candidate event from group."""
+        await self._forward(event, 'presence.update', 'conversation_id', 'user_id', 'status', 'timestamp')
+
+    async def messages_read(self, event):
+        """Handle read watermark event from group."""
+        await self._forward(
+            event, 'messages.read',
+            'conversation_id', 'reader_id', 'last_read_message_id', 'read_at',
+        )
+
+    async def message_media_ready(self, event):
+        """Handle processed media event from group."""
+        await self._forward(
+            event, 'message.updated',
+            'conversation_id', 'message_id', 'media_status', 'media_url', 'media_thumbnail_url', 'media_info',
+        )
+
+    async def ice_candidates(self, event):
+        """Handle batched ICE candidates event from group."""
         # Only send to users that are not the sender
         if event['from_user_id'] == str(self.user.id):
             return
-        
-        await self.send(text_data=json.dumps({
-            'type': 'ice.candidate',
-            'from_user_id': event['from_user_id'],
-            'candidate': event['candidate'],
-            'sdpMid': event.get('sdpMid'),
-            'sdpMLineIndex': event.get('sdpMLineIndex'),
-        }))
+
+        if self.ice_batches:
+            await self._forward(event, 'ice.candidates', 'conversation_id', 'call_id', 'from_user_id', 'candidates')
+            return
+
+        for candidate in event['candidates']:
+            await self.send_frame({
+                'type': 'ice.candidate',
+                'conversation_id': event['conversation_id'],
+                'call_id': event.get('call_id'),
+                'from_user_id': event['from_user_id'],
+                **candidate,
+            })
 
     async def webrtc_offer(self, event):
         """Handle WebRTC offer event from group."""
         # Only send to users that are not the sender
         if event['from_user_id'] == str(self.user.id):
             return
-        
-        await self.send(text_data=json.dumps({
-            'type': 'webrtc.offer',
-            'from_user_id': event['from_user_id'],
-            'call_id': event.get('call_id'),
-            'offer': event['offer'],
-        }))
+
+        await self._forward(event, 'webrtc.offer', 'conversation_id', 'from_user_id', 'call_id', 'offer')
 
     async def webrtc_answer(self, event):
         """Handle WebRTC answer event from group."""
         # Only send to users that are not the sender
         if event['from_user_id'] == str(self.user.id):
             return
-        
-        await self.send(text_data=json.dumps({
-            'type': 'webrtc.answer',
-            'from_user_id': event['from_user_id'],
-            'call_id': event.get('call_id'),
-            'answer': event['answer'],
-        }))
+
+        await self._forward(event, 'webrtc.answer', 'conversation_id', 'from_user_id', 'call_id', 'answer')
 
     # Helper methods
     async def _authenticate_user(self):
@@ -424,7 +417,7 @@ class ConversationConsumer(AsyncWebsocketConsumer):
             # Try token from Authorization header first
             headers = dict(self.scope.get('headers', []))
             auth_header = headers.get(b'authorization', b'').decode()
-            
+
             if auth_header.startswith('Bearer '):
                 token = auth_header.split(' ')[1]
 
@@ -437,93 +430,329 @@ class ConversationConsumer(AsyncWebsocketConsumer):
             if not token:
                 self.user = None
                 return
-            
+
             # Decode JWT
             try:
-                access_token = AccessToken(token)
-                user_id = access_token['user_id']
-                self.user = await database_sync_to_async(User.objects.get)(id=user_id)
-            except (InvalidToken, TokenError, User.DoesNotExist):
+                self.access_token = AccessToken(token)
+            except (InvalidToken, TokenError):
                 self.user = None
-                
+                return
+
+            identity = await self._get_identity()
+            self.user = identity['user'] if identity else None
+
         except Exception as e:
             logger.error(f'Authentication error: {str(e)}')
             self.user = None
 
-    async def _get_active_match(self):
-        """Verify user has access to conversation."""
+    async def _get_identity(self):
+        """
+        User and conversations of the socket's token: cached, so reconnects
+        do not query the database (see WebSocketIdentityService).
+        """
+        identity = WebSocketIdentityService.get_cached(self.access_token)
+        if identity is None:
+            identity = await database_sync_to_async(WebSocketIdentityService.load)(self.access_token)
+        return identity
+
+    async def _get_conversation_peer(self, conversation_id):
+        """Verify user has access to conversation; returns the other participant's ID."""
         try:
-            match = await database_sync_to_async(
-                lambda: Match.objects.filter(
-                    Q(user1=self.user) | Q(user2=self.user),
-                    id=self.conversation_id,
-                    status=Match.ACTIVE,
-                ).select_related('user1', 'user2').first()
-            )()
-            return match
+            identity = await self._get_identity()
+            if identity is None:
+                return None
+            return WebSocketIdentityService.get_peer_id(identity, conversation_id)
         except Exception as e:
             logger.error(f'Error getting match: {str(e)}')
             return None
 
-    async def _set_presence_online(self):
-        """Set user presence to online in Redis."""
+    async def _presence_heartbeat(self):
+        """
+        Register or refresh this socket's presence session (connect and ping).
+        Matches are told when the user comes online.
+        """
         try:
-            cache_key = f'presence_{self.user.id}_{self.conversation_id}'
-            cache.set(cache_key, {
-                'status': 'online',
-                'timestamp': timezone.now().isoformat(),
-            }, timeout=3600)  # 1 hour TTL
+            if await sync_to_async(PresenceService.heartbeat, thread_sensitive=False)(self.user.id, self.channel_name):
+                await database_sync_to_async(PresenceService.broadcast_change)(self.user.id, 'online')
         except Exception as e:
             logger.error(f'Error setting presence online: {str(e)}')
 
-    async def _set_presence_offline(self):
-        """Set user presence to offline in Redis."""
+    async def _presence_disconnect(self):
+        """Drop this socket's presence session; matches are told if it was the last one."""
         try:
-            cache_key = f'presence_{self.user.id}_{self.conversation_id}'
-            cache.delete(cache_key)
+            if await sync_to_async(PresenceService.disconnect, thread_sensitive=False)(self.user.id, self.channel_name):
+                await database_sync_to_async(PresenceService.broadcast_change)(self.user.id, 'offline')
         except Exception as e:
             logger.error(f'Error setting presence offline: {str(e)}')
 
-    async def _create_message(self, content, client_message_id=None):
-        """Create message in database."""
+    async def _create_message(self, conversation_id, content, client_message_id=None):
+        """
+        Create message in database.
+        Inserts are batched by the write buffer; returns once committed.
+        """
         try:
-            # Check for deduplication
-            if client_message_id:
-                existing = await database_sync_to_async(
-                    lambda: Message.objects.filter(
-                        client_message_id=client_message_id,
-                        match_id=self.conversation_id,
-                        sender=self.user,
-                    ).first()
-                , thread_sensitive=False)()
-                if existing:
-                    return existing
-            
-            # Create message
             message = Message(
-                match_id=self.conversation_id,
+                match_id=conversation_id,
                 sender=self.user,
                 content=content,
                 message_type=Message.TEXT,
                 client_message_id=client_message_id or '',
                 status=Message.SENT,
             )
-            await database_sync_to_async(Message.objects.bulk_create, thread_sensitive=False)([message])
-            
-            # Update match last_message_at
-            await database_sync_to_async(self._update_match_timestamp, thread_sensitive=False)()
-            
-            return message
-            
+            return await get_write_buffer().submit(message)
+
         except Exception as e:
             logger.error(f'Error creating message: {str(e)}')
             return None
 
-    def _update_match_timestamp(self):
-        """Update match last_message_at timestamp."""
+
+class ConversationConsumer(BaseMessagingConsumer):
+    """
+    WebSocket consumer for a single conversation.
+
+    Handles:
+    - Real-time message delivery
+    - Typing indicators
+    - Presence status
+    - WebRTC signaling
+    """
+
+    async def connect(self):
+        """Handle WebSocket connection."""
         try:
-            Match.objects.filter(id=self.conversation_id).update(
-                last_message_at=timezone.now()
+            # Extract conversation_id from URL
+            self.conversation_id = self.scope['url_route']['kwargs'].get('conversation_id')
+
+            if not self.conversation_id:
+                await self.close(code=4001)  # Conversation not found
+                return
+
+            # Authenticate user via JWT
+            await self._authenticate_user()
+
+            if not hasattr(self, 'user') or not self.user:
+                await self.close(code=4000)  # Invalid token
+                return
+
+            # Verify user has access to this conversation
+            if not await self._get_conversation_peer(self.conversation_id):
+                await self.close(code=4001)  # Conversation not found
+                return
+
+            self.group_name = conversation_group(self.conversation_id)
+
+            # Join room group
+            await self.channel_layer.group_add(
+                self.group_name,
+                self.channel_name
+            )
+
+            await self._accept()
+
+            # Set presence status to online
+            await self._presence_heartbeat()
+
+            # Broadcast that user is now online
+            await self._broadcast_presence(self.conversation_id, 'online')
+
+            logger.info(
+                f'User {self.user.id} connected to conversation {self.conversation_id}'
+            )
+
+        except Exception as e:
+            logger.error(f'Connection error: {str(e)}', exc_info=True)
+            await self.close(code=4999)  # Internal error
+
+    async def disconnect(self, close_code):
+        """Handle WebSocket disconnection."""
+        try:
+            if not hasattr(self, 'group_name'):
+                return
+
+            await self._flush_all_ice()
+
+            # Leave room group
+            await self.channel_layer.group_discard(
+                self.group_name,
+                self.channel_name
             )
+
+            # Set presence status to offline
+            if hasattr(self, 'user'):
+                await self._presence_disconnect()
+
+                # Broadcast that user is now offline
+                await self._broadcast_presence(self.conversation_id, 'offline')
+
+                logger.info(
+                    f'User {self.user.id} disconnected from conversation {self.conversation_id}'
+                )
+
         except Exception as e:
-            logger.error(f'Error updating match timestamp: {str(e)}')
+            logger.error(f'Disconnection error: {str(e)}', exc_info=True)
+
+    async def _handle_frame(self, message_type, data):
+        if message_type == 'ping':
+            await self._presence_heartbeat()
+            await self._send_pong()
+        else:
+            await self._handle_conversation_frame(self.conversation_id, message_type, data)
+
+
+class UserConsumer(BaseMessagingConsumer):
+    """
+    WebSocket consumer multiplexing all of a user's real-time traffic.
+
+    Client frames:
+    - {"type": "subscribe", "conversation_id": ...}
+    - {"type": "unsubscribe", "conversation_id": ...}
+    - conversation frames (message.send, typing.start, ...) with a
+      conversation_id the socket is subscribed to
+    """
+
+    # Conversation groups one socket may join
+    max_subscriptions = 50
+
+    async def connect(self):
+        """Handle WebSocket connection."""
+        try:
+            await self._authenticate_user()
+
+            if not hasattr(self, 'user') or not self.user:
+                await self.close(code=4000)  # Invalid token
+                return
+
+            self.subscriptions = set()
+            self.group_name = user_group(self.user.id)
+            await self.channel_layer.group_add(self.group_name, self.channel_name)
+
+            await self._accept()
+            await self._presence_heartbeat()
+
+            logger.info(f'User {self.user.id} connected')
+
+        except Exception as e:
+            logger.error(f'Connection error: {str(e)}', exc_info=True)
+            await self.close(code=4999)  # Internal error
+
+    async def disconnect(self, close_code):
+        """Handle WebSocket disconnection."""
+        try:
+            if not hasattr(self, 'group_name'):
+                return
+
+            await self._flush_all_ice()
+            for conversation_id in list(self.subscriptions):
+                await self._unsubscribe(conversation_id)
+            await self.channel_layer.group_discard(self.group_name, self.channel_name)
+            await self._presence_disconnect()
+
+            logger.info(f'User {self.user.id} disconnected')
+
+        except Exception as e:
+            logger.error(f'Disconnection error: {str(e)}', exc_info=True)
+
+    async def _handle_frame(self, message_type, data):
+        if message_type == 'ping':
+            await self._presence_heartbeat()
+            await self._send_pong()
+            return
+
+        conversation_id = str(data.get('conversation_id') or '')
+        if message_type == 'subscribe':
+            await self._subscribe(conversation_id)
+        elif message_type == 'unsubscribe':
+            if conversation_id in self.subscriptions:
+                await self._unsubscribe(conversation_id)
+            await self.send_frame({
+                'type': 'unsubscribed',
+                'conversation_id': conversation_id,
+            })
+        elif conversation_id in self.subscriptions:
+            await self._handle_conversation_frame(conversation_id, message_type, data)
+        else:
+            await self._send_error(
+                'Not subscribed to this conversation', 'NOT_SUBSCRIBED',
+                conversation_id=conversation_id or None,
+            )
+
+    async def _subscribe(self, conversation_id):
+        if conversation_id in self.subscriptions:
+            await self.send_frame({'type': 'subscribed', 'conversation_id': conversation_id})
+            return
+        if len(self.subscriptions) >= self.max_subscriptions:
+            await self._send_error('Too many subscriptions', 'TOO_MANY_SUBSCRIPTIONS', conversation_id=conversation_id)
+            return
+
+        other_user_id = await self._get_conversation_peer(conversation_id) if conversation_id else None
+        if not other_user_id:
+            await self._send_error('Conversation not found', 'CONVERSATION_NOT_FOUND', conversation_id=conversation_id or None)
+            return
+
+        self.subscriptions.add(conversation_id)
+        await self.channel_layer.group_add(conversation_group(conversation_id), self.channel_name)
+        # Later presence changes arrive on the user group (presence.update)
+        other_user_online = await sync_to_async(PresenceService.is_online, thread_sensitive=False)(other_user_id)
+        await self.send_frame({
+            'type': 'subscribed',
+            'conversation_id': conversation_id,
+            'other_user_online': other_user_online,
+        })
+
+    async def _unsubscribe(self, conversation_id):
+        self.subscriptions.discard(conversation_id)
+        await self.channel_layer.group_discard(conversation_group(conversation_id), self.channel_name)
+
+    # User group event handlers (matching/signals.py, messaging/signals.py)
+    async def new_message(self, event):
+        """Handle new message event for a conversation the socket is not subscribed to."""
+        message = event['message']
+        # Subscribed conversations already get message.created
+        if message.get('conversation_id') in self.subscriptions:
+            return
+
+        await self.send_frame({
+            'type': 'message.new',
+            'conversation_id': message.get('conversation_id'),
+            'message': message,
+        })
+
+    async def new_match(self, event):
+        """Handle new match event."""
+        await self.send_frame({
+            'type': 'match.new',
+            'match_id': event['match_id'],
+            'matched_user_id': event['matched_user_id'],
+        })
+
+    async def like(self, event):
+        """Handle like received event."""
+        await self.send_frame({
+            'type': 'like.received',
+            'from_user_id': event['from_user_id'],
+            'like_id': event['like_id'],
+            'is_super_like': False,
+        })
+
+    async def super_like(self, event):
+        """Handle super like received event."""
+        await self.send_frame({
+            'type': 'like.received',
+            'from_user_id': event['from_user_id'],
+            'like_id': event['like_id'],
+            'is_super_like': True,
+        })
+
+    async def incoming_call(self, event):
+        """Handle incoming call event."""
+        await self.send_frame({
+            'type': 'call.incoming',
+            'call': event['call'],
+        })
+
+    async def call_update(self, event):
+        """Handle call status update event."""
+        await self.send_frame({
+            'type': 'call.update',
+            'call': event['call'],
+        })
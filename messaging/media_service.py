@@ -0,0 +1,295 @@
+"""
+Processing of message media attachments.
+
+Files live in MESSAGE_MEDIA_STORAGE, a Django storage class: the local
+FileSystemStorage under MEDIA_ROOT by default, or e.g. a django-storages
+cloud backend in production. Once a media message is committed,
+messaging.tasks.process_message_media runs on the Celery workers and
+stores, next to the original:
+
+- images: downscaled renditions (RENDITION_SIZES, EXIF metadata stripped),
+  a thumbnail and a blurhash placeholder;
+- videos: a poster frame, extracted with ffmpeg when it is installed, then
+  thumbnailed like an image;
+- audio: nothing, the original is served as is.
+
+Clients either post the file to the API, or ask for an upload target
+(get_upload_target): a signed PUT URL of the storage bucket when the storage
+backend supports one (Google Cloud Storage, S3), else a signed token for the
+API upload route. Either way the file lands under the conversation's prefix,
+the only paths processed for its messages.
+
+media_url then points to the large rendition instead of the original,
+media_thumbnail_url to the thumbnail, and the conversation is sent a
+message_media_ready event (plus a sync change for offline clients).
+"""
+import io
+import logging
+import os
+import posixpath
+import shutil
+import subprocess
+import tempfile
+from datetime import timedelta
+from typing import Optional
+from uuid import uuid4
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.core import signing
+from django.core.files.base import ContentFile
+from django.core.files.storage import Storage
+from django.db import transaction
+from django.utils.module_loading import import_string
+from django.utils.text import get_valid_filename
+from PIL import Image, ImageOps
+
+from . import blurhash
+from .models import Message, SyncChange
+
+logger = logging.getLogger('hivmeet.messaging')
+
+# Longest side of each image rendition, largest first
+RENDITION_SIZES = {'large': 1600, 'medium': 800}
+THUMBNAIL_SIZE = 320
+JPEG_QUALITY = 82
+
+# Seconds into a video of the poster frame (first frame for shorter videos)
+POSTER_OFFSETS = ('1', '0')
+FFMPEG_TIMEOUT_SECONDS = 60
+
+# Files of a conversation are stored under MEDIA_PREFIX/<match id>/; only
+# those are processed for its messages (paths may come from clients)
+MEDIA_PREFIX = 'messages/'
+
+MAX_UPLOAD_BYTES = 10 * 1024 * 1024
+UPLOAD_URL_EXPIRES_SECONDS = 15 * 60
+UPLOAD_TOKEN_SALT = 'messaging.media_upload'
+
+
+class MessageMediaService:
+    """
+    Service for message media storage and processing.
+    """
+
+    @staticmethod
+    def get_storage() -> Storage:
+        return import_string(
+            getattr(settings, 'MESSAGE_MEDIA_STORAGE', 'django.core.files.storage.FileSystemStorage')
+        )()
+
+    @staticmethod
+    def save_upload(match, media_file) -> str:
+        """Store an uploaded file of a conversation; returns its storage path."""
+        path = MessageMediaService.new_path(match.id, media_file.name)
+        return MessageMediaService.get_storage().save(path, media_file)
+
+    @staticmethod
+    def new_path(match_id, file_name: Optional[str]) -> str:
+        """Unique storage path for a new file of a conversation."""
+        name = get_valid_filename(os.path.basename(file_name or '')) or 'upload'
+        return f'{MessageMediaService.get_prefix(match_id)}{uuid4()}_{name}'
+
+    @staticmethod
+    def get_upload_target(match, file_name: Optional[str], content_type: str) -> dict:
+        """
+        Where a client uploads a new file of a conversation: {'path', 'url'}
+        with a signed storage URL, or {'path', 'token'} for the API upload
+        route when the storage cannot sign uploads.
+        """
+        path = MessageMediaService.new_path(match.id, file_name)
+        url = MessageMediaService._signed_upload_url(MessageMediaService.get_storage(), path, content_type)
+        if url:
+            return {'path': path, 'url': url}
+        token = signing.dumps({'match_id': str(match.id), 'path': path}, salt=UPLOAD_TOKEN_SALT)
+        return {'path': path, 'token': token}
+
+    @staticmethod
+    def _signed_upload_url(storage: Storage, path: str, content_type: str) -> Optional[str]:
+        """Signed PUT URL of the storage bucket, None if the backend has none."""
+        bucket = getattr(storage, 'bucket', None)
+        if bucket is None:
+            return None
+        location = getattr(storage, 'location', '') or ''
+        key = posixpath.join(location, path) if location else path
+        if hasattr(bucket, 'blob'):
+            # django-storages GoogleCloudStorage
+            return bucket.blob(key).generate_signed_url(
+                version='v4',
+                expiration=timedelta(seconds=UPLOAD_URL_EXPIRES_SECONDS),
+                method='PUT',
+                content_type=content_type,
+            )
+        if hasattr(bucket, 'meta'):
+            # django-storages S3Storage (boto3 Bucket)
+            return bucket.meta.client.generate_presigned_url(
+                'put_object',
+                Params={'Bucket': bucket.name, 'Key': key, 'ContentType': content_type},
+                ExpiresIn=UPLOAD_URL_EXPIRES_SECONDS,
+            )
+        return None
+
+    @staticmethod
+    def read_upload_token(token: str, match_id) -> Optional[str]:
+        """Path of a valid, unexpired upload token of the conversation, else None."""
+        try:
+            data = signing.loads(token, salt=UPLOAD_TOKEN_SALT, max_age=UPLOAD_URL_EXPIRES_SECONDS)
+        except signing.BadSignature:
+            return None
+        path = data.get('path', '')
+        if data.get('match_id') != str(match_id) or not MessageMediaService.is_conversation_path(match_id, path):
+            return None
+        return path
+
+    @staticmethod
+    def save_at(path: str, content: bytes) -> bool:
+        """Store a file at an exact path; False if the path is already taken."""
+        storage = MessageMediaService.get_storage()
+        saved = storage.save(path, ContentFile(content))
+        if saved != path:
+            storage.delete(saved)
+            return False
+        return True
+
+    @staticmethod
+    def get_prefix(match_id) -> str:
+        """Storage prefix of a conversation's files."""
+        return f'{MEDIA_PREFIX}{match_id}/'
+
+    @staticmethod
+    def is_conversation_path(match_id, path: str) -> bool:
+        """True if path is a file of the conversation, without '..' segments."""
+        return posixpath.normpath(path) == path and path.startswith(MessageMediaService.get_prefix(match_id))
+
+    @staticmethod
+    def process(message_id) -> bool:
+        """
+        Generate the renditions of a message's media and publish them.
+        Returns False if there was nothing to process.
+        """
+        message = Message.objects.filter(id=message_id).defer('search_vector').first()
+        if message is None or message.media_status != Message.MEDIA_PENDING:
+            return False
+
+        storage = MessageMediaService.get_storage()
+        path = message.media_file_path
+        try:
+            if not MessageMediaService.is_conversation_path(message.match_id, path) or not storage.exists(path):
+                raise ValueError(f'Media file not found: {path}')
+            base = os.path.splitext(path)[0]
+            if message.message_type == Message.IMAGE:
+                with storage.open(path) as media_file:
+                    updates = MessageMediaService._process_image(storage, base, Image.open(media_file))
+            elif message.message_type == Message.VIDEO:
+                updates = {'media_url': storage.url(path), 'media_info': {}}
+                poster = MessageMediaService._extract_poster(storage, path)
+                if poster is not None:
+                    images = MessageMediaService._process_image(storage, f'{base}_poster', poster, renditions=False)
+                    updates['media_thumbnail_url'] = images['media_thumbnail_url']
+                    updates['media_info'] = images['media_info']
+            else:
+                updates = {'media_url': storage.url(path), 'media_info': {}}
+            updates['media_status'] = Message.MEDIA_READY
+        except Exception as e:
+            logger.warning(f"Media processing failed for message {message_id}: {str(e)}")
+            updates = {'media_status': Message.MEDIA_FAILED}
+
+        with transaction.atomic():
+            Message.objects.filter(id=message.id).update(**updates)
+            SyncChange.record(SyncChange.message_updated(message))
+        for field, value in updates.items():
+            setattr(message, field, value)
+
+        MessageMediaService._broadcast_ready(message)
+        return updates['media_status'] == Message.MEDIA_READY
+
+    @staticmethod
+    def _process_image(storage: Storage, base: str, image: Image.Image, renditions: bool = True) -> dict:
+        """Store renditions and a thumbnail of an image; returns the message updates."""
+        image = ImageOps.exif_transpose(image)
+        if image.mode in ('RGBA', 'LA', 'P'):
+            image = image.convert('RGBA')
+            background = Image.new('RGB', image.size, (255, 255, 255))
+            background.paste(image, mask=image.split()[-1])
+            image = background
+        elif image.mode != 'RGB':
+            image = image.convert('RGB')
+
+        width, height = image.size
+        info = {'width': width, 'height': height, 'blurhash': blurhash.encode(image)}
+        updates = {'media_info': info}
+
+        if renditions:
+            info['renditions'] = {}
+            for name, size in RENDITION_SIZES.items():
+                # The large rendition always exists: it replaces the original
+                if name != 'large' and max(width, height) <= size:
+                    continue
+                info['renditions'][name] = MessageMediaService._save_jpeg(storage, f'{base}_{name}.jpg', image, size)
+            updates['media_url'] = info['renditions']['large']
+
+        updates['media_thumbnail_url'] = MessageMediaService._save_jpeg(storage, f'{base}_thumb.jpg', image, THUMBNAIL_SIZE)
+        return updates
+
+    @staticmethod
+    def _save_jpeg(storage: Storage, name: str, image: Image.Image, size: int) -> str:
+        """Store a copy of an image downscaled to fit size x size; returns its URL."""
+        copy = image.copy()
+        copy.thumbnail((size, size), Image.Resampling.LANCZOS)
+        buffer = io.BytesIO()
+        copy.save(buffer, format='JPEG', quality=JPEG_QUALITY, optimize=True)
+        return storage.url(storage.save(name, ContentFile(buffer.getvalue())))
+
+    @staticmethod
+    def _extract_poster(storage: Storage, path: str) -> Optional[Image.Image]:
+        """A frame of a video, None if ffmpeg is not installed or fails."""
+        ffmpeg = shutil.which('ffmpeg')
+        if ffmpeg is None:
+            logger.info("ffmpeg not installed, video posters are not generated")
+            return None
+
+        with tempfile.TemporaryDirectory() as workdir:
+            try:
+                source = storage.path(path)
+            except NotImplementedError:
+                # Remote storage: ffmpeg needs a local copy
+                source = os.path.join(workdir, 'source')
+                with storage.open(path) as remote, open(source, 'wb') as local:
+                    shutil.copyfileobj(remote, local)
+
+            for offset in POSTER_OFFSETS:
+                result = subprocess.run(
+                    [ffmpeg, '-v', 'error', '-ss', offset, '-i', source,
+                     '-frames:v', '1', '-f', 'image2', '-c:v', 'png', '-'],
+                    capture_output=True,
+                    timeout=FFMPEG_TIMEOUT_SECONDS,
+                )
+                if result.returncode == 0 and result.stdout:
+                    return Image.open(io.BytesIO(result.stdout))
+        logger.warning(f"Could not extract a poster from {path}")
+        return None
+
+    @staticmethod
+    def _broadcast_ready(message: Message):
+        """Send a message_media_ready event to the conversation group."""
+        try:
+            channel_layer = get_channel_layer()
+        except Exception as e:
+            logger.warning(f"Redis non disponible (Channel Layer): {str(e)}")
+            return
+        if channel_layer is None:
+            return
+
+        try:
+            async_to_sync(channel_layer.group_send)(f'conversation_{message.match_id}', {
+                'type': 'message_media_ready',
+                'conversation_id': str(message.match_id),
+                'message_id': str(message.id),
+                'media_status': message.media_status,
+                'media_url': message.media_url,
+                'media_thumbnail_url': message.media_thumbnail_url,
+                'media_info': message.media_info,
+            })
+        except Exception as e:
+            logger.warning(f"Error broadcasting media update: {str(e)}")
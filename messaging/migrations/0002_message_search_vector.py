@@ -0,0 +1,45 @@
+"""
+Full-text search on Message.content: a tsvector column kept up to date by a
+BEFORE INSERT/UPDATE OF content trigger (so bulk inserts are covered too),
+with a GIN index.
+"""
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.db import migrations
+
+
+CREATE_TRIGGER = """
+CREATE TRIGGER messages_search_vector_update
+BEFORE INSERT OR UPDATE OF content ON messages
+FOR EACH ROW EXECUTE PROCEDURE
+tsvector_update_trigger(search_vector, 'pg_catalog.simple', content);
+"""
+
+DROP_TRIGGER = "DROP TRIGGER IF EXISTS messages_search_vector_update ON messages;"
+
+BACKFILL = "UPDATE messages SET search_vector = to_tsvector('pg_catalog.simple', content);"
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('messaging', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(
+                editable=False, null=True, verbose_name='Search vector'
+            ),
+        ),
+        migrations.RunSQL(CREATE_TRIGGER, DROP_TRIGGER),
+        migrations.RunSQL(BACKFILL, migrations.RunSQL.noop),
+        migrations.AddIndex(
+            model_name='message',
+            index=django.contrib.postgres.indexes.GinIndex(
+                fields=['search_vector'], name='messages_search_gin'
+            ),
+        ),
+    ]
@@ -0,0 +1,128 @@
+"""
+Move messages onto monthly range partitions by created_at.
+
+The table is rebuilt as a partitioned table with a (id, created_at) primary
+key, one partition per month from the oldest message to
+MESSAGE_PARTITION_MONTHS_AHEAD months ahead, and a default partition as a
+safety net. Existing rows are copied over, then indexes, foreign keys and the
+search trigger are recreated on the new table. Foreign keys *to* messages
+cannot target a partitioned table, so they become db_constraint=False first.
+
+Later months are created by messaging.tasks.maintain_message_partitions.
+"""
+from datetime import date
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.utils import timezone
+
+
+SEARCH_TRIGGER = """
+CREATE TRIGGER messages_search_vector_update
+BEFORE INSERT OR UPDATE OF content ON messages
+FOR EACH ROW EXECUTE PROCEDURE
+tsvector_update_trigger(search_vector, 'pg_catalog.simple', content);
+"""
+
+
+def _add_months(month, count):
+    index = month.year * 12 + month.month - 1 + count
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def _is_partitioned(cursor):
+    cursor.execute(
+        "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = 'messages'::regclass)"
+    )
+    return cursor.fetchone()[0]
+
+
+def _rebuild_messages(cursor, partitioned):
+    """Copy messages into a new (un)partitioned table with the same indexes and FKs."""
+    cursor.execute(
+        "SELECT pg_get_indexdef(indexrelid) FROM pg_index "
+        "WHERE indrelid = 'messages'::regclass AND NOT indisprimary"
+    )
+    index_defs = [row[0] for row in cursor.fetchall()]
+    cursor.execute(
+        "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint "
+        "WHERE conrelid = 'messages'::regclass AND contype = 'f'"
+    )
+    foreign_keys = cursor.fetchall()
+    cursor.execute(
+        "SELECT conname FROM pg_constraint WHERE conrelid = 'messages'::regclass AND contype = 'p'"
+    )
+    primary_key = cursor.fetchone()[0]
+
+    cursor.execute("ALTER TABLE messages RENAME TO messages_old")
+    # Frees the name for the new primary key
+    cursor.execute(f'ALTER TABLE messages_old RENAME CONSTRAINT "{primary_key}" TO messages_old_pkey')
+    if partitioned:
+        cursor.execute(
+            "CREATE TABLE messages (LIKE messages_old INCLUDING DEFAULTS INCLUDING CONSTRAINTS) "
+            "PARTITION BY RANGE (created_at)"
+        )
+        cursor.execute("ALTER TABLE messages ADD CONSTRAINT messages_pkey PRIMARY KEY (id, created_at)")
+
+        cursor.execute("SELECT MIN(created_at) FROM messages_old")
+        oldest = cursor.fetchone()[0] or timezone.now()
+        month = date(oldest.year, oldest.month, 1)
+        last = _add_months(timezone.now().date().replace(day=1), getattr(settings, 'MESSAGE_PARTITION_MONTHS_AHEAD', 3))
+        while month <= last:
+            cursor.execute(
+                f"CREATE TABLE messages_p{month:%Y_%m} PARTITION OF messages "
+                f"FOR VALUES FROM ('{month.isoformat()}') TO ('{_add_months(month, 1).isoformat()}')"
+            )
+            month = _add_months(month, 1)
+        cursor.execute("CREATE TABLE messages_default PARTITION OF messages DEFAULT")
+    else:
+        cursor.execute(
+            "CREATE TABLE messages (LIKE messages_old INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"
+        )
+        cursor.execute("ALTER TABLE messages ADD CONSTRAINT messages_pkey PRIMARY KEY (id)")
+
+    cursor.execute("INSERT INTO messages SELECT * FROM messages_old")
+    # Also drops the old partitions, indexes and trigger
+    cursor.execute("DROP TABLE messages_old")
+
+    for index_def in index_defs:
+        cursor.execute(index_def)
+    for name, definition in foreign_keys:
+        cursor.execute(f'ALTER TABLE messages ADD CONSTRAINT "{name}" {definition}')
+    cursor.execute(SEARCH_TRIGGER)
+
+
+def partition_messages(apps, schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        if not _is_partitioned(cursor):
+            _rebuild_messages(cursor, partitioned=True)
+
+
+def unpartition_messages(apps, schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        if _is_partitioned(cursor):
+            _rebuild_messages(cursor, partitioned=False)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('messaging', '0002_message_search_vector'),
+        ('matching', '0006_match_message_fks_without_constraint'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='messagereaction',
+            name='message',
+            field=models.ForeignKey(
+                db_constraint=False,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name='reactions',
+                to='messaging.message',
+                verbose_name='Message',
+            ),
+        ),
+        migrations.RunPython(partition_messages, unpartition_messages),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 4.2.7 on 2026-10-18 23:12
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('matching', '0006_match_message_fks_without_constraint'),
+        ('messaging', '0003_partition_messages'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SyncChange',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('kind', models.CharField(choices=[('message.created', 'Message created'), ('message.deleted', 'Message deleted'), ('messages.read', 'Messages read'), ('match.created', 'Match created'), ('match.ended', 'Match ended')], max_length=20, verbose_name='Kind')),
+                ('message_id', models.UUIDField(blank=True, null=True, verbose_name='Message ID')),
+                ('payload', models.JSONField(blank=True, default=dict, verbose_name='Payload')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Created at')),
+                ('match', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='sync_changes', to='matching.match', verbose_name='Match')),
+                ('user', models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL, verbose_name='User')),
+            ],
+            options={
+                'verbose_name': 'Sync Change',
+                'verbose_name_plural': 'Sync Changes',
+                'db_table': 'sync_changes',
+                'ordering': ['id'],
+                'indexes': [models.Index(fields=['match', 'id'], name='sync_change_match_i_58085a_idx'), models.Index(fields=['created_at'], name='sync_change_created_fc95e5_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 4.2.7 on 2026-10-18 23:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('messaging', '0004_sync_change'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='media_info',
+            field=models.JSONField(blank=True, default=dict, verbose_name='Media info'),
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='media_status',
+            field=models.CharField(blank=True, choices=[('pending', 'Pending'), ('ready', 'Ready'), ('failed', 'Failed')], max_length=10, verbose_name='Media status'),
+        ),
+        migrations.AlterField(
+            model_name='syncchange',
+            name='kind',
+            field=models.CharField(choices=[('message.created', 'Message created'), ('message.updated', 'Message updated'), ('message.deleted', 'Message deleted'), ('messages.read', 'Messages read'), ('match.created', 'Match created'), ('match.ended', 'Match ended')], max_length=20, verbose_name='Kind'),
+        ),
+    ]
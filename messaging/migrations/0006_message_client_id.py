@@ -0,0 +1,59 @@
+# Generated by Django 4.2.7 on 2026-10-18 23:29
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+# Existing keys, held by their oldest message
+BACKFILL_CLIENT_IDS = """
+INSERT INTO message_client_ids (match_id, sender_id, client_message_id, message_id)
+SELECT DISTINCT ON (match_id, sender_id, client_message_id) match_id, sender_id, client_message_id, id
+FROM messages
+WHERE client_message_id <> ''
+ORDER BY match_id, sender_id, client_message_id, created_at, id
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('matching', '0006_match_message_fks_without_constraint'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('messaging', '0005_message_media_processing'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MessageClientId',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('client_message_id', models.CharField(max_length=100, verbose_name='Client message ID')),
+                ('message_id', models.UUIDField(verbose_name='Message ID')),
+            ],
+            options={
+                'verbose_name': 'Message Client ID',
+                'verbose_name_plural': 'Message Client IDs',
+                'db_table': 'message_client_ids',
+            },
+        ),
+        migrations.RemoveIndex(
+            model_name='message',
+            name='messages_client__b9809d_idx',
+        ),
+        migrations.AddField(
+            model_name='messageclientid',
+            name='match',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='matching.match', verbose_name='Match'),
+        ),
+        migrations.AddField(
+            model_name='messageclientid',
+            name='sender',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL, verbose_name='Sender'),
+        ),
+        migrations.AddConstraint(
+            model_name='messageclientid',
+            constraint=models.UniqueConstraint(fields=('match', 'sender', 'client_message_id'), name='unique_message_client_id'),
+        ),
+        migrations.RunSQL(BACKFILL_CLIENT_IDS, migrations.RunSQL.noop),
+    ]
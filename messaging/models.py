@@ -1,7 +1,9 @@
 """
 Messaging models for HIVMeet.
 """
-from django.db import models
+from django.db import connection, models
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 from django.contrib.auth import get_user_model
 from django.utils.translation import gettext_lazy as _
 from django.utils import timezone
@@ -48,6 +50,17 @@ class Message(models.Model):
         (FAILED, _('Failed')),
     ]
     
+    # Media processing statuses (see messaging.media_service)
+    MEDIA_PENDING = 'pending'
+    MEDIA_READY = 'ready'
+    MEDIA_FAILED = 'failed'
+    
+    MEDIA_STATUS_CHOICES = [
+        (MEDIA_PENDING, _('Pending')),
+        (MEDIA_READY, _('Ready')),
+        (MEDIA_FAILED, _('Failed')),
+    ]
+    
     id = models.UUIDField(
         primary_key=True,
         default=uuid.uuid4,
@@ -111,6 +124,21 @@ class Message(models.Model):
         verbose_name=_('Media file path')
     )
     
+    # Empty for messages without media
+    media_status = models.CharField(
+        max_length=10,
+        choices=MEDIA_STATUS_CHOICES,
+        blank=True,
+        verbose_name=_('Media status')
+    )
+    
+    # Width, height, blurhash and rendition URLs, filled by media processing
+    media_info = models.JSONField(
+        default=dict,
+        blank=True,
+        verbose_name=_('Media info')
+    )
+    
     # Status tracking
     status = models.CharField(
         max_length=10,
@@ -148,6 +176,13 @@ class Message(models.Model):
         verbose_name=_('Deleted by recipient')
     )
     
+    # Full-text search, maintained by a database trigger on content
+    search_vector = SearchVectorField(
+        null=True,
+        editable=False,
+        verbose_name=_('Search vector')
+    )
+    
     class Meta:
         verbose_name = _('Message')
         verbose_name_plural = _('Messages')
@@ -157,7 +192,7 @@ class Message(models.Model):
             models.Index(fields=['match', '-created_at']),
             models.Index(fields=['sender', '-created_at']),
             models.Index(fields=['status']),
-            models.Index(fields=['client_message_id']),
+            GinIndex(fields=['search_vector'], name='messages_search_gin'),
         ]
     
     def __str__(self):
@@ -175,15 +210,13 @@ class Message(models.Model):
             self.save(update_fields=['status', 'delivered_at'])
     
     def mark_as_read(self):
-        """Mark message as read."""
-        if self.status != self.READ:
-            self.status = self.READ
-            self.read_at = timezone.now()
-            self.save(update_fields=['status', 'read_at'])
-            
-            # Update unread count in match
-            recipient = self.get_recipient()
+        """Mark message as read by moving the recipient's read watermark."""
+        recipient = self.get_recipient()
+        if self.match.advance_read_watermark(recipient, self):
             self.match.reset_unread(recipient)
+            SyncChange.record(SyncChange.messages_read(self.match, recipient))
+        self.status = self.READ
+        self.read_at = self.match.get_read_watermark(recipient)[1]
     
     def delete_for_user(self, user):
         """Soft delete message for a specific user."""
@@ -192,6 +225,7 @@ class Message(models.Model):
         else:
             self.is_deleted_by_recipient = True
         self.save(update_fields=['is_deleted_by_sender', 'is_deleted_by_recipient'])
+        SyncChange.record(SyncChange.message_deleted(self, user))
 
 
 class MessageReaction(models.Model):
@@ -209,6 +243,7 @@ class MessageReaction(models.Model):
         Message,
         on_delete=models.CASCADE,
         related_name='reactions',
+        db_constraint=False,
         verbose_name=_('Message')
     )
     
@@ -389,6 +424,9 @@ class Call(models.Model):
         self.calculate_duration()
         self.save(update_fields=['status', 'ended_at', 'end_reason'])
         
+        from .call_budget_service import CallBudgetService
+        CallBudgetService.record_call_end(self)
+        
         # Create call log message
         Message.objects.create(
             match=self.match,
@@ -418,18 +456,9 @@ class Call(models.Model):
         if not user.is_premium:
             return False, _("Audio/video calls are a premium feature.")
         
-        # Check today's total call duration
-        today_start = timezone.now().replace(hour=0, minute=0, second=0, microsecond=0)
-        today_duration = cls.objects.filter(
-            models.Q(caller=user) | models.Q(callee=user),
-            initiated_at__gte=today_start,
-            status=cls.ENDED
-        ).aggregate(
-            total=models.Sum('duration_seconds')
-        )['total'] or 0
-        
-        # 30 minutes limit per day
-        if today_duration >= 1800:
+        # Today's total call duration, from the cached daily counter
+        from .call_budget_service import CallBudgetService
+        if CallBudgetService.get_remaining_seconds(user.id) <= 0:
             return False, _("Daily call limit of 30 minutes reached.")
         
         return True, None
@@ -474,4 +503,202 @@ class TypingIndicator(models.Model):
         verbose_name = _('Typing Indicator')
         verbose_name_plural = _('Typing Indicators')
         db_table = 'typing_indicators'
-        unique_together = ['match', 'user']
\ No newline at end of file
+        unique_together = ['match', 'user']
+
+class SyncChange(models.Model):
+    """
+    Entry of the conversation change log read by the sync endpoint.
+    The auto-increment id is the change sequence clients sync from.
+    """
+    
+    MESSAGE_CREATED = 'message.created'
+    MESSAGE_UPDATED = 'message.updated'
+    MESSAGE_DELETED = 'message.deleted'
+    MESSAGES_READ = 'messages.read'
+    MATCH_CREATED = 'match.created'
+    MATCH_ENDED = 'match.ended'
+    
+    KIND_CHOICES = [
+        (MESSAGE_CREATED, _('Message created')),
+        (MESSAGE_UPDATED, _('Message updated')),
+        (MESSAGE_DELETED, _('Message deleted')),
+        (MESSAGES_READ, _('Messages read')),
+        (MATCH_CREATED, _('Match created')),
+        (MATCH_ENDED, _('Match ended')),
+    ]
+    
+    id = models.BigAutoField(primary_key=True)
+    
+    # Covered by the (match, id) index
+    match = models.ForeignKey(
+        Match,
+        on_delete=models.CASCADE,
+        related_name='sync_changes',
+        db_index=False,
+        verbose_name=_('Match')
+    )
+    
+    # Set for changes only this participant sees (e.g. deletions on their side)
+    user = models.ForeignKey(
+        User,
+        null=True,
+        blank=True,
+        on_delete=models.CASCADE,
+        related_name='+',
+        db_index=False,
+        verbose_name=_('User')
+    )
+    
+    kind = models.CharField(
+        max_length=20,
+        choices=KIND_CHOICES,
+        verbose_name=_('Kind')
+    )
+    
+    message_id = models.UUIDField(
+        null=True,
+        blank=True,
+        verbose_name=_('Message ID')
+    )
+    
+    payload = models.JSONField(
+        default=dict,
+        blank=True,
+        verbose_name=_('Payload')
+    )
+    
+    created_at = models.DateTimeField(
+        auto_now_add=True,
+        verbose_name=_('Created at')
+    )
+    
+    class Meta:
+        verbose_name = _('Sync Change')
+        verbose_name_plural = _('Sync Changes')
+        db_table = 'sync_changes'
+        ordering = ['id']
+        indexes = [
+            models.Index(fields=['match', 'id']),
+            models.Index(fields=['created_at']),
+        ]
+    
+    @classmethod
+    def record(cls, *changes):
+        """Write changes in the current transaction (single INSERT)."""
+        return cls.objects.bulk_create(changes)
+    
+    @classmethod
+    def message_created(cls, message):
+        return cls(match_id=message.match_id, kind=cls.MESSAGE_CREATED, message_id=message.id)
+    
+    @classmethod
+    def message_updated(cls, message):
+        return cls(match_id=message.match_id, kind=cls.MESSAGE_UPDATED, message_id=message.id)
+    
+    @classmethod
+    def message_deleted(cls, message, user):
+        return cls(match_id=message.match_id, user=user, kind=cls.MESSAGE_DELETED, message_id=message.id)
+    
+    @classmethod
+    def messages_read(cls, match, user):
+        last_read, read_at = match.get_read_watermark(user)
+        return cls(
+            match_id=match.id,
+            kind=cls.MESSAGES_READ,
+            message_id=last_read.id if last_read else None,
+            payload={
+                'reader_id': str(getattr(user, 'pk', user)),
+                'read_at': read_at.isoformat() if read_at else None,
+            },
+        )
+    
+    @classmethod
+    def match_changed(cls, match, kind):
+        return cls(match_id=match.id, kind=kind, payload={'status': match.status})
+
+
+class MessageClientId(models.Model):
+    """
+    Claim of a client_message_id by a message, unique per (match, sender).
+    The partitioned messages table cannot enforce this itself (its unique
+    indexes must include created_at), so sends claim the key here with
+    INSERT ... ON CONFLICT DO NOTHING in the transaction inserting the message.
+    """
+    
+    id = models.BigAutoField(primary_key=True)
+    
+    # Covered by the unique constraint
+    match = models.ForeignKey(
+        Match,
+        on_delete=models.CASCADE,
+        related_name='+',
+        db_index=False,
+        verbose_name=_('Match')
+    )
+    
+    sender = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name=_('Sender')
+    )
+    
+    client_message_id = models.CharField(
+        max_length=100,
+        verbose_name=_('Client message ID')
+    )
+    
+    message_id = models.UUIDField(
+        verbose_name=_('Message ID')
+    )
+    
+    class Meta:
+        verbose_name = _('Message Client ID')
+        verbose_name_plural = _('Message Client IDs')
+        db_table = 'message_client_ids'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['match', 'sender', 'client_message_id'],
+                name='unique_message_client_id',
+            ),
+        ]
+    
+    @staticmethod
+    def key(match_id, sender_id, client_message_id):
+        return (str(match_id), str(sender_id), client_message_id)
+    
+    @classmethod
+    def claim(cls, messages):
+        """
+        Claim the client_message_id of unsaved messages, in one statement.
+        Returns the ID of the message holding each key that was already
+        taken: by a committed or concurrent send (whose commit is awaited),
+        or earlier in `messages`. Messages without client_message_id are
+        never duplicates.
+        """
+        keyed = [message for message in messages if message.client_message_id]
+        if not keyed:
+            return {}
+        
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"INSERT INTO {cls._meta.db_table} (match_id, sender_id, client_message_id, message_id) "
+                f"VALUES {', '.join(['(%s, %s, %s, %s)'] * len(keyed))} "
+                "ON CONFLICT (match_id, sender_id, client_message_id) DO NOTHING "
+                "RETURNING message_id",
+                [
+                    str(value)
+                    for message in keyed
+                    for value in (message.match_id, message.sender_id, message.client_message_id, message.id)
+                ],
+            )
+            claimed = {str(row[0]) for row in cursor.fetchall()}
+        
+        taken = [message for message in keyed if str(message.id) not in claimed]
+        if not taken:
+            return {}
+        holders = cls.objects.filter(
+            match_id__in={message.match_id for message in taken},
+            client_message_id__in={message.client_message_id for message in taken},
+        ).values_list('match_id', 'sender_id', 'client_message_id', 'message_id')
+        return {cls.key(*holder[:3]): holder[3] for holder in holders}
@@ -7,8 +7,9 @@ from rest_framework import serializers
 from django.contrib.auth import get_user_model
 from django.utils.html import strip_tags
 from django.utils.translation import gettext_lazy as _
-from django.utils import timezone
+from authentication.presence_service import PresenceService
 from .models import Message, Call
+from .signaling_service import MAX_CANDIDATES
 from matching.models import Match
 
 User = get_user_model()
@@ -38,7 +39,7 @@ class MessageSerializer(serializers.ModelSerializer):
         fields = [
             'message_id', 'id', 'client_message_id', 'conversation_id', 'sender_id', 'is_mine',
             'content', 'message_type', 'media_url', 'media_type', 'media_thumbnail_url',
-            'status', 'sent_at', 'created_at', 'delivered_at', 'read_at', 'read_at_by_recipient',
+            'media_status', 'media_info', 'status', 'sent_at', 'created_at', 'delivered_at', 'read_at', 'read_at_by_recipient',
             'is_sending'
         ]
         read_only_fields = [
@@ -62,6 +63,16 @@ class MessageSerializer(serializers.ModelSerializer):
         return False
 
 
+class MessageSearchResultSerializer(MessageSerializer):
+    """
+    Serializer for message search results, with a highlighted snippet.
+    """
+    snippet = serializers.CharField(read_only=True)
+    
+    class Meta(MessageSerializer.Meta):
+        fields = MessageSerializer.Meta.fields + ['snippet']
+
+
 class ConversationSerializer(serializers.ModelSerializer):
     """
     Serializer for conversations (matches with messages).
@@ -70,7 +81,7 @@ class ConversationSerializer(serializers.ModelSerializer):
     other_user = serializers.SerializerMethodField()
     last_message = serializers.SerializerMethodField()
     unread_count_for_me = serializers.SerializerMethodField()
-    last_activity_at = serializers.DateTimeField(source='last_message_at', read_only=True)
+    last_activity_at = serializers.DateTimeField(read_only=True)
     
     class Meta:
         model = Match
@@ -85,24 +96,39 @@ class ConversationSerializer(serializers.ModelSerializer):
         request = self.context.get('request')
         if request and request.user:
             other_user = obj.get_other_user(request.user)
-            photo = other_user.profile.photos.filter(is_main=True).first() if hasattr(other_user, 'profile') else None
+            photo = None
+            if hasattr(other_user, 'profile'):
+                # Main photo prefetched by ConversationListView
+                main_photos = getattr(other_user.profile, 'main_photos', None)
+                if main_photos is None:
+                    photo = other_user.profile.photos.filter(is_main=True).first()
+                elif main_photos:
+                    photo = main_photos[0]
             
             return {
                 'user_id': str(other_user.id),
                 'display_name': other_user.display_name,
                 'main_photo_url': photo.photo_url if photo else None,
-                'is_online': (timezone.now() - other_user.last_active).total_seconds() < 300,
+                'is_online': self._is_online(other_user.id),
                 'last_active': other_user.last_active,
             }
         return None
     
+    def _is_online(self, user_id):
+        # Bulk lookup done by ConversationListView when available
+        online_status = self.context.get('online_status')
+        if online_status is not None:
+            return online_status.get(str(user_id), False)
+        return PresenceService.is_online(user_id)
+
     def get_last_message(self, obj):
         """Get the last message in the conversation."""
         request = self.context.get('request')
         if not request:
             return None
 
-        message = Message.objects.filter(match=obj).order_by('-created_at').first()
+        # Denormalized by MessageService.send_message
+        message = obj.last_message
         if not message:
             return None
 
@@ -111,7 +137,7 @@ class ConversationSerializer(serializers.ModelSerializer):
             'content_preview': message.content[:100] if message.content else _('Media'),
             'sender_id': str(message.sender_id),
             'sent_at': message.created_at,
-            'is_read_by_me': message.sender == request.user or message.status == Message.READ,
+            'is_read_by_me': obj.has_read(request.user, message),
         }
     
     def get_unread_count_for_me(self, obj):
@@ -244,6 +270,10 @@ class InitiateCallSerializer(serializers.Serializer):
     target_user_id = serializers.UUIDField()
     call_type = serializers.ChoiceField(choices=['audio', 'video'])
     offer_sdp = serializers.CharField()
+    # Candidates gathered with the offer, saving ice-candidate requests
+    ice_candidates = serializers.ListField(
+        child=serializers.DictField(), required=False, max_length=MAX_CANDIDATES
+    )
 
 
 class AnswerCallSerializer(serializers.Serializer):
@@ -251,13 +281,28 @@ class AnswerCallSerializer(serializers.Serializer):
     Serializer for answering calls.
     """
     answer_sdp = serializers.CharField()
+    ice_candidates = serializers.ListField(
+        child=serializers.DictField(), required=False, max_length=MAX_CANDIDATES
+    )
 
 
 class IceCandidateSerializer(serializers.Serializer):
     """
-    Serializer for ICE candidates.
+    Serializer for ICE candidates: one `candidate` or a `candidates` batch.
     """
-    candidate = serializers.DictField()
+    candidate = serializers.DictField(required=False)
+    candidates = serializers.ListField(
+        child=serializers.DictField(), required=False, max_length=MAX_CANDIDATES
+    )
+
+    def validate(self, data):
+        candidates = data.get('candidates') or []
+        if 'candidate' in data:
+            candidates = [data['candidate']] + candidates
+        if not candidates:
+            raise serializers.ValidationError(_('At least one candidate is required.'))
+        data['candidates'] = candidates
+        return data
 
 
 class EndCallSerializer(serializers.Serializer):
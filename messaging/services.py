@@ -2,22 +2,35 @@
 Messaging services.
 """
 from __future__ import annotations
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
 from django.contrib.auth import get_user_model
+from django.contrib.postgres.search import SearchHeadline, SearchQuery
+from django.db import transaction
 from django.db.models import Q, F, Count
 from django.utils import timezone
 from django.utils.translation import gettext as _
 from django.core.cache import cache
-from django.conf import settings
 from typing import List, Optional, Tuple, TYPE_CHECKING
-from uuid import uuid4
+from datetime import datetime
+from uuid import UUID
+from html import escape
+import base64
 import logging
 
 if TYPE_CHECKING:
     from authentication.models import User as AuthUser
 
+from authentication import notification_service
+from authentication.notification_service import NotificationDispatcher
 from matching.models import Match
-from .models import Message, Call, TypingIndicator
-from .tasks import send_call_notification, send_read_notification
+from .archive_service import MessageArchiveService
+from .call_budget_service import CallBudgetService
+from .models import Message, MessageClientId, Call, SyncChange
+from .signaling_service import CallSignalingService, normalize_candidates
+from .media_service import MessageMediaService
+from .tasks import process_message_media, send_call_notification
+from .typing_service import TypingService
 from subscriptions.utils import check_feature_availability
 
 logger = logging.getLogger('hivmeet.messaging')
@@ -29,65 +42,232 @@ class MessageService:
     Service for handling messages.
     """
     
+    # Free users only see the latest messages of a conversation
+    FREE_HISTORY_LIMIT = 50
+
+    # Text search configuration of the messages search_vector trigger;
+    # 'simple' does no stemming, which keeps it cheap and language neutral
+    SEARCH_CONFIG = 'simple'
+
+    # Match delimiters of search headlines, replaced by <mark></mark> once
+    # the content is HTML-escaped
+    HEADLINE_START = '\x02'
+    HEADLINE_STOP = '\x03'
+
     @staticmethod
-    def get_conversation_messages(user: 'AuthUser', match: Match, limit: int = 50, before_id: Optional[str] = None) -> List[Message]:
-        """
-        Get messages for a conversation with pagination.
-        """
-        # Base query
-        query = Message.objects.filter(match=match)
-        
-        # Filter out deleted messages
-        query = query.filter(
+    def encode_cursor(message: Message) -> str:
+        """Opaque pagination cursor for a message: (created_at, id)."""
+        raw = f"{message.created_at.isoformat()}|{message.id}"
+        return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+    @staticmethod
+    def decode_cursor(cursor: str) -> Optional[Tuple[datetime, str]]:
+        """Decode a cursor into (created_at, id), or None if malformed."""
+        try:
+            padded = cursor + '=' * (-len(cursor) % 4)
+            created_at, message_id = base64.urlsafe_b64decode(padded.encode()).decode().split('|', 1)
+            return datetime.fromisoformat(created_at), str(UUID(message_id))
+        except (ValueError, TypeError, UnicodeDecodeError):
+            return None
+
+    @staticmethod
+    def get_visible_messages(user: 'AuthUser', match: Match):
+        """Messages of a conversation not deleted on the user's side."""
+        return Message.objects.filter(match=match).filter(
             Q(sender=user, is_deleted_by_sender=False) |
             Q(sender=match.get_other_user(user), is_deleted_by_recipient=False)
-        )
-        
-        # Apply cursor pagination
-        if before_id:
-            try:
-                before_message = Message.objects.get(id=before_id, match=match)
-                query = query.filter(created_at__lt=before_message.created_at)
-            except Message.DoesNotExist:
-                pass
-        
+        ).defer('search_vector')
+
+    @staticmethod
+    def get_approximate_message_count(user: 'AuthUser', match: Match) -> int:
+        """Visible message count, cached briefly; only computed on request."""
+        cache_key = f'conversation_count_{match.id}_{user.id}'
+        count = cache.get(cache_key)
+        if count is None:
+            count = MessageService.get_visible_messages(user, match).count()
+            cache.set(cache_key, count, 60)
+        return count
+
+    @staticmethod
+    def get_conversation_page(
+        user: 'AuthUser',
+        match: Match,
+        limit: int = 50,
+        cursor: Optional[str] = None,
+        before_id: Optional[str] = None,
+    ) -> Tuple[List[Message], bool]:
+        """
+        Get one page of messages, newest first, with keyset pagination on
+        (created_at, id). Fetches limit + 1 rows to know if there are more.
+        Returns (messages, has_more).
+        """
+        query = MessageService.get_visible_messages(user, match)
+
+        position = MessageService.decode_cursor(cursor) if cursor else None
+        if position is None and before_id:
+            # Legacy cursor: costs one lookup to resolve the timestamp
+            before_message = Message.objects.filter(id=before_id, match=match).only('created_at').first()
+            if before_message:
+                position = (before_message.created_at, str(before_message.id))
+        if position:
+            created_at, message_id = position
+            query = query.filter(
+                Q(created_at__lt=created_at) |
+                Q(created_at=created_at, id__lt=message_id)
+            )
+
         # Limit history for non-premium users
         if not user.is_premium:
-            query = query.order_by('-created_at')[:50]
-        else:
-            query = query.order_by('-created_at')
-        
-        # Apply response cap
-        messages = list(query[:limit])
-        
-        # Auto-mark received unread messages as read
-        unread_ids = [
-            msg.id for msg in messages
-            if msg.sender != user and msg.status in [Message.SENT, Message.DELIVERED]
-        ]
-        if unread_ids:
-            read_at = timezone.now()
-            latest_read_message_id = unread_ids[0]
-            Message.objects.filter(id__in=unread_ids).update(
-                status=Message.READ,
-                read_at=read_at,
+            limit = min(limit, MessageService.FREE_HISTORY_LIMIT)
+
+        rows = list(query.order_by('-created_at', '-id')[:limit + 1])
+        if len(rows) <= limit and MessageArchiveService.may_have_archive(match):
+            # Live history exhausted: continue with archived months
+            oldest = (rows[-1].created_at, str(rows[-1].id)) if rows else position
+            rows += MessageArchiveService.get_archived_messages(user, match, before=oldest, limit=limit + 1 - len(rows))
+        has_more = len(rows) > limit
+        messages = rows[:limit]
+
+        MessageService._mark_page_as_read(user, match, messages)
+        return messages, has_more
+
+    @staticmethod
+    def search_messages(
+        user: 'AuthUser',
+        match: Match,
+        query: str,
+        limit: int = 20,
+        cursor: Optional[str] = None,
+    ) -> Tuple[List[Message], bool]:
+        """
+        Full-text search in the messages of a conversation visible to the
+        user, newest first, with the same keyset cursor as get_conversation_page.
+        Each message gets a `snippet`: HTML-escaped content with matches
+        wrapped in <mark></mark>.
+        Returns (messages, has_more).
+        """
+        search_query = SearchQuery(query, config=MessageService.SEARCH_CONFIG, search_type='websearch')
+        results = MessageService.get_visible_messages(user, match).filter(search_vector=search_query)
+
+        position = MessageService.decode_cursor(cursor) if cursor else None
+        if position:
+            created_at, message_id = position
+            results = results.filter(
+                Q(created_at__lt=created_at) |
+                Q(created_at=created_at, id__lt=message_id)
             )
-            match.reset_unread(user)
-            for msg in messages:
-                if msg.id in unread_ids:
-                    msg.status = Message.READ
-                    msg.read_at = read_at
-            try:
-                send_read_notification.delay(
-                    recipient_id=match.get_other_user(user).id,
-                    reader_id=user.id,
-                    match_id=str(match.id),
-                    message_id=str(latest_read_message_id),
+
+        if not user.is_premium:
+            limit = min(limit, MessageService.FREE_HISTORY_LIMIT)
+
+        rows = list(
+            results.annotate(
+                snippet=SearchHeadline(
+                    'content',
+                    search_query,
+                    config=MessageService.SEARCH_CONFIG,
+                    start_sel=MessageService.HEADLINE_START,
+                    stop_sel=MessageService.HEADLINE_STOP,
+                    max_words=20,
+                    min_words=5,
                 )
-            except Exception as exc:
-                logger.warning(f"Failed to queue read notification: {exc}")
+            ).order_by('-created_at', '-id')[:limit + 1]
+        )
+        has_more = len(rows) > limit
+        messages = rows[:limit]
+        for msg in messages:
+            msg.snippet = MessageService.render_headline(msg.snippet)
+        MessageService.apply_read_state(match, messages)
+        return messages, has_more
 
+    @staticmethod
+    def render_headline(headline: str) -> str:
+        """Escape a search headline, then highlight its matches with <mark>."""
+        return (
+            escape(headline)
+            .replace(MessageService.HEADLINE_START, '<mark>')
+            .replace(MessageService.HEADLINE_STOP, '</mark>')
+        )
+
+    @staticmethod
+    def get_conversation_messages(user: 'AuthUser', match: Match, limit: int = 50, before_id: Optional[str] = None) -> List[Message]:
+        """
+        Get messages for a conversation with pagination.
+        """
+        messages, _ = MessageService.get_conversation_page(user, match, limit=limit, before_id=before_id)
         return messages
+
+    @staticmethod
+    def _mark_page_as_read(user: 'AuthUser', match: Match, messages: List[Message]):
+        """
+        Auto-mark a page as read by moving the user's read watermark to the
+        newest received message (one UPDATE, none if already read).
+        """
+        latest_received = next(
+            (msg for msg in messages if msg.sender_id != user.id and not getattr(msg, 'is_archived', False)),
+            None,
+        )
+        if latest_received is not None:
+            MessageService._advance_read_watermark(user, match, latest_received)
+        MessageService.apply_read_state(match, messages)
+
+    @staticmethod
+    def apply_read_state(match: Match, messages: List[Message]):
+        """
+        Derive read status of messages from the recipients' read watermarks,
+        in memory only.
+        """
+        for msg in messages:
+            recipient_id = match.user2_id if msg.sender_id == match.user1_id else match.user1_id
+            if msg.status != Message.READ and match.has_read(recipient_id, msg):
+                msg.status = Message.READ
+                msg.read_at = match.get_read_watermark(recipient_id)[1]
+
+    @staticmethod
+    def _advance_read_watermark(user: 'AuthUser', match: Match, message: Message) -> bool:
+        """
+        Move the user's read watermark to a message; on change, reset their
+        unread count, queue a READ push (collapsed by the dispatcher) and
+        broadcast a messages_read event to the conversation.
+        """
+        if not match.advance_read_watermark(user, message):
+            return False
+
+        match.reset_unread(user)
+        SyncChange.record(SyncChange.messages_read(match, user))
+        _last_read, read_at = match.get_read_watermark(user)
+        try:
+            NotificationDispatcher.enqueue(
+                match.get_other_user(user).id,
+                notification_service.READ,
+                actor_id=user.id,
+                data={'conversation_id': str(match.id), 'message_id': str(message.id)},
+            )
+        except Exception as exc:
+            logger.warning(f"Failed to queue read notification: {exc}")
+        MessageService._broadcast_read(match, user, message, read_at)
+        return True
+
+    @staticmethod
+    def _broadcast_read(match: Match, user: 'AuthUser', message: Message, read_at):
+        try:
+            channel_layer = get_channel_layer()
+        except Exception as e:
+            logger.warning(f"Redis non disponible (Channel Layer): {str(e)}")
+            return
+        if channel_layer is None:
+            return
+
+        try:
+            async_to_sync(channel_layer.group_send)(f'conversation_{match.id}', {
+                'type': 'messages_read',
+                'conversation_id': str(match.id),
+                'reader_id': str(user.id),
+                'last_read_message_id': str(message.id),
+                'read_at': read_at.isoformat(),
+            })
+        except Exception as e:
+            logger.warning(f"Error broadcasting read receipt: {str(e)}")
     
     @staticmethod
     def send_message(
@@ -96,10 +276,12 @@ class MessageService:
         content: str,
         message_type: str = Message.TEXT,
         media_file_path: Optional[str] = None,
-        client_message_id: Optional[str] = None
+        client_message_id: Optional[str] = None,
+        media_url: str = '',
     ) -> Tuple[Optional[Message], Optional[str]]:
         """
-        Send a message in a conversation.
+        Send a message in a conversation. Media is processed once the message
+        is committed (see MessageMediaService).
         Returns (message, error_message).
         """
         # Verify sender is part of the match
@@ -110,17 +292,9 @@ class MessageService:
         if match.status != Match.ACTIVE:
             return None, _("This conversation is no longer active.")
         
-        # Check for duplicate client message ID
-        if client_message_id:
-            existing = Message.objects.filter(
-                match=match,
-                client_message_id=client_message_id
-            ).first()
-            if existing:
-                return existing, None
-        
         # Validate media messages for premium users only
-        if message_type in [Message.IMAGE, Message.VIDEO, Message.AUDIO]:
+        is_media = message_type in [Message.IMAGE, Message.VIDEO, Message.AUDIO]
+        if is_media:
             feature_check = check_feature_availability(sender, 'media_messaging')
             if not feature_check['available']:
                 return None, _("Sending media messages is a premium feature.")
@@ -133,24 +307,38 @@ class MessageService:
             normalized_content = content or ''
             normalized_media_file_path = media_file_path or ''
 
-            message = Message.objects.create(
-                match=match,
-                sender=sender,
-                content=normalized_content,
-                message_type=message_type,
-                media_file_path=normalized_media_file_path,
-                client_message_id=client_message_id,
-                status=Message.SENT
-            )
-            
-            # Update match last message info
-            match.last_message_at = message.created_at
-            match.last_message_preview = normalized_content[:100] if normalized_content else _("[Media]")
-            match.save(update_fields=['last_message_at', 'last_message_preview'])
-
-            # Update unread count for recipient
-            recipient = match.get_other_user(sender)
-            match.increment_unread(recipient)
+            with transaction.atomic():
+                message = Message(
+                    match=match,
+                    sender=sender,
+                    content=normalized_content,
+                    message_type=message_type,
+                    media_file_path=normalized_media_file_path,
+                    media_url=media_url,
+                    media_status=Message.MEDIA_PENDING if is_media else '',
+                    client_message_id=client_message_id or '',
+                    status=Message.SENT
+                )
+
+                # A retry returns the message already sent with this client ID
+                holders = MessageClientId.claim([message])
+                if holders:
+                    key = MessageClientId.key(match.id, sender.id, message.client_message_id)
+                    existing = Message.objects.filter(id=holders[key]).first()
+                    if existing:
+                        return existing, None
+                    return None, _("Failed to send message. Please try again.")
+
+                message.save(force_insert=True)
+
+                # Last message info and recipient unread count in one UPDATE
+                match.record_message(
+                    message,
+                    normalized_content[:100] if normalized_content else _("[Media]"),
+                )
+
+                if is_media:
+                    transaction.on_commit(lambda: process_message_media.delay(str(message.id)))
             
             # TODO: Send push notification to recipient
             
@@ -173,91 +361,63 @@ class MessageService:
             return False
         
         message.save(update_fields=['is_deleted_by_sender', 'is_deleted_by_recipient'])
+        SyncChange.record(SyncChange.message_deleted(message, user))
         return True
     
     @staticmethod
     def update_typing_indicator(user: 'AuthUser', match: Match, is_typing: bool):
         """
         Update typing indicator for a user in a conversation.
+        Ephemeral and throttled, see TypingService.
         """
         if is_typing:
-            TypingIndicator.objects.update_or_create(
-                match=match,
-                user=user,
-                defaults={'is_typing': True}
-            )
-        else:
-            TypingIndicator.objects.filter(
-                match=match,
-                user=user
-            ).delete()
-
-        # Cache typing status for real-time updates
-        cache_key = f"typing_{match.id}_{user.id}"
-        if is_typing:
-            cache.set(cache_key, True, timeout=10)  # Expire after 10 seconds
+            changed = TypingService.start(match.id, user.id)
         else:
-            cache.delete(cache_key)
+            changed = TypingService.stop(match.id, user.id)
+        if changed:
+            TypingService.broadcast(match.id, user.id, is_typing)
 
     @staticmethod
     def mark_messages_as_read(user: 'AuthUser', match: Match, last_read_message_id: Optional[str] = None) -> int:
         """
-        Mark received messages as read up to an optional message.
+        Mark received messages as read up to an optional message (default:
+        the latest received) by moving the read watermark.
+        Returns the number of messages newly covered by the watermark.
         """
         other_user = match.get_other_user(user)
-        query = Message.objects.filter(
-            match=match,
-            sender=other_user,
-            status__in=[Message.SENT, Message.DELIVERED]
-        )
+        received = Message.objects.filter(match=match, sender=other_user)
 
+        target = None
         if last_read_message_id:
-            try:
-                last_message = Message.objects.get(id=last_read_message_id, match=match)
-                query = query.filter(created_at__lte=last_message.created_at)
-            except Message.DoesNotExist:
-                pass
-
-            latest_message = query.order_by('-created_at').first()
-            updated_count = query.update(status=Message.READ, read_at=timezone.now())
-        if updated_count:
-            match.reset_unread(user)
-            if latest_message:
-                try:
-                    send_read_notification.delay(
-                        recipient_id=other_user.id,
-                        reader_id=user.id,
-                        match_id=str(match.id),
-                        message_id=str(latest_message.id),
-                    )
-                except Exception as exc:
-                    logger.warning(f"Failed to queue read notification: {exc}")
-        return updated_count
+            target = received.filter(id=last_read_message_id).first()
+        if target is None:
+            target = received.order_by('-created_at', '-id').first()
+        if target is None:
+            return 0
+
+        previous, _read_at = match.get_read_watermark(user)
+        if not MessageService._advance_read_watermark(user, match, target):
+            return 0
+
+        newly_read = received.filter(created_at__lte=target.created_at)
+        if previous is not None:
+            newly_read = newly_read.filter(created_at__gt=previous.created_at)
+        return newly_read.count()
 
     @staticmethod
     def mark_single_message_as_read(user: 'AuthUser', message: Message) -> bool:
         """
-        Mark a single message as read if the user is the recipient.
+        Mark a message (and everything received before it) as read if the
+        user is the recipient.
         """
         if user == message.sender:
             return False
-        if user not in [message.match.user1, message.match.user2]:
+        match = message.match
+        if user not in [match.user1, match.user2]:
             return False
 
-        if message.status in [Message.SENT, Message.DELIVERED]:
-            message.status = Message.READ
-            message.read_at = timezone.now()
-            message.save(update_fields=['status', 'read_at'])
-            message.match.reset_unread(user)
-            try:
-                send_read_notification.delay(
-                    recipient_id=message.sender_id,
-                    reader_id=user.id,
-                    match_id=str(message.match.id),
-                    message_id=str(message.id),
-                )
-            except Exception as exc:
-                logger.warning(f"Failed to queue read notification: {exc}")
+        MessageService._advance_read_watermark(user, match, message)
+        MessageService.apply_read_state(match, [message])
         return True
 
     @staticmethod
@@ -270,10 +430,11 @@ class MessageService:
         client_message_id: Optional[str] = None,
     ) -> Message:
         """
-        Persist a media message from uploaded file metadata.
+        Store an uploaded file and send it as a media message. The original
+        is served until processing replaces it with a rendition.
         """
-        media_file_path = f"messages/{match.id}/{uuid4()}_{media_file.name}"
-        media_url = f"{getattr(settings, 'MEDIA_URL', '/media/')}{media_file_path}"
+        storage = MessageMediaService.get_storage()
+        media_file_path = MessageMediaService.save_upload(match, media_file)
 
         message, error = MessageService.send_message(
             sender=sender,
@@ -282,12 +443,13 @@ class MessageService:
             message_type=media_type,
             media_file_path=media_file_path,
             client_message_id=client_message_id,
+            media_url=storage.url(media_file_path),
         )
+        if not message or message.media_file_path != media_file_path:
+            # Rejected, or a retry of an already sent message
+            storage.delete(media_file_path)
         if not message:
             raise ValueError(error or "Unable to create media message")
-
-        message.media_url = media_url
-        message.save(update_fields=['media_url'])
         return message
     
     @staticmethod
@@ -295,18 +457,9 @@ class MessageService:
         """
         Get users currently typing in a conversation.
         """
-        # Check cache first
-        users_typing = []
-        
-        for user in [match.user1, match.user2]:
-            if exclude_user and user == exclude_user:
-                continue
-                
-            cache_key = f"typing_{match.id}_{user.id}"
-            if cache.get(cache_key):
-                users_typing.append(user)
-        
-        return users_typing
+        users = [user for user in (match.user1, match.user2) if not (exclude_user and user == exclude_user)]
+        typing_ids = TypingService.get_typing_user_ids(match.id, [user.id for user in users])
+        return [user for user in users if str(user.id) in typing_ids]
 
 
 class CallService:
@@ -338,28 +491,25 @@ class CallService:
         if match.status != Match.ACTIVE:
             return None, _("This conversation is no longer active.")
         
-        # Check for ongoing calls
-        ongoing_call = Call.objects.filter(
-            match=match,
-            status__in=[Call.INITIATED, Call.RINGING, Call.ANSWERED]
-        ).first()
-        
-        if ongoing_call:
-            return None, _("There is already an ongoing call in this conversation.")
-        
         # Get callee
         callee = match.get_other_user(caller)
         
+        call = Call(
+            match=match,
+            caller=caller,
+            callee=callee,
+            call_type=call_type,
+            offer_sdp=offer_sdp,
+            status=Call.RINGING
+        )
+        
+        # Reject overlapping calls of either participant (active call registry)
+        if not CallBudgetService.claim(call):
+            return None, _("There is already an ongoing call.")
+        
         # Create call
         try:
-            call = Call.objects.create(
-                match=match,
-                caller=caller,
-                callee=callee,
-                call_type=call_type,
-                offer_sdp=offer_sdp,
-                status=Call.RINGING
-            )
+            call.save(force_insert=True)
 
             try:
                 send_call_notification.delay(
@@ -375,6 +525,7 @@ class CallService:
             
         except Exception as e:
             logger.error(f"Error initiating call: {str(e)}")
+            CallBudgetService.release(call)
             return None, _("Failed to initiate call. Please try again.")
     
     @staticmethod
@@ -393,26 +544,12 @@ class CallService:
         return True
     
     @staticmethod
-    def add_ice_candidate(call: Call, candidate: dict, from_user: 'AuthUser') -> bool:
+    def add_ice_candidates(call: Call, candidates: List[dict], from_user: 'AuthUser') -> bool:
         """
-        Add ICE candidate for WebRTC negotiation.
+        Add ICE candidates for WebRTC negotiation, relayed to the peer as one
+        batch and cached rather than saved (see CallSignalingService).
         """
-        if call.status not in [Call.RINGING, Call.ANSWERED]:
-            return False
-        
-        # Verify user is part of the call
-        if from_user not in [call.caller, call.callee]:
-            return False
-        
-        # Add candidate
-        call.ice_candidates.append({
-            'from_user_id': str(from_user.id),
-            'candidate': candidate,
-            'timestamp': timezone.now().isoformat()
-        })
-        call.save(update_fields=['ice_candidates'])
-        
-        return True
+        return CallSignalingService.add_candidates(call, from_user, normalize_candidates({'candidates': candidates}))
     
     @staticmethod
     def end_call(call: Call, reason: str, ended_by: Optional['AuthUser'] = None) -> bool:
@@ -441,6 +578,8 @@ class CallService:
             call.duration_seconds = int(duration)
         
         call.save()
+        CallBudgetService.record_call_end(call)
+        CallSignalingService.clear(call)
         
         # Create call log message
         Message.objects.create(
@@ -0,0 +1,115 @@
+"""
+ICE candidate signaling for calls.
+
+Trickle ICE produces dozens of candidates per call, so they are relayed in
+batches: WebSocket consumers coalesce the candidates a client sends within
+BATCH_WINDOW_SECONDS, and REST clients post lists (also accepted with the
+offer and the answer). Each batch is one ice_candidates event to the
+conversation group.
+
+Candidates posted over REST are also kept in the cache for
+SIGNALING_TTL_SECONDS, never in the database, so a peer that joins late
+(e.g. the callee answering from a push) gets them with the answer.
+"""
+import logging
+from typing import List
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.core.cache import cache
+
+from .models import Call
+
+logger = logging.getLogger('hivmeet.messaging')
+
+# Candidates sent by a socket within this delay are relayed together
+BATCH_WINDOW_SECONDS = 0.05
+
+# Signaling state outlives call setup by a margin, then expires
+SIGNALING_TTL_SECONDS = 120
+
+# Per user and call; more is a misbehaving client
+MAX_CANDIDATES = 100
+
+CANDIDATE_FIELDS = ('candidate', 'sdpMid', 'sdpMLineIndex')
+
+
+def _candidates_key(call_id, user_id) -> str:
+    return f'call_ice_{call_id}_{user_id}'
+
+
+def normalize_candidates(data: dict) -> List[dict]:
+    """
+    Candidates of a client frame or request: a `candidates` list, or a single
+    candidate (legacy frames carry its fields at the top level).
+    """
+    if data.get('candidates') is not None:
+        items = data['candidates'] if isinstance(data['candidates'], list) else []
+    elif isinstance(data.get('candidate'), dict):
+        items = [data['candidate']]
+    else:
+        items = [data]
+    return [
+        {field: item.get(field) for field in CANDIDATE_FIELDS}
+        for item in items
+        if isinstance(item, dict) and item.get('candidate')
+    ]
+
+
+class CallSignalingService:
+    """
+    Service for batched ICE candidate relay.
+    """
+
+    @staticmethod
+    def add_candidates(call, from_user, candidates: List[dict]) -> bool:
+        """
+        Keep candidates of a participant for the peer and relay them as one
+        batch. Returns False if the call is not being set up or the user is
+        not part of it.
+        """
+        if call.status not in [Call.RINGING, Call.ANSWERED]:
+            return False
+        if from_user.id not in (call.caller_id, call.callee_id):
+            return False
+        if not candidates:
+            return True
+
+        key = _candidates_key(call.id, from_user.id)
+        stored = cache.get(key) or []
+        cache.set(key, (stored + candidates)[:MAX_CANDIDATES], SIGNALING_TTL_SECONDS)
+
+        CallSignalingService.relay(call.match_id, from_user.id, candidates, call_id=call.id)
+        return True
+
+    @staticmethod
+    def get_peer_candidates(call, user) -> List[dict]:
+        """Candidates the other participant sent so far (REST only)."""
+        peer_id = call.callee_id if user.id == call.caller_id else call.caller_id
+        return cache.get(_candidates_key(call.id, peer_id)) or []
+
+    @staticmethod
+    def clear(call):
+        cache.delete_many([_candidates_key(call.id, user_id) for user_id in (call.caller_id, call.callee_id)])
+
+    @staticmethod
+    def relay(conversation_id, from_user_id, candidates: List[dict], call_id=None):
+        """Send one ice_candidates event to the conversation group (HTTP path)."""
+        try:
+            channel_layer = get_channel_layer()
+        except Exception as e:
+            logger.warning(f"Redis non disponible (Channel Layer): {str(e)}")
+            return
+        if channel_layer is None:
+            return
+
+        try:
+            async_to_sync(channel_layer.group_send)(f'conversation_{conversation_id}', {
+                'type': 'ice_candidates',
+                'conversation_id': str(conversation_id),
+                'call_id': str(call_id) if call_id else None,
+                'from_user_id': str(from_user_id),
+                'candidates': candidates,
+            })
+        except Exception as e:
+            logger.warning(f"Error relaying ICE candidates: {str(e)}")
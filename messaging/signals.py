@@ -9,8 +9,11 @@ import logging
 from contextlib import contextmanager
 from django.utils.translation import gettext as _
 
-from .models import Message, Call
-from .tasks import send_message_notification
+from matching.models import Match
+from .models import Message, Call, SyncChange
+from authentication import notification_service
+from authentication.notification_service import NotificationDispatcher
+from authentication.ws_identity_service import WebSocketIdentityService
 
 logger = logging.getLogger('hivmeet.messaging')
 
@@ -29,52 +32,96 @@ def channel_layer_context():
     yield layer
 
 
+@receiver(post_save, sender=Message)
+def record_message_created(sender, instance, created, **kwargs):
+    """
+    Add new messages to the sync change log, in the saving transaction.
+    """
+    if created:
+        SyncChange.record(SyncChange.message_created(instance))
+
+
+@receiver(post_save, sender=Match)
+def record_match_change(sender, instance, created, update_fields=None, **kwargs):
+    """
+    Add new and ended (unmatched, blocked) matches to the sync change log.
+    """
+    if created:
+        SyncChange.record(SyncChange.match_changed(instance, SyncChange.MATCH_CREATED))
+    elif instance.status != Match.ACTIVE and (update_fields is None or 'status' in update_fields):
+        SyncChange.record(SyncChange.match_changed(instance, SyncChange.MATCH_ENDED))
+
+
+@receiver(post_save, sender=Match)
+def invalidate_ws_identities(sender, instance, created, update_fields=None, **kwargs):
+    """
+    Conversations the participants may join over WebSocket change with the
+    match status: drop their cached identities.
+    """
+    if created or update_fields is None or 'status' in update_fields:
+        WebSocketIdentityService.invalidate(instance.user1_id, instance.user2_id)
+
+
 @receiver(post_save, sender=Message)
 def handle_new_message(sender, instance, created, **kwargs):
     """
     Handle new message creation.
     """
     if created and instance.message_type != Message.CALL_LOG:
-        # Send push notification
         try:
-            recipient = instance.get_recipient()
-            send_message_notification.delay(
-                recipient.id,
-                instance.sender.id,
-                instance.content[:100] if instance.content else _("[Media]"),
-                str(instance.match.id)
-            )
+            recipient_id = instance.get_recipient().id
         except Exception as e:
-            logger.error(f"Error sending message notification: {str(e)}")
-        
-        # Send real-time update via WebSocket - use safe channel layer
-        with channel_layer_context() as channel_layer:
-            if channel_layer:
-                try:
-                    recipient = instance.get_recipient()
-                    
-                    # Serialize message data
-                    message_data = {
-                        'id': str(instance.id),
-                        'client_message_id': instance.client_message_id,
-                        'sender_id': str(instance.sender.id),
-                        'content': instance.content,
-                        'message_type': instance.message_type,
-                        'media_url': instance.media_url,
-                        'created_at': instance.created_at.isoformat(),
-                        'conversation_id': str(instance.match.id)
+            logger.error(f"Error resolving message recipient: {str(e)}")
+            return
+        notify_new_message(instance, recipient_id)
+
+
+def notify_new_message(message, recipient_id):
+    """
+    Push notification and new_message event on the recipient's user group
+    for a committed message. Also called by the WebSocket write buffer,
+    whose bulk inserts send no post_save.
+    """
+    # Send push notification
+    try:
+        NotificationDispatcher.enqueue(
+            recipient_id,
+            notification_service.MESSAGE,
+            actor_id=message.sender_id,
+            data={
+                'conversation_id': str(message.match_id),
+                'message_preview': message.content[:100] if message.content else _("[Media]"),
+            },
+        )
+    except Exception as e:
+        logger.error(f"Error sending message notification: {str(e)}")
+
+    # Send real-time update via WebSocket - use safe channel layer
+    with channel_layer_context() as channel_layer:
+        if channel_layer:
+            try:
+                # Serialize message data
+                message_data = {
+                    'id': str(message.id),
+                    'client_message_id': message.client_message_id,
+                    'sender_id': str(message.sender_id),
+                    'content': message.content,
+                    'message_type': message.message_type,
+                    'media_url': message.media_url,
+                    'created_at': message.created_at.isoformat(),
+                    'conversation_id': str(message.match_id)
+                }
+
+                # Send to recipient
+                async_to_sync(channel_layer.group_send)(
+                    f"user_{recipient_id}",
+                    {
+                        "type": "new_message",
+                        "message": message_data
                     }
-                    
-                    # Send to recipient
-                    async_to_sync(channel_layer.group_send)(
-                        f"user_{recipient.id}",
-                        {
-                            "type": "new_message",
-                            "message": message_data
-                        }
-                    )
-                except Exception as e:
-                    logger.warning(f"Erreur envoi WebSocket message: {str(e)}")
+                )
+            except Exception as e:
+                logger.warning(f"Erreur envoi WebSocket message: {str(e)}")
 
 
 @receiver(post_save, sender=Call)
@@ -0,0 +1,208 @@
+"""
+Delta sync of conversations for offline clients.
+
+Every change a client must replay (new, updated and deleted messages, read
+watermarks, new and ended matches) is appended to the sync_changes log in
+the transaction that makes it; its auto-increment id is the change
+sequence. A client keeps the next_since of its last sync and asks for
+everything after it across all its conversations in one request, instead
+of polling each conversation.
+
+Sequence ids are allocated before commit, so a change may become visible
+after one with a higher id. next_since therefore never moves past changes
+younger than SYNC_SETTLE_SECONDS: those are sent again on the next sync and
+clients apply changes idempotently.
+"""
+import logging
+from datetime import timedelta
+from typing import Iterator, List, Optional
+
+from django.conf import settings
+from django.db.models import Max, Min, Prefetch, Q
+from django.utils import timezone
+
+from authentication.presence_service import PresenceService
+from matching.models import Match
+from profiles.models import ProfilePhoto
+from .models import Message, SyncChange
+from .serializers import ConversationSerializer, MessageSerializer
+from .services import MessageService
+
+logger = logging.getLogger('hivmeet.messaging')
+
+
+class SyncService:
+    """
+    Service for the cross-conversation change feed.
+    """
+
+    # Changes read (and hydrated) per query
+    CHUNK_SIZE = 500
+
+    # Changes sent with the current state of their message
+    MESSAGE_KINDS = (SyncChange.MESSAGE_CREATED, SyncChange.MESSAGE_UPDATED)
+
+    @staticmethod
+    def get_settle_seconds() -> int:
+        return getattr(settings, 'SYNC_SETTLE_SECONDS', 5)
+
+    @staticmethod
+    def needs_full_resync(since: Optional[int]) -> bool:
+        """
+        A client without a sequence, or whose sequence is older than the
+        retained changes or ahead of the log (e.g. a restored database), must
+        reload its conversations from scratch.
+        """
+        if since is None:
+            return True
+        bounds = SyncChange.objects.aggregate(oldest=Min('id'), latest=Max('id'))
+        if since > (bounds['latest'] or 0):
+            return True
+        return bounds['oldest'] is not None and since < bounds['oldest'] - 1
+
+    @staticmethod
+    def get_high_water_mark() -> int:
+        return SyncChange.objects.aggregate(latest=Max('id'))['latest'] or 0
+
+    @staticmethod
+    def get_resync_point() -> int:
+        """Sequence a client syncs from after reloading all its conversations."""
+        settle_before = timezone.now() - timedelta(seconds=SyncService.get_settle_seconds())
+        return SyncChange.objects.filter(created_at__lte=settle_before).aggregate(latest=Max('id'))['latest'] or 0
+
+    @staticmethod
+    def iter_changes(user, since: int, request=None, cursor: Optional[dict] = None) -> Iterator[dict]:
+        """
+        Yield the user's changes after `since`, oldest first, in chunks of
+        CHUNK_SIZE. Changes committed after the call started are left for the
+        next sync. `cursor['next_since']` is kept up to date with the sequence
+        to sync from next; it only covers changes already yielded.
+        """
+        if cursor is None:
+            cursor = {}
+        cursor['next_since'] = since
+
+        high_water_mark = SyncService.get_high_water_mark()
+        settle_before = timezone.now() - timedelta(seconds=SyncService.get_settle_seconds())
+        settled = True
+
+        match_ids = Match.objects.filter(Q(user1=user) | Q(user2=user)).values('id')
+        changes = SyncChange.objects.filter(
+            Q(user__isnull=True) | Q(user=user),
+            match_id__in=match_ids,
+            id__lte=high_water_mark,
+        ).order_by('id')
+
+        position = since
+        while True:
+            chunk = list(changes.filter(id__gt=position)[:SyncService.CHUNK_SIZE])
+            if not chunk:
+                break
+            position = chunk[-1].id
+
+            for change, entry in zip(chunk, SyncService._hydrate(user, chunk, request)):
+                if settled and change.created_at > settle_before:
+                    settled = False
+                if settled:
+                    cursor['next_since'] = change.id
+                if entry is not None:
+                    yield entry
+
+            if len(chunk) < SyncService.CHUNK_SIZE:
+                break
+
+        if settled:
+            # Past changes of other users, but only settled ones: a lower
+            # sequence of this user may still be uncommitted
+            settled_mark = min(SyncService.get_resync_point(), high_water_mark)
+            cursor['next_since'] = max(cursor['next_since'], settled_mark)
+
+    @staticmethod
+    def _hydrate(user, chunk: List[SyncChange], request) -> List[Optional[dict]]:
+        """
+        Client representation of each change of a chunk (None to skip it),
+        loading messages and matches in bulk.
+        """
+        match_ids = {change.match_id for change in chunk}
+        main_photos = ProfilePhoto.objects.filter(is_main=True)
+        matches = Match.objects.select_related(
+            'user1__profile',
+            'user2__profile',
+            'last_message',
+            'user1_last_read_message',
+            'user2_last_read_message',
+        ).prefetch_related(
+            Prefetch('user1__profile__photos', queryset=main_photos, to_attr='main_photos'),
+            Prefetch('user2__profile__photos', queryset=main_photos, to_attr='main_photos'),
+        ).in_bulk(match_ids)
+
+        message_ids = [change.message_id for change in chunk if change.kind in SyncService.MESSAGE_KINDS]
+        messages = {}
+        if message_ids:
+            for message in Message.objects.filter(id__in=message_ids).select_related('sender').defer('search_vector'):
+                message.match = matches[message.match_id]
+                messages[message.id] = message
+
+        new_matches = [
+            matches[change.match_id] for change in chunk
+            if change.kind == SyncChange.MATCH_CREATED and change.match_id in matches
+        ]
+        context = {'request': request}
+        if new_matches:
+            context['online_status'] = PresenceService.get_online_status(
+                match.get_other_user(user).id for match in new_matches
+            )
+
+        entries = []
+        for change in chunk:
+            entry = {
+                'seq': change.id,
+                'type': change.kind,
+                'conversation_id': str(change.match_id),
+            }
+            if change.kind in SyncService.MESSAGE_KINDS:
+                message = messages.get(change.message_id)
+                if message is None or SyncService._is_deleted_for(message, user):
+                    entries.append(None)
+                    continue
+                MessageService.apply_read_state(message.match, [message])
+                entry['message'] = MessageSerializer(message, context=context).data
+            elif change.kind == SyncChange.MESSAGE_DELETED:
+                entry['message_id'] = str(change.message_id)
+            elif change.kind == SyncChange.MESSAGES_READ:
+                entry['last_read_message_id'] = str(change.message_id) if change.message_id else None
+                entry.update(change.payload)
+            elif change.kind == SyncChange.MATCH_CREATED:
+                match = matches.get(change.match_id)
+                if match is None:
+                    entries.append(None)
+                    continue
+                entry['conversation'] = ConversationSerializer(match, context=context).data
+            else:
+                entry['status'] = change.payload.get('status')
+            entries.append(entry)
+        return entries
+
+    @staticmethod
+    def _is_deleted_for(message: Message, user) -> bool:
+        if message.sender_id == user.id:
+            return message.is_deleted_by_sender
+        return message.is_deleted_by_recipient
+
+    @staticmethod
+    def prune(retention_days: Optional[int] = None) -> int:
+        """
+        Delete changes older than the retention period. The latest change is
+        always kept so that stale sequences are still detected by
+        needs_full_resync.
+        Returns the number of deleted changes.
+        """
+        if retention_days is None:
+            retention_days = getattr(settings, 'SYNC_CHANGE_RETENTION_DAYS', 30)
+        latest = SyncService.get_high_water_mark()
+        cutoff = timezone.now() - timedelta(days=retention_days)
+        deleted, _ = SyncChange.objects.filter(created_at__lt=cutoff, id__lt=latest).delete()
+        if deleted:
+            logger.info(f"Pruned {deleted} sync changes")
+        return deleted
+
@@ -1,14 +1,17 @@
 """
 Asynchronous tasks for messaging app.
+
+Pushes go through authentication.notification_service.NotificationDispatcher,
+which buffers and collapses events per recipient. These tasks remain as
+entry points for already-queued jobs and for callers that need a task.
 """
 from celery import shared_task
-from django.contrib.auth import get_user_model
-from django.utils.translation import gettext as _
-from firebase_admin import messaging
 import logging
 
+from authentication import notification_service
+from authentication.notification_service import NotificationDispatcher
+
 logger = logging.getLogger('hivmeet.messaging')
-User = get_user_model()
 
 
 @shared_task
@@ -17,51 +20,12 @@ def send_message_notification(recipient_id, sender_id, message_preview, match_id
     Send push notification for new message.
     """
     try:
-        recipient = User.objects.get(id=recipient_id)
-        sender = User.objects.get(id=sender_id)
-        
-        # Check notification settings
-        notification_settings = recipient.notification_settings or {}
-        if not notification_settings.get('new_message_notifications', True):
-            return
-        
-        # Get FCM tokens
-        tokens = [token['token'] for token in recipient.fcm_tokens if token.get('token')]
-        
-        if not tokens:
-            logger.warning(f"No FCM tokens found for user {recipient.email}")
-            return
-        
-        # Create notification
-        notification = messaging.Notification(
-            title=sender.display_name,
-            body=message_preview
-        )
-        
-        # Create message
-        message = messaging.MulticastMessage(
-            notification=notification,
-            data={
-                'notification_type': 'NEW_MESSAGE',
-                'conversation_id': match_id,
-                'sender_id': str(sender_id),
-                'sender_name': sender.display_name,
-                'message_preview': message_preview,
-                'click_action': 'FLUTTER_NOTIFICATION_CLICK'
-            },
-            tokens=tokens
-        )
-        
-        # Send notification
-        response = messaging.send_multicast(message)
-        
-        logger.info(
-            f"Message notification sent to {recipient.email}: "
-            f"{response.success_count} successful, {response.failure_count} failed"
+        NotificationDispatcher.enqueue(
+            recipient_id,
+            notification_service.MESSAGE,
+            actor_id=sender_id,
+            data={'conversation_id': match_id, 'message_preview': message_preview},
         )
-        
-    except User.DoesNotExist:
-        logger.error(f"User not found: {recipient_id} or {sender_id}")
     except Exception as e:
         logger.error(f"Error sending message notification: {str(e)}")
 
@@ -69,62 +33,15 @@ def send_message_notification(recipient_id, sender_id, message_preview, match_id
 @shared_task
 def send_call_notification(callee_id, caller_id, call_type, match_id):
     """
-    Send push notification for incoming call.
+    Send push notification for incoming call (not buffered).
     """
     try:
-        callee = User.objects.get(id=callee_id)
-        caller = User.objects.get(id=caller_id)
-        
-        # Get FCM tokens
-        tokens = [token['token'] for token in callee.fcm_tokens if token.get('token')]
-        
-        if not tokens:
-            logger.warning(f"No FCM tokens found for user {callee.email}")
-            return
-        
-        # Create notification
-        call_type_text = _("Audio call") if call_type == 'audio' else _("Video call")
-        notification = messaging.Notification(
-            title=f"{call_type_text} from {caller.display_name}",
-            body=_("Tap to answer")
+        NotificationDispatcher.send_now(
+            callee_id,
+            notification_service.CALL,
+            actor_id=caller_id,
+            data={'call_type': call_type, 'match_id': match_id},
         )
-        
-        # Create message with high priority
-        message = messaging.MulticastMessage(
-            notification=notification,
-            data={
-                'notification_type': 'INCOMING_CALL',
-                'call_type': call_type,
-                'caller_id': str(caller_id),
-                'caller_name': caller.display_name,
-                'match_id': match_id,
-                'click_action': 'FLUTTER_NOTIFICATION_CLICK'
-            },
-            android=messaging.AndroidConfig(
-                priority='high',
-                ttl=30  # 30 seconds TTL for call notifications
-            ),
-            apns=messaging.APNSConfig(
-                payload=messaging.APNSPayload(
-                    aps=messaging.Aps(
-                        content_available=True,
-                        sound='ringtone.caf'
-                    )
-                )
-            ),
-            tokens=tokens
-        )
-        
-        # Send notification
-        response = messaging.send_multicast(message)
-        
-        logger.info(
-            f"Call notification sent to {callee.email}: "
-            f"{response.success_count} successful"
-        )
-        
-    except User.DoesNotExist:
-        logger.error(f"User not found: {callee_id} or {caller_id}")
     except Exception as e:
         logger.error(f"Error sending call notification: {str(e)}")
 
@@ -135,47 +52,57 @@ def send_read_notification(recipient_id, reader_id, match_id, message_id):
     Send push notification when a message has been read.
     """
     try:
-        recipient = User.objects.get(id=recipient_id)
-        reader = User.objects.get(id=reader_id)
-
-        notification_settings = recipient.notification_settings or {}
-        if not notification_settings.get('message_read_notifications', True):
-            return
+        NotificationDispatcher.enqueue(
+            recipient_id,
+            notification_service.READ,
+            actor_id=reader_id,
+            data={'conversation_id': match_id, 'message_id': message_id},
+        )
+    except Exception as e:
+        logger.error(f"Error sending read notification: {str(e)}")
 
-        tokens = [token['token'] for token in recipient.fcm_tokens if token.get('token')]
-        if not tokens:
-            logger.warning(f"No FCM tokens found for user {recipient.email}")
-            return
 
-        notification = messaging.Notification(
-            title=reader.display_name,
-            body=_("Read your message")
-        )
+# Note: send_match_notification is now handled in matching/tasks.py to avoid duplication
 
-        message = messaging.MulticastMessage(
-            notification=notification,
-            data={
-                'notification_type': 'MESSAGE_READ',
-                'conversation_id': match_id,
-                'reader_id': str(reader_id),
-                'reader_name': reader.display_name,
-                'message_id': str(message_id),
-                'click_action': 'FLUTTER_NOTIFICATION_CLICK'
-            },
-            tokens=tokens
-        )
 
-        response = messaging.send_multicast(message)
+@shared_task
+def maintain_message_partitions():
+    """
+    Create upcoming monthly message partitions and archive cold ones.
+    Runs daily.
+    """
+    from .archive_service import MessageArchiveService
+    try:
+        created = MessageArchiveService.ensure_partitions()
+        archived = MessageArchiveService.archive_partitions()
+        return {'created': len(created), 'archived': len(archived)}
+    except Exception as e:
+        logger.error(f"Error maintaining message partitions: {str(e)}")
+        return {'created': 0, 'archived': 0}
 
-        logger.info(
-            f"Read notification sent to {recipient.email}: "
-            f"{response.success_count} successful, {response.failure_count} failed"
-        )
 
-    except User.DoesNotExist:
-        logger.error(f"User not found: {recipient_id} or {reader_id}")
+@shared_task
+def prune_sync_changes():
+    """
+    Delete sync changes older than the retention period.
+    Runs daily.
+    """
+    from .sync_service import SyncService
+    try:
+        return {'deleted': SyncService.prune()}
     except Exception as e:
-        logger.error(f"Error sending read notification: {str(e)}")
+        logger.error(f"Error pruning sync changes: {str(e)}")
+        return {'deleted': 0}
 
 
-# Note: send_match_notification is now handled in matching/tasks.py to avoid duplication
\ No newline at end of file
+@shared_task
+def process_message_media(message_id):
+    """
+    Generate thumbnails, renditions and placeholders of a media message.
+    """
+    from .media_service import MessageMediaService
+    try:
+        return {'processed': MessageMediaService.process(message_id)}
+    except Exception as e:
+        logger.error(f"Error processing media of message {message_id}: {str(e)}")
+        return {'processed': False}
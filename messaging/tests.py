@@ -1,18 +1,37 @@
-from datetime import date
+import asyncio
+import importlib
+import io
+import json
+import os
+import tempfile
+import uuid
+from datetime import date, datetime, timedelta, timezone as dt_timezone
 from unittest.mock import patch
 
+from asgiref.sync import async_to_sync
+from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import IntegrityError, connection, transaction
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from django.utils import timezone
+from PIL import Image
 from rest_framework import status
 from rest_framework.test import APITestCase
 
 from matching.models import Match
-from messaging.models import Call, Message
+from messaging import call_budget_service
+from messaging.archive_service import MessageArchiveService
+from messaging.call_budget_service import CallBudgetService
+from messaging.media_service import MessageMediaService
+from messaging.models import Call, Message, MessageClientId, MessageReaction, SyncChange, TypingIndicator
+from messaging.services import CallService, MessageService
 from messaging.signals import handle_call_update, handle_new_message
 from messaging.tasks import send_call_notification, send_message_notification, send_read_notification
-from profiles.models import Profile
+from messaging.write_buffer import MessageWriteBuffer, persist_messages
+from profiles.models import Profile, ProfilePhoto
 
 
 User = get_user_model()
@@ -52,21 +71,65 @@ class MessagingApiDeterministicTests(APITestCase):
 		return reverse('api:messaging:conversation-messages', kwargs={'conversation_id': conversation_id or self.match.id})
 
 	def test_conversation_list_includes_unread_and_last_message(self):
-		Message.objects.create(match=self.match, sender=self.user1, content='Hello', message_type=Message.TEXT)
-		self.match.last_message_at = timezone.now()
-		self.match.last_message_preview = 'Hello'
-		self.match.user2_unread_count = 1
-		self.match.save(update_fields=['last_message_at', 'last_message_preview', 'user2_unread_count'])
+		message = Message.objects.create(match=self.match, sender=self.user1, content='Hello', message_type=Message.TEXT)
+		self.match.record_message(message, 'Hello')
 
 		self._auth(self.user2)
 		response = self.client.get(reverse('api:messaging:conversation-list'))
 
 		self.assertEqual(response.status_code, status.HTTP_200_OK)
-		self.assertEqual(response.data['count'], 1)
+		self.assertEqual(len(response.data['results']), 1)
 		conversation = response.data['results'][0]
 		self.assertEqual(conversation['unread_count_for_me'], 1)
 		self.assertIn('other_user', conversation)
-		self.assertIn('last_message', conversation)
+		self.assertEqual(conversation['last_message']['message_id'], str(message.id))
+
+	def test_conversation_list_query_count_does_not_grow(self):
+		def add_conversation(index):
+			other = User.objects.create_user(
+				email=f'c{index}@example.com',
+				password='TestPass123!',
+				display_name=f'Contact {index}',
+				birth_date=date(1990, 1, 1),
+			)
+			ProfilePhoto.objects.create(profile=other.profile, photo_url=f'https://cdn/{index}.jpg', is_main=True)
+			match = Match.objects.create(user1=self.user1, user2=other, status=Match.ACTIVE)
+			match.record_message(Message.objects.create(match=match, sender=other, content='Hi'), 'Hi')
+
+		self._auth(self.user1)
+		url = reverse('api:messaging:conversation-list')
+		add_conversation(0)
+		with CaptureQueriesContext(connection) as one:
+			self.client.get(url)
+		for index in range(1, 6):
+			add_conversation(index)
+		with CaptureQueriesContext(connection) as many:
+			response = self.client.get(url)
+
+		self.assertEqual(len(response.data['results']), 6)
+		self.assertEqual(response.data['results'][0]['other_user']['main_photo_url'], 'https://cdn/5.jpg')
+		self.assertEqual(len(many), len(one))
+
+	def test_conversation_list_cursor_reaches_ties(self):
+		same_time = timezone.now()
+		for index in range(5):
+			other = User.objects.create_user(
+				email=f't{index}@example.com', password='TestPass123!', display_name=f'Tie {index}', birth_date=date(1990, 1, 1),
+			)
+			match = Match.objects.create(user1=self.user1, user2=other, status=Match.ACTIVE)
+			match.record_message(Message.objects.create(match=match, sender=other, content='Hi'), 'Hi')
+		Match.objects.exclude(pk=self.match.pk).update(last_message_at=same_time, last_activity_at=same_time)
+
+		self._auth(self.user1)
+		seen = []
+		url = f"{reverse('api:messaging:conversation-list')}?page_size=2"
+		while url:
+			response = self.client.get(url)
+			self.assertNotIn('count', response.data)
+			seen.extend(item['id'] for item in response.data['results'])
+			url = response.data['next']
+		self.assertEqual(len(seen), 5)
+		self.assertEqual(len(set(seen)), 5)
 
 	def test_send_message_creates_message_and_increments_unread(self):
 		self._auth(self.user1)
@@ -82,6 +145,33 @@ class MessagingApiDeterministicTests(APITestCase):
 		self.assertEqual(self.match.user2_unread_count, 1)
 		self.assertEqual(Message.objects.filter(match=self.match).count(), 1)
 
+	def test_unread_counters_and_badge_total(self):
+		other_match = Match.objects.create(user1=self.user2, user2=self.user3, status=Match.ACTIVE)
+		self._auth(self.user3)
+		self.client.post(self._messages_url(other_match.id), {'client_message_id': 'c3-0', 'content': 'Hey', 'type': 'text'}, format='json')
+		self._auth(self.user1)
+		for i in range(3):
+			self.client.post(self._messages_url(), {'client_message_id': f'c1-{i}', 'content': f'Msg {i}', 'type': 'text'}, format='json')
+
+		self.match.refresh_from_db()
+		self.user2.refresh_from_db()
+		self.assertEqual(self.match.user2_unread_count, 3)
+		self.assertEqual(self.match.last_message_preview, 'Msg 2')
+		self.assertEqual(self.user2.total_unread_count, 4)
+
+		self._auth(self.user2)
+		response = self.client.get(reverse('api:messaging:unread-count'))
+		self.assertEqual(response.data['total_unread_count'], 4)
+
+		url = reverse('api:messaging:mark-as-read', kwargs={'conversation_id': self.match.id})
+		with patch('messaging.services.NotificationDispatcher.enqueue'):
+			self.client.put(url, {}, format='json')
+
+		self.match.refresh_from_db()
+		self.user2.refresh_from_db()
+		self.assertEqual(self.match.user2_unread_count, 0)
+		self.assertEqual(self.user2.total_unread_count, 1)
+
 	def test_send_message_deduplicates_by_client_message_id(self):
 		self._auth(self.user1)
 		payload = {
@@ -97,22 +187,249 @@ class MessagingApiDeterministicTests(APITestCase):
 		self.assertEqual(response1.data['message_id'], response2.data['message_id'])
 		self.assertEqual(Message.objects.filter(match=self.match, client_message_id='same-id').count(), 1)
 
+	def test_client_message_ids_are_unique_per_sender(self):
+		sent, _ = MessageService.send_message(self.user1, self.match, 'One', client_message_id='retry-1')
+		retried, _ = MessageService.send_message(self.user1, self.match, 'One', client_message_id='retry-1')
+		reply, _ = MessageService.send_message(self.user2, self.match, 'Two', client_message_id='retry-1')
+
+		self.assertEqual(retried.id, sent.id)
+		self.assertNotEqual(reply.id, sent.id)
+		with self.assertRaises(IntegrityError), transaction.atomic():
+			MessageClientId.objects.create(
+				match=self.match, sender=self.user1, client_message_id='retry-1', message_id=uuid.uuid4(),
+			)
+
 	def test_get_messages_marks_received_messages_as_read(self):
 		msg = Message.objects.create(match=self.match, sender=self.user1, content='Unread', status=Message.SENT)
 		self.match.user2_unread_count = 1
 		self.match.save(update_fields=['user2_unread_count'])
 
 		self._auth(self.user2)
-		with patch('messaging.services.send_read_notification.delay') as mocked_delay:
+		with patch('messaging.services.NotificationDispatcher.enqueue') as mocked_delay:
 			response = self.client.get(self._messages_url())
 
 		self.assertEqual(response.status_code, status.HTTP_200_OK)
-		msg.refresh_from_db()
+		self.assertEqual(response.data['results'][0]['status'], Message.READ)
 		self.match.refresh_from_db()
-		self.assertEqual(msg.status, Message.READ)
+		self.assertTrue(self.match.has_read(self.user2, msg))
 		self.assertEqual(self.match.user2_unread_count, 0)
 		mocked_delay.assert_called_once()
 
+	def test_read_watermark_replaces_per_message_updates(self):
+		msgs = [
+			Message.objects.create(match=self.match, sender=self.user1, content=f'Msg {i}', status=Message.SENT)
+			for i in range(3)
+		]
+
+		self._auth(self.user2)
+		with patch('messaging.services.NotificationDispatcher.enqueue') as mocked_delay:
+			self.client.get(self._messages_url())
+			with CaptureQueriesContext(connection) as ctx:
+				response = self.client.get(self._messages_url())
+
+		# Rows are never rewritten, read state comes from the watermark
+		self.assertEqual(Message.objects.filter(match=self.match, status=Message.SENT).count(), 3)
+		self.assertEqual([item['status'] for item in response.data['results']], [Message.READ] * 3)
+		self.match.refresh_from_db()
+		self.assertEqual(self.match.user2_last_read_message_id, msgs[-1].id)
+		self.assertIsNotNone(self.match.user2_last_read_at)
+		self.assertIsNone(self.match.user1_last_read_message_id)
+		# Already read: no UPDATE and no second read receipt
+		self.assertFalse(any(q['sql'].startswith('UPDATE') for q in ctx.captured_queries))
+		mocked_delay.assert_called_once()
+
+		self._auth(self.user1)
+		response = self.client.get(self._messages_url())
+		self.assertEqual(response.data['results'][0]['status'], Message.READ)
+
+	def test_get_messages_cursor_pagination_without_count(self):
+		created = [
+			Message.objects.create(match=self.match, sender=self.user1, content=f'Msg {i}', status=Message.READ)
+			for i in range(5)
+		]
+
+		self._auth(self.user2)
+		seen = []
+		url = f"{self._messages_url()}?page_size=2"
+		pages = 0
+		while url:
+			response = self.client.get(url)
+			self.assertEqual(response.status_code, status.HTTP_200_OK)
+			self.assertIsNone(response.data['count'])
+			seen.extend(item['id'] for item in response.data['results'])
+			pages += 1
+			url = f"{self._messages_url()}{response.data['next']}" if response.data['next'] else None
+			self.assertEqual(response.data['has_more'], url is not None)
+
+		self.assertEqual(pages, 3)
+		self.assertEqual(seen, [str(m.id) for m in reversed(created)])
+
+		response = self.client.get(f"{self._messages_url()}?page_size=2&include_count=true")
+		self.assertEqual(response.data['count'], 5)
+
+	def _install_search_trigger(self):
+		# Migrations are disabled in tests: install the search trigger
+		migration = importlib.import_module('messaging.migrations.0002_message_search_vector')
+		with connection.cursor() as cursor:
+			cursor.execute(migration.CREATE_TRIGGER)
+
+	def test_search_messages_scoped_paginated_and_highlighted(self):
+		self._install_search_trigger()
+
+		hits = [
+			Message.objects.create(match=self.match, sender=self.user1, content=f'On se voit au cinema {i} ?')
+			for i in range(3)
+		]
+		Message.objects.create(match=self.match, sender=self.user1, content='Bonne nuit')
+		Message.objects.create(
+			match=self.match, sender=self.user1, content='Pas de cinema finalement', is_deleted_by_recipient=True,
+		)
+		other_match = Match.objects.create(user1=self.user2, user2=self.user3, status=Match.ACTIVE)
+		Message.objects.create(match=other_match, sender=self.user3, content='cinema ce soir')
+
+		self._auth(self.user2)
+		url = reverse('api:messaging:search-messages', kwargs={'conversation_id': self.match.id})
+		response = self.client.get(url, {'q': 'cinema', 'page_size': 2})
+		self.assertEqual(response.status_code, status.HTTP_200_OK)
+		self.assertTrue(response.data['has_more'])
+		self.assertIn('<mark>cinema</mark>', response.data['results'][0]['snippet'])
+
+		seen = [item['id'] for item in response.data['results']]
+		response = self.client.get(f"{url}{response.data['next']}")
+		seen.extend(item['id'] for item in response.data['results'])
+		self.assertFalse(response.data['has_more'])
+		self.assertEqual(seen, [str(m.id) for m in reversed(hits)])
+
+		self.assertEqual(self.client.get(url, {'q': ' '}).status_code, status.HTTP_400_BAD_REQUEST)
+		self.assertEqual(self.client.get(url, {'q': 'cinema', 'page_size': 'abc'}).status_code, status.HTTP_400_BAD_REQUEST)
+
+		# Out of range page sizes are clamped to 1..100
+		response = self.client.get(url, {'q': 'cinema', 'page_size': 0})
+		self.assertEqual(response.status_code, status.HTTP_200_OK)
+		self.assertEqual(len(response.data['results']), 1)
+		self.assertTrue(response.data['has_more'])
+		response = self.client.get(url, {'q': 'cinema', 'page_size': -5})
+		self.assertEqual(len(response.data['results']), 1)
+
+	def test_search_snippet_escapes_content(self):
+		self._install_search_trigger()
+		Message.objects.create(
+			match=self.match, sender=self.user1, content='<img src=x onerror=alert(1)> cinema & resto',
+		)
+
+		self._auth(self.user2)
+		url = reverse('api:messaging:search-messages', kwargs={'conversation_id': self.match.id})
+		snippet = self.client.get(url, {'q': 'cinema'}).data['results'][0]['snippet']
+
+		self.assertIn('<mark>cinema</mark> &amp; resto', snippet)
+		self.assertNotIn('<', snippet.replace('<mark>', '').replace('</mark>', ''))
+		self.assertIn('&gt;', snippet)
+
+	def test_old_history_is_read_from_the_archive(self):
+		old_month = date(2020, 1, 1)
+		Match.objects.filter(pk=self.match.pk).update(created_at=timezone.now() - timedelta(days=800))
+		archived = []
+		for i in range(3):
+			msg = Message.objects.create(
+				match=self.match, sender=self.user1, content=f'Old {i}', is_deleted_by_recipient=(i == 0),
+			)
+			Message.objects.filter(pk=msg.pk).update(created_at=datetime(2020, 1, 10 + i, tzinfo=dt_timezone.utc))
+			archived.append(msg)
+		live = Message.objects.create(match=self.match, sender=self.user1, content='Recent')
+
+		with tempfile.TemporaryDirectory() as archive_dir, self.settings(MESSAGE_ARCHIVE_DIR=archive_dir):
+			old_messages = Message.objects.filter(pk__in=[m.pk for m in archived])
+			self.assertEqual(MessageArchiveService.export_messages(old_month, old_messages), 3)
+			old_messages.delete()
+
+			self._auth(self.user2)
+			response = self.client.get(f"{self._messages_url()}?page_size=2")
+			self.assertEqual([item['content'] for item in response.data['results']], ['Recent', 'Old 2'])
+			self.assertTrue(response.data['has_more'])
+
+			response = self.client.get(f"{self._messages_url()}{response.data['next']}")
+			# Deleted on the recipient side before archival: still hidden
+			self.assertEqual([item['content'] for item in response.data['results']], ['Old 1'])
+			self.assertFalse(response.data['has_more'])
+
+		self.match.refresh_from_db()
+		self.assertEqual(self.match.user2_last_read_message_id, live.id)
+
+	def test_archival_exports_reactions_and_releases_watermarks(self):
+		old = Message.objects.create(match=self.match, sender=self.user1, content='Old')
+		MessageReaction.objects.create(message=old, user=self.user2, emoji='👍')
+		self.match.record_message(old, 'Old')
+		self.match.advance_read_watermark(self.user2, old)
+
+		with tempfile.TemporaryDirectory() as archive_dir, self.settings(MESSAGE_ARCHIVE_DIR=archive_dir):
+			old_messages = Message.objects.filter(pk=old.pk)
+			MessageArchiveService.export_messages(date(2020, 1, 1), old_messages)
+			MessageArchiveService.release_references(old_messages)
+			# Like dropping the partition: no ORM cascade
+			old_messages._raw_delete(old_messages.db)
+			archived = MessageArchiveService.get_archived_messages(self.user2, self.match)
+
+		self.assertEqual([r['emoji'] for r in archived[0].archived_reactions], ['👍'])
+		self.assertFalse(MessageReaction.objects.exists())
+		self.match.refresh_from_db()
+		self.assertIsNone(self.match.last_message_id)
+		self.assertIsNone(self.match.user2_last_read_message_id)
+
+		# The watermark moves again once the conversation resumes
+		new = Message.objects.create(match=self.match, sender=self.user1, content='New')
+		self.assertTrue(self.match.advance_read_watermark(self.user2, new))
+
+	def test_sync_returns_changes_across_conversations(self):
+		self._auth(self.user2)
+		url = reverse('api:messaging:sync')
+		with self.settings(SYNC_SETTLE_SECONDS=0):
+			response = self.client.get(url)
+		self.assertTrue(response.data['full_resync'])
+		since = response.data['next_since']
+		self.assertEqual(self.client.get(f'{url}?since=abc').status_code, status.HTTP_400_BAD_REQUEST)
+
+		hello, _ = MessageService.send_message(self.user1, self.match, 'Hello', client_message_id='sync-1')
+		bye, _ = MessageService.send_message(self.user1, self.match, 'Bye', client_message_id='sync-2')
+		MessageService.delete_message(self.user2, bye)
+		MessageService.mark_messages_as_read(self.user2, self.match)
+		other_match = Match.objects.create(user1=self.user1, user2=self.user3, status=Match.ACTIVE)
+		new_match = Match.objects.create(user1=self.user3, user2=self.user2, status=Match.ACTIVE)
+
+		with self.settings(SYNC_SETTLE_SECONDS=0):
+			response = self.client.get(f'{url}?since={since}')
+			body = json.loads(b''.join(response.streaming_content))
+			changes = body['changes']
+			self.assertFalse(body['full_resync'])
+			self.assertEqual(
+				[change['type'] for change in changes],
+				['message.created', 'message.deleted', 'messages.read', 'match.created'],
+			)
+			self.assertEqual(changes[0]['message']['content'], 'Hello')
+			self.assertEqual(changes[1]['message_id'], str(bye.id))
+			self.assertEqual(changes[2]['last_read_message_id'], str(bye.id))
+			self.assertEqual(changes[3]['conversation_id'], str(new_match.id))
+			self.assertEqual(body['next_since'], changes[-1]['seq'])
+
+			response = self.client.get(f"{url}?since={body['next_since']}")
+			self.assertEqual(json.loads(b''.join(response.streaming_content))['changes'], [])
+
+		# Recent changes may still have earlier ones committing: sent again next time
+		response = self.client.get(f'{url}?since={since}')
+		body = json.loads(b''.join(response.streaming_content))
+		self.assertEqual(len(body['changes']), 4)
+		self.assertEqual(body['next_since'], since)
+
+		# Unsettled changes of other users are not skipped over either
+		SyncChange.objects.update(created_at=timezone.now() - timedelta(minutes=1))
+		settled_seq = SyncChange.objects.latest('id').id
+		SyncChange.record(SyncChange.match_changed(other_match, SyncChange.MATCH_ENDED))
+		response = self.client.get(f'{url}?since={changes[-1]["seq"]}')
+		self.assertEqual(json.loads(b''.join(response.streaming_content))['next_since'], settled_seq)
+
+		# A sequence ahead of the log (restored database) needs a full resync
+		response = self.client.get(f'{url}?since={settled_seq + 100}')
+		self.assertTrue(response.data['full_resync'])
+
 	def test_mark_single_message_as_read_endpoint(self):
 		msg = Message.objects.create(match=self.match, sender=self.user1, content='Ping', status=Message.SENT)
 		self.match.user2_unread_count = 1
@@ -123,8 +440,10 @@ class MessagingApiDeterministicTests(APITestCase):
 		response = self.client.put(url, {}, format='json')
 
 		self.assertEqual(response.status_code, status.HTTP_200_OK)
-		msg.refresh_from_db()
-		self.assertEqual(msg.status, Message.READ)
+		self.assertIsNotNone(response.data['read_at'])
+		self.match.refresh_from_db()
+		self.assertTrue(self.match.has_read(self.user2, msg))
+		self.assertEqual(self.match.user2_unread_count, 0)
 
 	def test_mark_messages_as_read_batch_endpoint(self):
 		msg1 = Message.objects.create(match=self.match, sender=self.user1, content='One', status=Message.SENT)
@@ -134,16 +453,15 @@ class MessagingApiDeterministicTests(APITestCase):
 
 		self._auth(self.user2)
 		url = reverse('api:messaging:mark-as-read', kwargs={'conversation_id': self.match.id})
-		with patch('messaging.services.send_read_notification.delay') as mocked_delay:
+		with patch('messaging.services.NotificationDispatcher.enqueue') as mocked_delay:
 			response = self.client.put(url, {'last_read_message_id': str(msg2.id)}, format='json')
 
 		self.assertEqual(response.status_code, status.HTTP_200_OK)
 		self.assertEqual(response.data['messages_marked'], 2)
 		mocked_delay.assert_called_once()
-		msg1.refresh_from_db()
-		msg2.refresh_from_db()
-		self.assertEqual(msg1.status, Message.READ)
-		self.assertEqual(msg2.status, Message.READ)
+		self.match.refresh_from_db()
+		self.assertTrue(self.match.has_read(self.user2, msg1))
+		self.assertTrue(self.match.has_read(self.user2, msg2))
 
 	def test_delete_message_soft_delete_sender(self):
 		msg = Message.objects.create(match=self.match, sender=self.user1, content='Delete me')
@@ -168,6 +486,23 @@ class MessagingApiDeterministicTests(APITestCase):
 		self.assertEqual(presence.status_code, status.HTTP_200_OK)
 		self.assertTrue(presence.data['participant']['is_typing'])
 
+	def test_typing_is_throttled_and_never_hits_the_database(self):
+		self._auth(self.user1)
+		typing_url = reverse('api:messaging:typing-indicator', kwargs={'conversation_id': self.match.id})
+
+		with patch('messaging.services.TypingService.broadcast') as mocked_broadcast:
+			for _ in range(5):
+				self.client.post(typing_url, {'is_typing': True}, format='json')
+			self.assertEqual(mocked_broadcast.call_count, 1)
+
+			self.assertEqual(MessageService.get_typing_users(self.match, exclude_user=self.user2), [self.user1])
+			self.client.post(typing_url, {'is_typing': False}, format='json')
+			self.client.post(typing_url, {'is_typing': False}, format='json')
+			self.assertEqual(mocked_broadcast.call_count, 2)
+
+		self.assertEqual(MessageService.get_typing_users(self.match), [])
+		self.assertFalse(TypingIndicator.objects.exists())
+
 	def test_non_premium_cannot_send_media_message(self):
 		self._auth(self.user1)
 		payload = {
@@ -179,17 +514,50 @@ class MessagingApiDeterministicTests(APITestCase):
 		response = self.client.post(self._messages_url(), payload, format='json')
 		self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
 
-	def test_generate_media_upload_url_returns_storage_payload(self):
+	def test_media_upload_url_then_send_processes_the_file(self):
+		self.user1.is_premium = True
+		self.user1.save(update_fields=['is_premium'])
 		self._auth(self.user1)
-		response = self.client.post(
-			reverse('api:messaging:generate-media-upload-url'),
-			{'file_name': 'photo.jpg', 'content_type': 'image/jpeg'},
-			format='json',
-		)
-
-		self.assertEqual(response.status_code, status.HTTP_200_OK)
-		self.assertIn('upload_url', response.data)
-		self.assertIn('file_path_on_storage', response.data)
+		buffer = io.BytesIO()
+		Image.new('RGB', (1200, 600), (20, 90, 200)).save(buffer, format='PNG')
+		available = {'available': True, 'reason': 'ok'}
+		with patch('messaging.views.check_feature_availability', return_value=available), patch(
+			'messaging.services.check_feature_availability', return_value=available
+		), tempfile.TemporaryDirectory() as media_root, self.settings(MEDIA_ROOT=media_root):
+			target = self.client.post(
+				reverse('api:messaging:generate-media-upload-url', kwargs={'conversation_id': self.match.id}),
+				{'file_name': 'photo.png', 'content_type': 'image/png'},
+				format='json',
+			)
+			self.assertEqual(target.status_code, status.HTTP_200_OK)
+			path = target.data['file_path_on_storage']
+			self.assertTrue(path.startswith(f'messages/{self.match.id}/'))
+
+			upload = self.client.put(target.data['upload_url'], buffer.getvalue(), content_type='image/png')
+			self.assertEqual(upload.status_code, status.HTTP_201_CREATED)
+			# Upload URLs are single use
+			again = self.client.put(target.data['upload_url'], b'other', content_type='image/png')
+			self.assertEqual(again.status_code, status.HTTP_409_CONFLICT)
+
+			with self.captureOnCommitCallbacks(execute=True):
+				response = self.client.post(
+					self._messages_url(),
+					{'client_message_id': 'media-url-1', 'type': 'image', 'media_file_path_on_storage': path},
+					format='json',
+				)
+			self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+			message = Message.objects.get(id=response.data['id'])
+			self.assertEqual(message.media_status, Message.MEDIA_READY)
+			self.assertEqual(message.media_url, message.media_info['renditions']['large'])
+
+			# The token only opens its own conversation
+			other_match = Match.objects.create(user1=self.user1, user2=self.user3, status=Match.ACTIVE)
+			token = target.data['upload_url'].rstrip('/').rsplit('/', 1)[1]
+			forged = reverse('api:messaging:upload-media-file', kwargs={'conversation_id': other_match.id, 'token': token})
+			self.assertEqual(
+				self.client.put(forged, b'data', content_type='image/png').status_code, status.HTTP_403_FORBIDDEN,
+			)
 
 	def test_premium_user_can_send_media_message(self):
 		self.user1.is_premium = True
@@ -198,7 +566,7 @@ class MessagingApiDeterministicTests(APITestCase):
 		upload = SimpleUploadedFile('photo.jpg', b'fake-image-bytes', content_type='image/jpeg')
 		with patch('messaging.views.check_feature_availability', return_value={'available': True, 'reason': 'ok'}), patch(
 			'messaging.services.check_feature_availability', return_value={'available': True, 'reason': 'ok'}
-		):
+		), tempfile.TemporaryDirectory() as media_root, self.settings(MEDIA_ROOT=media_root):
 			response = self.client.post(
 				reverse('api:messaging:send-media-message', kwargs={'conversation_id': self.match.id}),
 				{
@@ -213,6 +581,52 @@ class MessagingApiDeterministicTests(APITestCase):
 		self.assertEqual(response.data['message_type'], 'image')
 		self.assertIn('/media/messages/', response.data['media_url'])
 
+	def test_media_processing_generates_renditions_and_placeholder(self):
+		self.user1.is_premium = True
+		self.user1.save(update_fields=['is_premium'])
+		self._auth(self.user1)
+		buffer = io.BytesIO()
+		Image.new('RGB', (2000, 1000), (200, 40, 90)).save(buffer, format='PNG')
+		upload = SimpleUploadedFile('photo.png', buffer.getvalue(), content_type='image/png')
+		with patch('messaging.views.check_feature_availability', return_value={'available': True, 'reason': 'ok'}), patch(
+			'messaging.services.check_feature_availability', return_value={'available': True, 'reason': 'ok'}
+		), tempfile.TemporaryDirectory() as media_root, self.settings(MEDIA_ROOT=media_root):
+			with self.captureOnCommitCallbacks(execute=True):
+				response = self.client.post(
+					reverse('api:messaging:send-media-message', kwargs={'conversation_id': self.match.id}),
+					{'media_file': upload, 'media_type': 'image', 'client_message_id': 'media-3'},
+				)
+			self.assertEqual(response.data['media_status'], Message.MEDIA_PENDING)
+
+			message = Message.objects.get(id=response.data['id'])
+			self.assertEqual(message.media_status, Message.MEDIA_READY)
+			self.assertEqual(sorted(message.media_info['renditions']), ['large', 'medium'])
+			self.assertEqual(message.media_url, message.media_info['renditions']['large'])
+			self.assertEqual(len(message.media_info['blurhash']), 28)
+			thumbnail_path = os.path.join(media_root, message.media_thumbnail_url[len(settings.MEDIA_URL):])
+			with Image.open(thumbnail_path) as thumbnail:
+				self.assertEqual(thumbnail.size, (320, 160))
+			self.assertTrue(
+				SyncChange.objects.filter(message_id=message.id, kind=SyncChange.MESSAGE_UPDATED).exists()
+			)
+
+	def test_media_processing_rejects_files_of_other_conversations(self):
+		other_match = Match.objects.create(user1=self.user2, user2=self.user3, status=Match.ACTIVE)
+		with tempfile.TemporaryDirectory() as media_root, self.settings(MEDIA_ROOT=media_root):
+			buffer = io.BytesIO()
+			Image.new('RGB', (10, 10)).save(buffer, format='PNG')
+			upload = SimpleUploadedFile('photo.png', buffer.getvalue(), content_type='image/png')
+			other_path = MessageMediaService.save_upload(other_match, upload)
+
+			for path in (other_path, f'messages/{self.match.id}/../{other_path[len("messages/"):]}'):
+				message = Message.objects.create(
+					match=self.match, sender=self.user1, message_type=Message.IMAGE,
+					media_file_path=path, media_status=Message.MEDIA_PENDING,
+				)
+				self.assertFalse(MessageMediaService.process(message.id))
+				message.refresh_from_db()
+				self.assertEqual(message.media_status, Message.MEDIA_FAILED)
+
 	def test_premium_user_can_initiate_call(self):
 		self.user1.is_premium = True
 		self.user1.save(update_fields=['is_premium'])
@@ -238,7 +652,12 @@ class MessagingApiDeterministicTests(APITestCase):
 		with patch('messaging.services.send_call_notification.delay'):
 			initiate = self.client.post(
 				reverse('api:calls:initiate'),
-				{'target_user_id': str(self.user2.id), 'call_type': 'audio', 'offer_sdp': 'offer-data'},
+				{
+					'target_user_id': str(self.user2.id),
+					'call_type': 'audio',
+					'offer_sdp': 'offer-data',
+					'ice_candidates': [{'candidate': 'caller-1', 'sdpMid': '0', 'sdpMLineIndex': 0}],
+				},
 				format='json',
 			)
 
@@ -252,13 +671,25 @@ class MessagingApiDeterministicTests(APITestCase):
 			format='json',
 		)
 		self.assertEqual(answer.status_code, status.HTTP_200_OK)
-
-		ice = self.client.post(
-			reverse('api:calls:ice-candidate', kwargs={'call_id': call_id}),
-			{'candidate': {'candidate': 'abc', 'sdpMid': '0', 'sdpMLineIndex': 0}},
-			format='json',
-		)
+		# Candidates sent with the offer come back with the answer
+		self.assertEqual([c['candidate'] for c in answer.data['ice_candidates']], ['caller-1'])
+
+		ice_url = reverse('api:calls:ice-candidate', kwargs={'call_id': call_id})
+		with self.assertNumQueries(1):
+			ice = self.client.post(
+				ice_url,
+				{'candidates': [
+					{'candidate': 'abc', 'sdpMid': '0', 'sdpMLineIndex': 0},
+					{'candidate': 'def', 'sdpMid': '0', 'sdpMLineIndex': 0},
+				]},
+				format='json',
+			)
 		self.assertEqual(ice.status_code, status.HTTP_204_NO_CONTENT)
+		self.assertEqual(Call.objects.get(id=call_id).ice_candidates, [])
+
+		self._auth(self.user1)
+		peer = self.client.get(ice_url)
+		self.assertEqual([c['candidate'] for c in peer.data['candidates']], ['abc', 'def'])
 
 		end = self.client.post(
 			reverse('api:calls:terminate', kwargs={'call_id': call_id}),
@@ -271,6 +702,51 @@ class MessagingApiDeterministicTests(APITestCase):
 		self.assertEqual(call.status, Call.ENDED)
 		self.assertEqual(Message.objects.filter(match=self.match, message_type=Message.CALL_LOG).count(), 1)
 
+	def test_call_budget_is_counted_and_overlapping_calls_rejected(self):
+		for user in (self.user1, self.user3):
+			user.is_premium = True
+			user.save(update_fields=['is_premium'])
+		other_match = Match.objects.create(user1=self.user3, user2=self.user2, status=Match.ACTIVE)
+
+		with patch('messaging.services.send_call_notification.delay'):
+			call, error = CallService.initiate_call(self.user1, self.match, Call.AUDIO, 'offer-data')
+			self.assertIsNone(error)
+			# The callee is already in a call, whatever the conversation
+			self.assertIsNone(CallService.initiate_call(self.user3, other_match, Call.AUDIO, 'offer-data')[0])
+
+			call.answered_at = timezone.now() - timedelta(minutes=25)
+			CallService.end_call(call, 'ended_by_caller')
+			self.assertIsNotNone(CallService.initiate_call(self.user3, other_match, Call.AUDIO, 'offer-data')[0])
+
+		self.assertEqual(CallBudgetService.get_used_seconds(self.user2.id), 1500)
+		with self.assertNumQueries(0):
+			self.assertEqual(Call.check_call_limit(self.user1), (True, None))
+
+		extra = Call.objects.create(
+			match=self.match, caller=self.user2, callee=self.user1, call_type=Call.AUDIO,
+			status=Call.ENDED, duration_seconds=300,
+		)
+		CallBudgetService.record_call_end(extra)
+		can_call, _error = Call.check_call_limit(self.user1)
+		self.assertFalse(can_call)
+
+	def test_call_claim_is_kept_until_its_row_can_be_committed(self):
+		# Claimed by a concurrent initiate whose row is not committed yet
+		pending = Call(match=self.match, caller=self.user2, callee=self.user1, call_type=Call.AUDIO)
+		self.assertTrue(CallBudgetService.claim(pending))
+		self.assertFalse(Call.objects.filter(id=pending.id).exists())
+
+		call = Call(match=self.match, caller=self.user1, callee=self.user2, call_type=Call.AUDIO)
+		self.assertFalse(CallBudgetService.claim(call))
+
+		# Past the grace period, a holder without an active row is stale
+		later = timezone.now() + timedelta(seconds=call_budget_service.CLAIM_GRACE_SECONDS)
+		with patch('messaging.call_budget_service.timezone.now', return_value=later):
+			self.assertTrue(CallBudgetService.claim(call))
+		CallBudgetService.release(pending)
+		self.assertFalse(CallBudgetService.claim(pending))
+		CallBudgetService.release(call)
+
 	def test_non_premium_cannot_initiate_call(self):
 		self._auth(self.user1)
 		payload = {
@@ -305,14 +781,15 @@ class MessagingApiDeterministicTests(APITestCase):
 		self.assertEqual(response.status_code, status.HTTP_201_CREATED)
 		self.assertEqual(response.data['content'], 'Salut')
 
+	@override_settings(PUSH_NOTIFICATION_WINDOW_SECONDS=0)
 	def test_send_message_notification_task_uses_tokens(self):
 		self.user2.fcm_tokens = [{'token': 'tok-1'}]
 		self.user2.notification_settings = {'new_message_notifications': True}
 		self.user2.save(update_fields=['fcm_tokens', 'notification_settings'])
 
-		with patch('messaging.tasks.messaging.Notification') as mock_notification, patch(
-			'messaging.tasks.messaging.MulticastMessage'
-		) as mock_multicast, patch('messaging.tasks.messaging.send_multicast') as mock_send:
+		with patch('firebase_admin.messaging.Notification') as mock_notification, patch(
+			'firebase_admin.messaging.MulticastMessage'
+		) as mock_multicast, patch('firebase_admin.messaging.send_multicast') as mock_send:
 			mock_send.return_value.success_count = 1
 			mock_send.return_value.failure_count = 0
 			send_message_notification(self.user2.id, self.user1.id, 'Hello', str(self.match.id))
@@ -321,14 +798,15 @@ class MessagingApiDeterministicTests(APITestCase):
 		mock_multicast.assert_called_once()
 		mock_send.assert_called_once()
 
+	@override_settings(PUSH_NOTIFICATION_WINDOW_SECONDS=0)
 	def test_send_read_notification_task_uses_tokens(self):
 		self.user1.fcm_tokens = [{'token': 'tok-1'}]
 		self.user1.notification_settings = {'message_read_notifications': True}
 		self.user1.save(update_fields=['fcm_tokens', 'notification_settings'])
 
-		with patch('messaging.tasks.messaging.Notification') as mock_notification, patch(
-			'messaging.tasks.messaging.MulticastMessage'
-		) as mock_multicast, patch('messaging.tasks.messaging.send_multicast') as mock_send:
+		with patch('firebase_admin.messaging.Notification') as mock_notification, patch(
+			'firebase_admin.messaging.MulticastMessage'
+		) as mock_multicast, patch('firebase_admin.messaging.send_multicast') as mock_send:
 			mock_send.return_value.success_count = 1
 			mock_send.return_value.failure_count = 0
 			send_read_notification(self.user1.id, self.user2.id, str(self.match.id), 'message-id')
@@ -341,9 +819,9 @@ class MessagingApiDeterministicTests(APITestCase):
 		self.user2.fcm_tokens = [{'token': 'tok-1'}]
 		self.user2.save(update_fields=['fcm_tokens'])
 
-		with patch('messaging.tasks.messaging.Notification') as mock_notification, patch(
-			'messaging.tasks.messaging.MulticastMessage'
-		) as mock_multicast, patch('messaging.tasks.messaging.send_multicast') as mock_send:
+		with patch('firebase_admin.messaging.Notification') as mock_notification, patch(
+			'firebase_admin.messaging.MulticastMessage'
+		) as mock_multicast, patch('firebase_admin.messaging.send_multicast') as mock_send:
 			mock_send.return_value.success_count = 1
 			send_call_notification(self.user2.id, self.user1.id, 'audio', str(self.match.id))
 
@@ -354,7 +832,7 @@ class MessagingApiDeterministicTests(APITestCase):
 	def test_handle_new_message_signal_dispatches_socket_and_notification(self):
 		message = Message.objects.create(match=self.match, sender=self.user1, content='Signal test', message_type=Message.TEXT)
 
-		with patch('messaging.signals.send_message_notification.delay') as mocked_delay, patch(
+		with patch('messaging.signals.NotificationDispatcher.enqueue') as mocked_delay, patch(
 			'messaging.signals.channel_layer'
 		) as mocked_channel_layer, patch('messaging.signals.async_to_sync', side_effect=lambda fn: fn):
 			handle_new_message(Message, message, True)
@@ -378,3 +856,41 @@ class MessagingApiDeterministicTests(APITestCase):
 			handle_call_update(Call, call, True)
 
 		mocked_channel_layer.group_send.assert_called_once()
+
+	def test_persist_messages_batches_dedupes_and_counts_unread(self):
+		batch = [
+			Message(match=self.match, sender=self.user1, content='One', client_message_id='a'),
+			Message(match=self.match, sender=self.user1, content='Two', client_message_id='b'),
+			Message(match=self.match, sender=self.user1, content='Two again', client_message_id='b'),
+			Message(match=self.match, sender=self.user2, content='Reply', client_message_id='a'),
+		]
+		stored = persist_messages(batch)
+
+		self.assertIs(stored[2], stored[1])
+		self.assertEqual(Message.objects.filter(match=self.match).count(), 3)
+		self.assertEqual(persist_messages([Message(match=self.match, sender=self.user1, content='x', client_message_id='a')])[0].id, stored[0].id)
+
+		self.match.refresh_from_db()
+		self.user2.refresh_from_db()
+		self.assertEqual(self.match.user2_unread_count, 2)
+		self.assertEqual(self.match.user1_unread_count, 1)
+		self.assertEqual(self.match.last_message_id, stored[3].id)
+		self.assertEqual(self.user2.total_unread_count, 2)
+
+	def test_write_buffer_flushes_in_batches_in_order(self):
+		batches = []
+
+		def fake_persist(messages):
+			batches.append([m.content for m in messages])
+			return messages
+
+		async def scenario():
+			buffer = MessageWriteBuffer(max_batch=3, max_delay=0.001)
+			messages = [Message(match=self.match, sender=self.user1, content=str(i)) for i in range(5)]
+			return await asyncio.gather(*(buffer.submit(m) for m in messages))
+
+		with patch('messaging.write_buffer.persist_messages', side_effect=fake_persist):
+			stored = async_to_sync(scenario)()
+
+		self.assertEqual([m.content for m in stored], ['0', '1', '2', '3', '4'])
+		self.assertEqual(batches, [['0', '1', '2'], ['3', '4']])
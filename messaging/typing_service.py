@@ -0,0 +1,86 @@
+"""
+Typing indicators for HIVMeet.
+
+Typing state is ephemeral: a short-TTL cache key per (conversation, user),
+never written to the database. Keystroke events are throttled so that at
+most one typing_indicator event per user and conversation is broadcast
+every THROTTLE_SECONDS; the TTL expires indicators of clients that never
+send a stop.
+"""
+import logging
+from typing import Iterable, Set
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.core.cache import cache
+
+logger = logging.getLogger('hivmeet.messaging')
+
+# Typing state expires this long after the last broadcast start
+TTL_SECONDS = 10
+
+# Minimum delay between two typing broadcasts of a user in a conversation
+THROTTLE_SECONDS = 3
+
+
+def _typing_key(match_id, user_id) -> str:
+    return f'typing_{match_id}_{user_id}'
+
+
+def _throttle_key(match_id, user_id) -> str:
+    return f'typing_throttle_{match_id}_{user_id}'
+
+
+class TypingService:
+    """
+    Service for ephemeral typing indicators.
+    """
+
+    @staticmethod
+    def start(match_id, user_id) -> bool:
+        """
+        Record a typing event.
+        Returns True if it should be broadcast, False while throttled.
+        """
+        if not cache.add(_throttle_key(match_id, user_id), True, THROTTLE_SECONDS):
+            return False
+        cache.set(_typing_key(match_id, user_id), True, TTL_SECONDS)
+        return True
+
+    @staticmethod
+    def stop(match_id, user_id) -> bool:
+        """
+        Clear typing state.
+        Returns True if the user was typing, i.e. a stop should be broadcast.
+        """
+        cache.delete(_throttle_key(match_id, user_id))
+        return bool(cache.delete(_typing_key(match_id, user_id)))
+
+    @staticmethod
+    def get_typing_user_ids(match_id, user_ids: Iterable) -> Set[str]:
+        """Which of the given users are typing in a conversation (one multi-get)."""
+        keys = {_typing_key(match_id, user_id): str(user_id) for user_id in user_ids}
+        if not keys:
+            return set()
+        return {keys[key] for key, value in cache.get_many(list(keys)).items() if value}
+
+    @staticmethod
+    def broadcast(match_id, user_id, is_typing: bool):
+        """Send a typing_indicator event to the conversation group (HTTP path)."""
+        try:
+            channel_layer = get_channel_layer()
+        except Exception as e:
+            logger.warning(f"Redis non disponible (Channel Layer): {str(e)}")
+            return
+        if channel_layer is None:
+            return
+
+        try:
+            async_to_sync(channel_layer.group_send)(f'conversation_{match_id}', {
+                'type': 'typing_indicator',
+                'conversation_id': str(match_id),
+                'user_id': str(user_id),
+                'status': 'typing' if is_typing else 'stopped',
+            })
+        except Exception as e:
+            logger.warning(f"Error broadcasting typing indicator: {str(e)}")
@@ -9,11 +9,15 @@ app_name = 'messaging'
 urlpatterns = [
     # Conversations
     path('', views.ConversationListView.as_view(), name='conversation-list'),
-    path('generate-media-upload-url/', views.generate_media_upload_url, name='generate-media-upload-url'),
+    path('unread-count/', views.unread_count, name='unread-count'),
+    path('sync/', views.sync_conversations, name='sync'),
     
     # Messages
     path('<uuid:conversation_id>/messages/', views.conversation_messages, name='conversation-messages'),
     path('<uuid:conversation_id>/messages/media/', views.SendMediaMessageView.as_view(), name='send-media-message'),
+    path('<uuid:conversation_id>/messages/media/upload-url/', views.generate_media_upload_url, name='generate-media-upload-url'),
+    path('<uuid:conversation_id>/messages/media/upload/<str:token>/', views.upload_media_file, name='upload-media-file'),
+    path('<uuid:conversation_id>/messages/search/', views.search_messages, name='search-messages'),
     path('<uuid:conversation_id>/messages/mark-as-read/', views.mark_messages_as_read, name='mark-as-read'),
     path('<uuid:conversation_id>/messages/<uuid:message_id>/', views.delete_message, name='delete-message'),
     path('<uuid:conversation_id>/messages/<uuid:message_id>/read/', views.mark_single_message_as_read, name='mark-single-read'),
@@ -1,23 +1,30 @@
 """
 Views for messaging app.
 """
+import json
 import logging
-import uuid
+from urllib.parse import quote
 
 from django.contrib.auth import get_user_model
-from django.db.models import Q
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Prefetch, Q
+from django.http import StreamingHttpResponse
 from django.shortcuts import get_object_or_404
-from django.utils import timezone
+from django.urls import reverse
 from django.utils.translation import gettext_lazy as _
 from rest_framework import generics, permissions, status
 from rest_framework.decorators import api_view, permission_classes
+from rest_framework.pagination import CursorPagination
 from rest_framework.parsers import FormParser, MultiPartParser
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
+from authentication.presence_service import PresenceService
 from matching.models import Match
+from profiles.models import ProfilePhoto
 from subscriptions.utils import check_feature_availability, premium_required_response
 
+from .media_service import MAX_UPLOAD_BYTES, UPLOAD_URL_EXPIRES_SECONDS, MessageMediaService
 from .models import Call, Message
 from .serializers import (
     AnswerCallSerializer,
@@ -27,10 +34,13 @@ from .serializers import (
     IceCandidateSerializer,
     InitiateCallSerializer,
     MarkAsReadSerializer,
+    MessageSearchResultSerializer,
     MessageSerializer,
     SendMessageSerializer,
 )
 from .services import CallService, MessageService
+from .signaling_service import CallSignalingService
+from .sync_service import SyncService
 
 logger = logging.getLogger('hivmeet.messaging')
 User = get_user_model()
@@ -41,21 +51,35 @@ def _get_active_match_for_user(user, conversation_id):
         Q(user1=user) | Q(user2=user),
         id=conversation_id,
         status=Match.ACTIVE,
+    ).select_related(
+        'user1_last_read_message',
+        'user2_last_read_message',
     ).first()
 
 
+class ConversationCursorPagination(CursorPagination):
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    # Unique and never null, so every row is reachable from a cursor
+    ordering = ('-last_activity_at', '-id')
+
+
 class ConversationListView(generics.ListAPIView):
     """
-    Get list of conversations.
+    Get list of conversations, most recent first.
+    Runs a fixed number of queries whatever the number of conversations.
 
-    GET /api/v1/conversations/
+    GET /api/v1/conversations/?cursor=...
     """
 
     permission_classes = [permissions.IsAuthenticated]
     serializer_class = ConversationSerializer
+    pagination_class = ConversationCursorPagination
 
     def get_queryset(self):
         user = self.request.user
+        main_photos = ProfilePhoto.objects.filter(is_main=True)
 
         queryset = Match.objects.filter(
             Q(user1=user) | Q(user2=user),
@@ -65,13 +89,77 @@ class ConversationListView(generics.ListAPIView):
         ).select_related(
             'user1__profile',
             'user2__profile',
-        ).order_by('-last_message_at')
+            'last_message',
+            'user1_last_read_message',
+            'user2_last_read_message',
+        ).prefetch_related(
+            Prefetch('user1__profile__photos', queryset=main_photos, to_attr='main_photos'),
+            Prefetch('user2__profile__photos', queryset=main_photos, to_attr='main_photos'),
+        )
 
         status_filter = self.request.query_params.get('status')
         if status_filter == 'archived':
             return queryset.none()
         return queryset
 
+    def list(self, request, *args, **kwargs):
+        page = self.paginate_queryset(self.filter_queryset(self.get_queryset()))
+        # One bulk presence lookup for the page
+        context = self.get_serializer_context()
+        context['online_status'] = PresenceService.get_online_status(
+            match.user2_id if match.user1_id == request.user.id else match.user1_id
+            for match in page
+        )
+        serializer = self.get_serializer_class()(page, many=True, context=context)
+        return self.get_paginated_response(serializer.data)
+
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAuthenticated])
+def unread_count(request):
+    """
+    Total unread messages across conversations, for the app badge.
+
+    GET /api/v1/conversations/unread-count/
+    """
+    return Response({'total_unread_count': request.user.total_unread_count}, status=status.HTTP_200_OK)
+
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAuthenticated])
+def sync_conversations(request):
+    """
+    Changes across all the user's conversations since a change sequence,
+    oldest first, streamed as one JSON document. Without `since` (first sync)
+    or when it is too old or ahead of the log, full_resync is set: the client
+    must reload its conversations, then sync from next_since.
+
+    GET /api/v1/conversations/sync/?since=<next_since of the previous sync>
+    """
+    since = request.query_params.get('since')
+    if since is not None:
+        try:
+            since = int(since)
+        except ValueError:
+            since = -1
+        if since < 0:
+            return Response({'error': _('Invalid sync sequence.')}, status=status.HTTP_400_BAD_REQUEST)
+
+    if SyncService.needs_full_resync(since):
+        return Response(
+            {'full_resync': True, 'changes': [], 'next_since': SyncService.get_resync_point()},
+            status=status.HTTP_200_OK,
+        )
+
+    def stream():
+        cursor = {}
+        yield '{"full_resync": false, "changes": ['
+        for index, change in enumerate(SyncService.iter_changes(request.user, since, request=request, cursor=cursor)):
+            yield (',' if index else '') + json.dumps(change, cls=DjangoJSONEncoder)
+        yield f'], "next_since": {cursor["next_since"]}}}'
+
+    return StreamingHttpResponse(stream(), content_type='application/json')
+
 
 @api_view(['GET', 'POST'])
 @permission_classes([permissions.IsAuthenticated])
@@ -91,32 +179,31 @@ def conversation_messages(request, conversation_id):
         page = int(request.query_params.get('page', 1))
         page_size = int(request.query_params.get('page_size', 50))
         limit = int(request.query_params.get('limit', page_size))
+        cursor = request.query_params.get('cursor')
         before_message_id = request.query_params.get('before_message_id')
+        include_count = request.query_params.get('include_count', 'false').lower() == 'true'
 
-        messages = MessageService.get_conversation_messages(
+        messages, has_more = MessageService.get_conversation_page(
             user=request.user,
             match=match,
             limit=limit,
+            cursor=cursor,
             before_id=before_message_id,
         )
-
-        visible_query = Message.objects.filter(match=match).filter(
-            Q(sender=request.user, is_deleted_by_sender=False)
-            | Q(sender=match.get_other_user(request.user), is_deleted_by_recipient=False)
-        )
-        visible_count = visible_query.count()
-        has_more = visible_count > len(messages)
         show_premium_prompt = has_more and not request.user.is_premium
 
         next_link = None
-        if messages:
-            next_link = f"?before_message_id={messages[-1].id}&page_size={limit}"
+        if has_more and messages:
+            next_link = f"?cursor={MessageService.encode_cursor(messages[-1])}&page_size={limit}"
         previous_link = f"?page={page - 1}&page_size={limit}" if page > 1 else None
 
+        # Total is approximate and only computed on request
+        count = MessageService.get_approximate_message_count(request.user, match) if include_count else None
+
         serializer = MessageSerializer(messages, many=True, context={'request': request})
         return Response(
             {
-                'count': visible_count,
+                'count': count,
                 'next': next_link,
                 'previous': previous_link,
                 'results': serializer.data,
@@ -151,6 +238,52 @@ def conversation_messages(request, conversation_id):
     return Response(response_serializer.data, status=status.HTTP_201_CREATED)
 
 
+@api_view(['GET'])
+@permission_classes([permissions.IsAuthenticated])
+def search_messages(request, conversation_id):
+    """
+    Full-text search in a conversation, newest first.
+
+    GET /api/v1/conversations/{conversation_id}/messages/search/?q=...&cursor=...
+    """
+
+    match = _get_active_match_for_user(request.user, conversation_id)
+    if not match:
+        return Response({'error': _('Conversation not found.')}, status=status.HTTP_404_NOT_FOUND)
+
+    query = request.query_params.get('q', '').strip()
+    if not query:
+        return Response({'error': _('Search query is required.')}, status=status.HTTP_400_BAD_REQUEST)
+
+    try:
+        page_size = int(request.query_params.get('page_size', 20))
+    except (TypeError, ValueError):
+        return Response({'error': _('page_size must be an integer.')}, status=status.HTTP_400_BAD_REQUEST)
+    page_size = min(max(page_size, 1), 100)
+
+    messages, has_more = MessageService.search_messages(
+        user=request.user,
+        match=match,
+        query=query,
+        limit=page_size,
+        cursor=request.query_params.get('cursor'),
+    )
+
+    next_link = None
+    if has_more and messages:
+        next_link = f"?q={quote(query)}&cursor={MessageService.encode_cursor(messages[-1])}&page_size={page_size}"
+
+    serializer = MessageSearchResultSerializer(messages, many=True, context={'request': request})
+    return Response(
+        {
+            'next': next_link,
+            'results': serializer.data,
+            'has_more': has_more,
+        },
+        status=status.HTTP_200_OK,
+    )
+
+
 @api_view(['PUT'])
 @permission_classes([permissions.IsAuthenticated])
 def mark_messages_as_read(request, conversation_id):
@@ -193,6 +326,7 @@ def mark_single_message_as_read(request, conversation_id, message_id):
     message = Message.objects.filter(id=message_id, match=match).first()
     if not message:
         return Response({'error': _('Message not found.')}, status=status.HTTP_404_NOT_FOUND)
+    message.match = match
 
     if not MessageService.mark_single_message_as_read(request.user, message):
         return Response({'error': _('Cannot mark this message as read.')}, status=status.HTTP_403_FORBIDDEN)
@@ -248,7 +382,7 @@ def conversation_presence(request, conversation_id):
         return Response({'error': _('Conversation not found.')}, status=status.HTTP_404_NOT_FOUND)
 
     other_user = match.get_other_user(request.user)
-    is_online = (timezone.now() - other_user.last_active).total_seconds() < 300
+    is_online = PresenceService.is_online(other_user.id)
     is_typing = len(MessageService.get_typing_users(match, exclude_user=request.user)) > 0
 
     return Response(
@@ -266,27 +400,69 @@ def conversation_presence(request, conversation_id):
 
 @api_view(['POST'])
 @permission_classes([permissions.IsAuthenticated])
-def generate_media_upload_url(request):
+def generate_media_upload_url(request, conversation_id):
     """
-    POST /api/v1/conversations/generate-media-upload-url/
+    POST /api/v1/conversations/{conversation_id}/messages/media/upload-url/
+
+    Upload target of a media file: PUT the file to upload_url, then send a
+    message with file_path_on_storage as media_file_path_on_storage.
     """
+    feature_check = check_feature_availability(request.user, 'media_messaging')
+    if not feature_check['available']:
+        return premium_required_response()
+
+    match = _get_active_match_for_user(request.user, conversation_id)
+    if not match:
+        return Response({'error': _('Conversation not found.')}, status=status.HTTP_404_NOT_FOUND)
 
-    file_name = request.data.get('file_name') or 'upload.bin'
     content_type = request.data.get('content_type') or 'application/octet-stream'
-    file_path_on_storage = f"messages/{request.user.id}/{uuid.uuid4()}_{file_name}"
-    upload_url = f"https://storage.googleapis.com/hivmeet-media/{file_path_on_storage}"
+    target = MessageMediaService.get_upload_target(match, request.data.get('file_name'), content_type)
+    upload_url = target.get('url') or request.build_absolute_uri(
+        reverse('api:messaging:upload-media-file', kwargs={'conversation_id': match.id, 'token': target['token']})
+    )
 
     return Response(
         {
             'upload_url': upload_url,
-            'file_path_on_storage': file_path_on_storage,
+            'upload_method': 'PUT',
+            'file_path_on_storage': target['path'],
             'content_type': content_type,
-            'expires_in_seconds': 900,
+            'expires_in_seconds': UPLOAD_URL_EXPIRES_SECONDS,
         },
         status=status.HTTP_200_OK,
     )
 
 
+@api_view(['PUT'])
+@permission_classes([permissions.IsAuthenticated])
+def upload_media_file(request, conversation_id, token):
+    """
+    PUT /api/v1/conversations/{conversation_id}/messages/media/upload/{token}/
+
+    Upload target returned by generate_media_upload_url when the media
+    storage cannot sign uploads; the request body is the file.
+    """
+    match = _get_active_match_for_user(request.user, conversation_id)
+    if not match:
+        return Response({'error': _('Conversation not found.')}, status=status.HTTP_404_NOT_FOUND)
+
+    path = MessageMediaService.read_upload_token(token, match.id)
+    if not path:
+        return Response({'error': _('Invalid or expired upload URL.')}, status=status.HTTP_403_FORBIDDEN)
+
+    stream = request.stream
+    content = stream.read(MAX_UPLOAD_BYTES + 1) if stream is not None else b''
+    if not content:
+        return Response({'error': _('Media file is required')}, status=status.HTTP_400_BAD_REQUEST)
+    if len(content) > MAX_UPLOAD_BYTES:
+        return Response({'error': _('File size must be less than 10MB')}, status=status.HTTP_400_BAD_REQUEST)
+
+    if not MessageMediaService.save_at(path, content):
+        return Response({'error': _('This upload URL was already used.')}, status=status.HTTP_409_CONFLICT)
+
+    return Response({'file_path_on_storage': path}, status=status.HTTP_201_CREATED)
+
+
 @api_view(['POST'])
 @permission_classes([permissions.IsAuthenticated])
 def initiate_call(request):
@@ -317,6 +493,8 @@ def initiate_call(request):
         response_status = status.HTTP_403_FORBIDDEN if 'premium' in error_text else status.HTTP_400_BAD_REQUEST
         return Response({'error': error_msg}, status=response_status)
 
+    CallService.add_ice_candidates(call, serializer.validated_data.get('ice_candidates', []), request.user)
+
     return Response({'call_id': str(call.id), 'status': call.status, 'message': _('Call initiated. Waiting for response.')}, status=status.HTTP_201_CREATED)
 
 
@@ -338,25 +516,40 @@ def answer_call(request, call_id):
     if not CallService.answer_call(call=call, answer_sdp=serializer.validated_data['answer_sdp']):
         return Response({'error': _('Failed to answer call. Call may have ended.')}, status=status.HTTP_400_BAD_REQUEST)
 
-    return Response({'call_id': str(call.id), 'status': call.status, 'message': _('Call connected.')}, status=status.HTTP_200_OK)
+    CallService.add_ice_candidates(call, serializer.validated_data.get('ice_candidates', []), request.user)
 
+    # Caller candidates sent before the answer, saving a round trip
+    return Response(
+        {
+            'call_id': str(call.id),
+            'status': call.status,
+            'message': _('Call connected.'),
+            'ice_candidates': CallSignalingService.get_peer_candidates(call, request.user),
+        },
+        status=status.HTTP_200_OK,
+    )
 
-@api_view(['POST'])
+
+@api_view(['GET', 'POST'])
 @permission_classes([permissions.IsAuthenticated])
 def add_ice_candidate(request, call_id):
     """
-    POST /api/v1/calls/{call_id}/ice-candidate
+    GET  /api/v1/calls/{call_id}/ice-candidate  (candidates of the peer)
+    POST /api/v1/calls/{call_id}/ice-candidate  ({"candidate": {...}} or {"candidates": [...]})
     """
 
     call = Call.objects.filter(Q(caller=request.user) | Q(callee=request.user), id=call_id).first()
     if not call:
         return Response({'error': _('Call not found.')}, status=status.HTTP_404_NOT_FOUND)
 
+    if request.method == 'GET':
+        return Response({'candidates': CallSignalingService.get_peer_candidates(call, request.user)}, status=status.HTTP_200_OK)
+
     serializer = IceCandidateSerializer(data=request.data)
     if not serializer.is_valid():
         return Response({'error': _('Validation error'), 'details': serializer.errors}, status=status.HTTP_400_BAD_REQUEST)
 
-    if not CallService.add_ice_candidate(call=call, candidate=serializer.validated_data['candidate'], from_user=request.user):
+    if not CallService.add_ice_candidates(call=call, candidates=serializer.validated_data['candidates'], from_user=request.user):
         return Response({'error': _('Failed to add ICE candidate.')}, status=status.HTTP_400_BAD_REQUEST)
 
     return Response(status=status.HTTP_204_NO_CONTENT)
@@ -413,7 +606,7 @@ class SendMediaMessageView(APIView):
             return Response({'error': _('Media file is required')}, status=status.HTTP_400_BAD_REQUEST)
 
         media_file = request.FILES['media_file']
-        if media_file.size > 10 * 1024 * 1024:
+        if media_file.size > MAX_UPLOAD_BYTES:
             return Response({'error': _('File size must be less than 10MB')}, status=status.HTTP_400_BAD_REQUEST)
 
         media_type = request.data.get('media_type', Message.IMAGE)
@@ -466,5 +659,7 @@ class InitiatePremiumCallView(APIView):
         if not call:
             return Response({'error': error_msg or _('Cannot initiate call at this time')}, status=status.HTTP_400_BAD_REQUEST)
 
+        CallService.add_ice_candidates(call, serializer.validated_data.get('ice_candidates', []), request.user)
+
         call_serializer = CallSerializer(call, context={'request': request})
         return Response(call_serializer.data, status=status.HTTP_201_CREATED)
\ No newline at end of file
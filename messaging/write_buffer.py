@@ -0,0 +1,167 @@
+"""
+Write-behind buffer for messages sent over WebSocket.
+
+Consumers submit unsaved Message objects and await the result. Messages are
+inserted in batches of MESSAGE_WRITE_BUFFER_MAX_BATCH, or after
+MESSAGE_WRITE_BUFFER_MAX_DELAY_MS, in one transaction that also deduplicates
+client_message_ids (see MessageClientId) and updates each match once.
+bulk_create sends no post_save, so the side effects of the messaging
+signals (sync change, push notification, new_message user group event) are
+applied here too.
+Batches are written one at a time in submission order, and a submit only
+returns once its batch is committed, so callers broadcast durable messages
+in order.
+
+There is one buffer per event loop (i.e. per ASGI worker process).
+"""
+import asyncio
+import logging
+import weakref
+from typing import Dict, List, Tuple
+
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.db import transaction
+from django.utils.translation import gettext as _
+
+from matching.models import Match
+from .models import Message, MessageClientId, SyncChange
+from .signals import notify_new_message
+
+logger = logging.getLogger('hivmeet.messaging')
+
+_buffers = weakref.WeakKeyDictionary()
+
+
+def persist_messages(messages: List[Message]) -> List[Message]:
+    """
+    Insert a batch of messages and update their matches, in one transaction.
+    Returns the stored message for each input, in order: the existing one for
+    an already known (match, sender, client_message_id), else the input.
+    """
+    with transaction.atomic():
+        holders = MessageClientId.claim(messages)
+        pending = {str(message.id): message for message in messages}
+        existing = {}
+        held_ids = {str(message_id) for message_id in holders.values()} - set(pending)
+        if held_ids:
+            existing = {str(message.id): message for message in Message.objects.filter(id__in=held_ids)}
+
+        results = []
+        new_messages = []
+        for message in messages:
+            key = MessageClientId.key(message.match_id, message.sender_id, message.client_message_id)
+            holder_id = str(holders[key]) if message.client_message_id and key in holders else None
+            if holder_id and holder_id != str(message.id):
+                results.append(pending.get(holder_id) or existing.get(holder_id))
+                continue
+            new_messages.append(message)
+            results.append(message)
+
+        if new_messages:
+            Message.objects.bulk_create(new_messages)
+            # bulk_create sends no post_save, see signals.record_message_created
+            SyncChange.record(*(SyncChange.message_created(m) for m in new_messages))
+            matches = _record_on_matches(new_messages)
+            # ... nor signals.handle_new_message
+            transaction.on_commit(lambda: _notify_recipients(new_messages, matches))
+
+    return results
+
+
+def _record_on_matches(messages: List[Message]) -> Dict:
+    """One Match update per conversation of the batch; returns the matches by ID."""
+    by_match: Dict = {}
+    for message in messages:
+        by_match.setdefault(message.match_id, []).append(message)
+
+    matches = Match.objects.in_bulk(list(by_match))
+    for match_id, match_messages in by_match.items():
+        match = matches.get(match_id)
+        if match is None:
+            continue
+        unread = {}
+        for message in match_messages:
+            recipient_id = match.user2_id if message.sender_id == match.user1_id else match.user1_id
+            unread[recipient_id] = unread.get(recipient_id, 0) + 1
+        last = match_messages[-1]
+        match.record_message(last, last.content[:100] if last.content else _("[Media]"), unread=unread)
+    return matches
+
+
+def _notify_recipients(messages: List[Message], matches: Dict):
+    """Push and user group event for each committed message of a batch."""
+    for message in messages:
+        match = matches.get(message.match_id)
+        if match is None or message.message_type == Message.CALL_LOG:
+            continue
+        recipient_id = match.user2_id if message.sender_id == match.user1_id else match.user1_id
+        notify_new_message(message, recipient_id)
+
+
+class MessageWriteBuffer:
+    """
+    Batches message inserts for the consumers of one event loop.
+    """
+
+    def __init__(self, max_batch: int = None, max_delay: float = None):
+        self.max_batch = max_batch or getattr(settings, 'MESSAGE_WRITE_BUFFER_MAX_BATCH', 100)
+        if max_delay is None:
+            max_delay = getattr(settings, 'MESSAGE_WRITE_BUFFER_MAX_DELAY_MS', 5) / 1000
+        self.max_delay = max_delay
+        self._pending: List[Tuple[Message, asyncio.Future]] = []
+        self._timer = None
+        # Held while a batch is written, so batches commit in order
+        self._flush_lock = asyncio.Lock()
+
+    async def submit(self, message: Message) -> Message:
+        """Queue a message and wait until it is committed."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((message, future))
+
+        if len(self._pending) >= self.max_batch:
+            self._schedule_flush(loop)
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_delay, self._schedule_flush, loop)
+
+        return await future
+
+    def _schedule_flush(self, loop):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        loop.create_task(self.flush())
+
+    async def flush(self):
+        """Write everything pending so far, max_batch messages at a time."""
+        async with self._flush_lock:
+            while self._pending:
+                batch = self._pending[:self.max_batch]
+                self._pending = self._pending[self.max_batch:]
+                await self._write(batch)
+
+    async def _write(self, batch: List[Tuple[Message, asyncio.Future]]):
+        try:
+            stored = await database_sync_to_async(persist_messages, thread_sensitive=False)(
+                [message for message, future in batch]
+            )
+        except Exception as e:
+            logger.error(f"Error writing {len(batch)} buffered messages: {str(e)}")
+            for message, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for (message, future), stored_message in zip(batch, stored):
+            if not future.done():
+                future.set_result(stored_message)
+
+
+def get_write_buffer() -> MessageWriteBuffer:
+    """Buffer of the running event loop."""
+    loop = asyncio.get_running_loop()
+    buffer = _buffers.get(loop)
+    if buffer is None:
+        buffer = _buffers[loop] = MessageWriteBuffer()
+    return buffer
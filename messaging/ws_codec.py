@@ -0,0 +1,126 @@
+"""
+Wire formats of the messaging WebSocket protocol.
+
+Clients get JSON text frames by default. Clients offering BINARY_SUBPROTOCOL
+at connect get MessagePack binary frames, where top-level keys and frame
+types are replaced by the short codes below; nested values (message, call,
+offer, ...) are left as is.
+
+Group broadcasts carry their frame pre-encoded in both formats (see
+encode_frames), so subscribers forward bytes instead of encoding per socket.
+"""
+import json
+
+import msgpack
+
+BINARY_SUBPROTOCOL = 'hivmeet.msgpack.v1'
+
+# Codes are part of the protocol: never change or reuse one
+FIELD_CODES = {
+    'type': 't',
+    'conversation_id': 'c',
+    'message_id': 'm',
+    'client_message_id': 'cm',
+    'sender_id': 's',
+    'content': 'b',
+    'message_type': 'mt',
+    'sent_at': 'at',
+    'user_id': 'u',
+    'from_user_id': 'f',
+    'status': 'st',
+    'timestamp': 'ts',
+    'candidate': 'ic',
+    'sdpMid': 'im',
+    'sdpMLineIndex': 'il',
+    'call_id': 'ci',
+    'offer': 'o',
+    'answer': 'a',
+    'reader_id': 'r',
+    'last_read_message_id': 'lr',
+    'read_at': 'ra',
+    'message': 'msg',
+    'code': 'e',
+    'other_user_online': 'on',
+    'match_id': 'mi',
+    'matched_user_id': 'mu',
+    'like_id': 'li',
+    'is_super_like': 'sl',
+    'call': 'cl',
+    'media_url': 'md',
+    'media_thumbnail_url': 'th',
+    'media_status': 'ms',
+    'media_info': 'mx',
+    'candidates': 'ics',
+}
+
+TYPE_CODES = {
+    'message.send': 1,
+    'message.queued': 2,
+    'message.created': 3,
+    'message.new': 4,
+    'messages.read': 5,
+    'message.updated': 6,
+    'typing.start': 10,
+    'typing.stop': 11,
+    'typing.indicator': 12,
+    'presence.update': 20,
+    'ping': 21,
+    'pong': 22,
+    'ice.candidate': 30,
+    'offer': 31,
+    'answer': 32,
+    'webrtc.offer': 33,
+    'webrtc.answer': 34,
+    'ice.candidates': 35,
+    'subscribe': 40,
+    'unsubscribe': 41,
+    'subscribed': 42,
+    'unsubscribed': 43,
+    'match.new': 50,
+    'like.received': 51,
+    'call.incoming': 52,
+    'call.update': 53,
+    'error': 99,
+}
+
+_FIELD_NAMES = {code: name for name, code in FIELD_CODES.items()}
+_TYPE_NAMES = {code: name for name, code in TYPE_CODES.items()}
+
+
+class FrameError(ValueError):
+    """A binary frame that is not a valid MessagePack map."""
+
+
+def encode_json(payload: dict) -> str:
+    return json.dumps(payload)
+
+
+def encode_binary(payload: dict) -> bytes:
+    packed = {}
+    for key, value in payload.items():
+        if key == 'type':
+            value = TYPE_CODES.get(value, value)
+        packed[FIELD_CODES.get(key, key)] = value
+    return msgpack.packb(packed, use_bin_type=True)
+
+
+def decode_binary(data: bytes) -> dict:
+    try:
+        unpacked = msgpack.unpackb(data, raw=False)
+    except Exception as e:
+        raise FrameError(str(e)) from e
+    if not isinstance(unpacked, dict):
+        raise FrameError('Frame is not a map')
+
+    frame = {}
+    for key, value in unpacked.items():
+        name = _FIELD_NAMES.get(key, key)
+        if name == 'type':
+            value = _TYPE_NAMES.get(value, value)
+        frame[name] = value
+    return frame
+
+
+def encode_frames(payload: dict) -> dict:
+    """A frame in both wire formats, for group broadcasts."""
+    return {'json': encode_json(payload), 'binary': encode_binary(payload)}
@@ -0,0 +1,160 @@
+"""
+Compatibility bucketing for discovery.
+
+Each profile stores a compact signature of its own gender, the genders it
+seeks and a birth-year band, e.g. ``f:m:1990`` or ``m:*:1985``. Discovery
+first computes which existing buckets can be mutually compatible with the
+seeker and then filters on the indexed ``compatibility_bucket`` column,
+instead of evaluating the gender predicates row by row.
+
+The band is based on birth year (not age) so that stored buckets do not go
+stale as users get older.
+"""
+import logging
+from typing import Iterable, List, Optional, Set, Tuple
+
+from django.core.cache import cache
+from django.utils import timezone
+
+logger = logging.getLogger('hivmeet.profiles')
+
+# One letter per gender (see Profile.GENDER_CHOICES)
+GENDER_CODES = {
+    'male': 'm',
+    'female': 'f',
+    'non_binary': 'n',
+    'trans_male': 'a',
+    'trans_female': 'b',
+    'other': 'o',
+    'prefer_not_to_say': 'x',
+}
+CODE_GENDERS = {code: gender for gender, code in GENDER_CODES.items()}
+
+ANY_GENDER = '*'
+UNKNOWN_BAND = '-'
+BIRTH_YEAR_BAND = 5
+
+BUCKETS_CACHE_KEY = 'compatibility_buckets'
+BUCKETS_CACHE_TTL = 600  # 10 minutes
+
+
+def compute_bucket(gender: str, genders_sought: Optional[Iterable[str]], birth_date) -> str:
+    """Build the compatibility signature for a profile."""
+    own = GENDER_CODES.get(gender, GENDER_CODES['prefer_not_to_say'])
+    sought_codes = sorted({GENDER_CODES[g] for g in (genders_sought or []) if g in GENDER_CODES})
+    sought = ''.join(sought_codes) if sought_codes else ANY_GENDER
+    if birth_date:
+        band = str(birth_date.year - birth_date.year % BIRTH_YEAR_BAND)
+    else:
+        band = UNKNOWN_BAND
+    return f'{own}:{sought}:{band}'
+
+
+def parse_bucket(bucket: str) -> Optional[Tuple[str, Optional[Set[str]], Optional[int]]]:
+    """
+    Decode a signature into (gender, sought genders or None for "all",
+    first birth year of the band or None if unknown).
+    """
+    try:
+        own, sought, band = bucket.split(':')
+    except (AttributeError, ValueError):
+        return None
+    gender = CODE_GENDERS.get(own)
+    if gender is None:
+        return None
+    sought_genders = None if sought == ANY_GENDER else {CODE_GENDERS.get(c) for c in sought}
+    band_start = None if band == UNKNOWN_BAND else int(band)
+    return gender, sought_genders, band_start
+
+
+class CompatibilityBucketService:
+    """
+    Service for computing and querying compatibility buckets.
+    """
+
+    @staticmethod
+    def get_existing_buckets() -> Set[str]:
+        """Get every bucket value currently in use (cached)."""
+        buckets = cache.get(BUCKETS_CACHE_KEY)
+        if buckets is None:
+            from .models import Profile
+            buckets = set(
+                Profile.objects.exclude(compatibility_bucket='')
+                .values_list('compatibility_bucket', flat=True)
+                .distinct()
+            )
+            cache.set(BUCKETS_CACHE_KEY, buckets, BUCKETS_CACHE_TTL)
+        return buckets
+
+    @staticmethod
+    def note_bucket(bucket: str):
+        """Make sure a newly used bucket is visible to discovery right away."""
+        buckets = cache.get(BUCKETS_CACHE_KEY)
+        if buckets is not None and bucket not in buckets:
+            cache.delete(BUCKETS_CACHE_KEY)
+
+    @staticmethod
+    def is_compatible(bucket: str, seeker_gender: str, seeker_sought: Iterable[str],
+                      age_min: int, age_max: int) -> bool:
+        """Check whether profiles in `bucket` can be mutually compatible with the seeker."""
+        parsed = parse_bucket(bucket)
+        if parsed is None:
+            return False
+        gender, sought_genders, band_start = parsed
+
+        # Seeker wants this gender ([] means all)
+        seeker_sought = list(seeker_sought or [])
+        if seeker_sought and gender not in seeker_sought:
+            return False
+
+        # Target wants the seeker's gender (not enforced for prefer_not_to_say)
+        if (
+            seeker_gender and seeker_gender != 'prefer_not_to_say'
+            and sought_genders is not None and seeker_gender not in sought_genders
+        ):
+            return False
+
+        # Band overlaps the seeker's age range (same year-based age as discovery)
+        if band_start is None:
+            return False
+        current_year = timezone.now().year
+        oldest = current_year - band_start
+        youngest = current_year - (band_start + BIRTH_YEAR_BAND - 1)
+        return youngest <= age_max and oldest >= age_min
+
+    @staticmethod
+    def get_compatible_buckets(profile) -> List[str]:
+        """Get the existing buckets a profile's discovery query needs to hit."""
+        return [
+            bucket for bucket in CompatibilityBucketService.get_existing_buckets()
+            if CompatibilityBucketService.is_compatible(
+                bucket,
+                profile.gender,
+                profile.genders_sought,
+                profile.age_min_preference,
+                profile.age_max_preference,
+            )
+        ]
+
+    @staticmethod
+    def rebuild(queryset=None) -> int:
+        """
+        Recompute stored buckets, e.g. after bulk updates that bypass save().
+        Returns the number of profiles updated.
+        """
+        from .models import Profile
+        if queryset is None:
+            queryset = Profile.objects.all()
+
+        changed = []
+        for profile in queryset.select_related('user').iterator():
+            bucket = compute_bucket(profile.gender, profile.genders_sought, profile.user.birth_date)
+            if bucket != profile.compatibility_bucket:
+                profile.compatibility_bucket = bucket
+                changed.append(profile)
+
+        if changed:
+            Profile.objects.bulk_update(changed, ['compatibility_bucket'], batch_size=500)
+            cache.delete(BUCKETS_CACHE_KEY)
+            logger.info(f"Rebuilt compatibility buckets for {len(changed)} profiles")
+        return len(changed)
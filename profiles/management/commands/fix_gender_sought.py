@@ -4,6 +4,7 @@ This is a production-safe, idempotent operation.
 """
 from django.core.management.base import BaseCommand, CommandError
 from django.db.models import Q
+from profiles.compatibility_service import CompatibilityBucketService
 from profiles.models import Profile
 
 
@@ -136,6 +137,10 @@ class Command(BaseCommand):
                     total_updated += count
                     self.stdout.write(f'      [DRY-RUN] Would update {count} profiles')
             
+            # queryset.update() bypasses Profile.save(), refresh discovery buckets
+            if not dry_run and total_updated:
+                CompatibilityBucketService.rebuild()
+            
             # Summary
             self.stdout.write(f'\n' + '=' * 80)
             if dry_run:
@@ -0,0 +1,45 @@
+"""
+Add the indexed compatibility_bucket column used to shard discovery
+candidate pools, and backfill it for existing profiles.
+"""
+from django.db import migrations, models
+
+
+def backfill_compatibility_bucket(apps, schema_editor):
+    """Compute the bucket for every existing profile."""
+    from profiles.compatibility_service import compute_bucket
+
+    Profile = apps.get_model('profiles', 'Profile')
+    changed = []
+    for profile in Profile.objects.select_related('user').iterator():
+        profile.compatibility_bucket = compute_bucket(
+            profile.gender, profile.genders_sought, profile.user.birth_date
+        )
+        changed.append(profile)
+    Profile.objects.bulk_update(changed, ['compatibility_bucket'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('profiles', '0004_alter_profile_genders_sought'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='profile',
+            name='compatibility_bucket',
+            field=models.CharField(
+                blank=True,
+                db_index=True,
+                default='',
+                editable=False,
+                max_length=16,
+                verbose_name='Compatibility bucket',
+            ),
+        ),
+        migrations.RunPython(
+            code=backfill_compatibility_bucket,
+            reverse_code=migrations.RunPython.noop,
+        ),
+    ]
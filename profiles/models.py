@@ -150,6 +150,16 @@ class Profile(models.Model):
         help_text=_('List of genders this profile is interested in. Empty list means open to all genders.')
     )
     
+    # Discovery bucket: own gender, sought genders and birth-year band
+    compatibility_bucket = models.CharField(
+        max_length=16,
+        blank=True,
+        default='',
+        editable=False,
+        db_index=True,
+        verbose_name=_('Compatibility bucket')
+    )
+    
     # Additional search filters
     verified_only = models.BooleanField(
         default=False,
@@ -228,7 +238,23 @@ class Profile(models.Model):
     def save(self, *args, **kwargs):
         """Save the profile with validation."""
         self.clean()
+        
+        # Keep the discovery bucket in sync with gender preferences
+        from .compatibility_service import CompatibilityBucketService, compute_bucket
+        update_fields = kwargs.get('update_fields')
+        bucket_changed = False
+        if update_fields is None or {'gender', 'genders_sought'} & set(update_fields):
+            bucket = compute_bucket(self.gender, self.genders_sought, self.user.birth_date)
+            if bucket != self.compatibility_bucket:
+                self.compatibility_bucket = bucket
+                bucket_changed = True
+                if update_fields is not None:
+                    kwargs['update_fields'] = set(update_fields) | {'compatibility_bucket'}
+        
         super().save(*args, **kwargs)
+        
+        if bucket_changed:
+            CompatibilityBucketService.note_bucket(self.compatibility_bucket)
     
     def get_location_display(self):
         """Get displayable location based on privacy settings."""
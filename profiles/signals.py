@@ -34,6 +34,25 @@ def create_user_profile(sender, instance, created, **kwargs):
             logger.error(f"Error creating profile for user {instance.email}: {str(e)}")
 
 
+@receiver(post_save, sender=User)
+def refresh_compatibility_bucket(sender, instance, created, update_fields=None, **kwargs):
+    """
+    Keep the profile's discovery bucket in sync when the birth date changes.
+    Users loaded from the database are compared with their loaded birth date,
+    so other saves do not rebuild the bucket.
+    """
+    if created:
+        instance._loaded_birth_date = instance.birth_date
+        return
+    if update_fields is not None and 'birth_date' not in update_fields:
+        return
+    if getattr(instance, '_loaded_birth_date', None) == instance.birth_date:
+        return
+    from .compatibility_service import CompatibilityBucketService
+    CompatibilityBucketService.rebuild(Profile.objects.filter(user=instance))
+    instance._loaded_birth_date = instance.birth_date
+
+
 @receiver(pre_delete, sender=User)
 def cleanup_user_firebase(sender, instance, **kwargs):
     """
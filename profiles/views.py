@@ -14,6 +14,7 @@ from django.utils import timezone
 from datetime import timedelta
 import logging
 
+from authentication.block_service import BlockService
 from .models import Profile, ProfilePhoto, Verification
 from .serializers import (
     ProfileSerializer,
@@ -85,12 +86,8 @@ class UserProfileView(generics.RetrieveAPIView):
         filter_kwargs = {self.lookup_field: self.kwargs[self.lookup_url_kwarg]}
         profile = get_object_or_404(queryset, **filter_kwargs)
         
-        # Check if user is blocked
-        if self.request.user in profile.user.blocked_users.all():
-            raise PermissionDenied(_("You cannot view this profile."))
-        
-        # Check if current user is blocked by this user
-        if profile.user in self.request.user.blocked_users.all():
+        # Check if either user has blocked the other
+        if BlockService.is_blocked_between(self.request.user.id, profile.user_id):
             raise PermissionDenied(_("You cannot view this profile."))
         
         # Increment view count
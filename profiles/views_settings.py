@@ -9,6 +9,7 @@ from django.utils.translation import gettext_lazy as _
 from django.db import transaction
 import logging
 
+from authentication.block_service import BlockService
 from authentication.serializers import UserSerializer
 
 logger = logging.getLogger('hivmeet.profiles')
@@ -172,7 +173,7 @@ def block_unblock_user_view(request, user_id):
                     'message': _('Block limit reached (100 users).')
                 }, status=status.HTTP_429_TOO_MANY_REQUESTS)
             
-            request.user.blocked_users.add(target_user)
+            BlockService.block(request.user, target_user)
             logger.info(f"User {request.user.email} blocked {target_user.email}")
             
             return Response({
@@ -188,7 +189,7 @@ def block_unblock_user_view(request, user_id):
                     'message': _('User not in blocked list.')
                 }, status=status.HTTP_404_NOT_FOUND)
             
-            request.user.blocked_users.remove(target_user)
+            BlockService.unblock(request.user, target_user)
             logger.info(f"User {request.user.email} unblocked {target_user.email}")
             
             return Response(status=status.HTTP_204_NO_CONTENT)
@@ -0,0 +1,78 @@
+"""
+Primary/replica routing tests.
+File: tests/test_db_router.py
+"""
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, override_settings
+from rest_framework_simplejwt.tokens import AccessToken
+
+from authentication.models import User
+from hivmeet_backend.db_router import (
+    PIN_COOKIE_NAME,
+    PrimaryReplicaRouter,
+    ReplicaPinningMiddleware,
+    is_pinned_to_primary,
+)
+
+
+@override_settings(DATABASE_REPLICAS=['replica'], DATABASE_PRIMARY_PIN_SECONDS=30)
+class PrimaryReplicaRouterTests(SimpleTestCase):
+    """Routing decisions only, no second database needed."""
+
+    def setUp(self):
+        cache.clear()
+        self.router = PrimaryReplicaRouter()
+        self.factory = RequestFactory()
+        self.user = User(id='11111111-1111-1111-1111-111111111111', email='router@example.com')
+
+    def _run(self, request, view):
+        routed = []
+
+        def get_response(req):
+            view(routed)
+            return HttpResponse()
+
+        response = ReplicaPinningMiddleware(get_response)(request)
+        return routed, response
+
+    def _auth_request(self):
+        token = AccessToken.for_user(self.user)
+        return self.factory.get('/', HTTP_AUTHORIZATION=f'Bearer {token}')
+
+    def test_reads_outside_requests_use_primary(self):
+        self.assertEqual(self.router.db_for_read(User), 'default')
+
+    def test_request_reads_use_replica_until_a_write(self):
+        def view(routed):
+            routed.append(self.router.db_for_read(User))
+            routed.append(self.router.db_for_write(User))
+            routed.append(self.router.db_for_read(User))
+
+        routed, response = self._run(self._auth_request(), view)
+
+        self.assertEqual(routed, ['replica', 'default', 'default'])
+        self.assertIn(PIN_COOKIE_NAME, response.cookies)
+        self.assertTrue(is_pinned_to_primary(str(self.user.id)))
+
+    def test_user_stays_on_primary_after_writing(self):
+        self._run(self._auth_request(), lambda routed: self.router.db_for_write(User))
+
+        routed, _ = self._run(self._auth_request(), lambda routed: routed.append(self.router.db_for_read(User)))
+        self.assertEqual(routed, ['default'])
+
+        # Other users still read from the replica
+        routed, _ = self._run(self.factory.get('/'), lambda routed: routed.append(self.router.db_for_read(User)))
+        self.assertEqual(routed, ['replica'])
+
+    def test_pin_cookie_keeps_anonymous_client_on_primary(self):
+        _, response = self._run(self.factory.post('/'), lambda routed: self.router.db_for_write(User))
+
+        request = self.factory.get('/')
+        request.COOKIES[PIN_COOKIE_NAME] = response.cookies[PIN_COOKIE_NAME].value
+        routed, _ = self._run(request, lambda routed: routed.append(self.router.db_for_read(User)))
+        self.assertEqual(routed, ['default'])
+
+    def test_replicas_are_never_migrated(self):
+        self.assertFalse(self.router.allow_migrate('replica', 'authentication'))
+        self.assertIsNone(self.router.allow_migrate('default', 'authentication'))
@@ -1,19 +1,42 @@
 """
 WebSocket integration tests for real-time messaging.
+
+WebSocketLoadTests also runs a load scenario and builds a JSON report
+(throughput, delivery latency, DB queries per message). It is sized with
+environment variables, to benchmark beyond the small default run:
+
+- WS_LOAD_CONVERSATIONS: concurrent conversations (two users each)
+- WS_LOAD_MESSAGES: messages sent in each conversation
+- WS_LOAD_REDIS_URL: use channels_redis on this server instead of the
+  in-memory channel layer
+- WS_LOAD_REPORT: file the JSON report is written to, or '-' to print it
 """
 
+import asyncio
+import itertools
+import json
+import os
+import time
 import uuid
+from unittest import mock
 
+import msgpack
 from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
 from channels.testing import WebsocketCommunicator
+from django.db.backends.utils import CursorWrapper
 from django.test import TransactionTestCase, override_settings
 from django.utils import timezone
-from rest_framework_simplejwt.tokens import RefreshToken
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken, RefreshToken
 
 from authentication.models import User
+from authentication.presence_service import PresenceService
+from authentication.ws_identity_service import WebSocketIdentityService
 from hivmeet_backend.asgi import application
 from matching.models import Match
 from messaging.models import Message
+from messaging.ws_codec import BINARY_SUBPROTOCOL, decode_binary, encode_binary
 
 
 @override_settings(
@@ -29,6 +52,7 @@ class WebSocketMessagingTests(TransactionTestCase):
     reset_sequences = True
 
     def setUp(self):
+        PresenceService.clear()
         self.user1 = User.objects.create_user(
             email="ws_user1@example.com",
             password="testpass123",
@@ -116,6 +140,38 @@ class WebSocketMessagingTests(TransactionTestCase):
 
         async_to_sync(scenario)()
 
+    def test_reconnects_use_cached_identity_until_revoked(self):
+        token1 = self._access_token(self.user1)
+        token2 = self._access_token(self.user2)
+
+        async def connect(token):
+            communicator = WebsocketCommunicator(
+                application,
+                f"/ws/conversations/{self.match.id}/",
+                headers=[(b"authorization", f"Bearer {token}".encode())],
+            )
+            connected, code = await communicator.connect()
+            if connected:
+                await communicator.disconnect()
+            return connected, code
+
+        self.assertEqual(async_to_sync(connect)(token1), (True, None))
+        identity = WebSocketIdentityService.get_cached(AccessToken(token1))
+        self.assertEqual(identity["user"].id, self.user1.id)
+        self.assertEqual(identity["conversations"], {str(self.match.id): self.user2.id})
+
+        # Logout refuses the access token
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f"Bearer {token2}")
+        self.assertEqual(client.post("/api/v1/auth/logout").status_code, 204)
+        self.assertEqual(async_to_sync(connect)(token2), (False, 4000))
+
+        # Unmatching drops the cached conversation
+        self.match.status = Match.DELETED
+        self.match.save()
+        self.assertIsNone(WebSocketIdentityService.get_cached(AccessToken(token1)))
+        self.assertEqual(async_to_sync(connect)(token1), (False, 4001))
+
     def test_typing_events_are_broadcast_to_other_participant(self):
         async def scenario():
             token1 = self._access_token(self.user1)
@@ -163,6 +219,72 @@ class WebSocketMessagingTests(TransactionTestCase):
 
         async_to_sync(scenario)()
 
+    def test_ice_candidates_are_relayed_in_batches(self):
+        async def scenario():
+            call_id = str(uuid.uuid4())
+            comm1 = WebsocketCommunicator(
+                application,
+                f"/ws/conversations/{self.match.id}/",
+                headers=[(b"authorization", f"Bearer {self._access_token(self.user1)}".encode())],
+            )
+            comm2 = WebsocketCommunicator(
+                application,
+                f"/ws/conversations/{self.match.id}/?ice_batches=1",
+                headers=[(b"authorization", f"Bearer {self._access_token(self.user2)}".encode())],
+            )
+            # A client predating batches, on another device of the peer
+            legacy = WebsocketCommunicator(
+                application,
+                f"/ws/conversations/{self.match.id}/",
+                headers=[(b"authorization", f"Bearer {self._access_token(self.user2)}".encode())],
+            )
+            for comm in (comm1, comm2, legacy):
+                self.assertTrue((await comm.connect())[0])
+
+            async def receive_ice(communicator):
+                event = await communicator.receive_json_from(timeout=1)
+                while event["type"] == "presence.update":
+                    event = await communicator.receive_json_from(timeout=1)
+                return event
+
+            # Trickled one by one, plus a client-side batch
+            for index in range(3):
+                await comm1.send_json_to({
+                    "type": "ice.candidate",
+                    "call_id": call_id,
+                    "candidate": f"candidate:{index}",
+                    "sdpMid": "0",
+                    "sdpMLineIndex": 0,
+                })
+            await comm1.send_json_to({
+                "type": "ice.candidates",
+                "call_id": call_id,
+                "candidates": [{"candidate": "candidate:3", "sdpMid": "0", "sdpMLineIndex": 0}],
+            })
+
+            expected = ["candidate:0", "candidate:1", "candidate:2", "candidate:3"]
+            event = await receive_ice(comm2)
+            self.assertEqual(event["type"], "ice.candidates")
+            self.assertEqual(event["from_user_id"], str(self.user1.id))
+            self.assertEqual(event["call_id"], call_id)
+            self.assertEqual([candidate["candidate"] for candidate in event["candidates"]], expected)
+            self.assertTrue(await comm2.receive_nothing(timeout=0.2))
+
+            frames = [await receive_ice(legacy) for _ in expected]
+            self.assertEqual({frame["type"] for frame in frames}, {"ice.candidate"})
+            self.assertEqual({frame["call_id"] for frame in frames}, {call_id})
+            self.assertEqual([frame["candidate"] for frame in frames], expected)
+            self.assertEqual(frames[0]["sdpMid"], "0")
+            self.assertTrue(await legacy.receive_nothing(timeout=0.2))
+
+            for comm in (comm1, comm2, legacy):
+                try:
+                    await comm.disconnect()
+                except BaseException:
+                    pass
+
+        async_to_sync(scenario)()
+
     def test_message_send_broadcasts_and_persists(self):
         async def scenario():
             token1 = self._access_token(self.user1)
@@ -237,3 +359,370 @@ class WebSocketMessagingTests(TransactionTestCase):
             content="Hello WebSocket",
         )
         self.assertEqual(messages.count(), 1)
+
+    def test_user_socket_multiplexes_conversations_and_user_events(self):
+        other_match = Match.objects.create(user1=self.user3, user2=self.user1, status=Match.ACTIVE)
+
+        async def scenario():
+            token1 = self._access_token(self.user1)
+            token2 = self._access_token(self.user2)
+
+            comm1 = WebsocketCommunicator(
+                application,
+                "/ws/",
+                headers=[(b"authorization", f"Bearer {token1}".encode())],
+            )
+            comm2 = WebsocketCommunicator(application, f"/ws/?token={token2}")
+            connected1, _ = await comm1.connect()
+            connected2, _ = await comm2.connect()
+            self.assertTrue(connected1)
+            self.assertTrue(connected2)
+            self.assertEqual((await comm1.receive_json_from(timeout=1))["type"], "presence.update")
+
+            # user1 follows two conversations on one socket
+            for conversation_id in (self.match.id, other_match.id):
+                await comm1.send_json_to({"type": "subscribe", "conversation_id": str(conversation_id)})
+                event = await comm1.receive_json_from(timeout=1)
+                self.assertEqual(event["type"], "subscribed")
+                self.assertEqual(event["conversation_id"], str(conversation_id))
+
+            await comm2.send_json_to({"type": "subscribe", "conversation_id": str(other_match.id)})
+            event = await comm2.receive_json_from(timeout=1)
+            self.assertEqual(event["code"], "CONVERSATION_NOT_FOUND")
+
+            await comm2.send_json_to({"type": "typing.start", "conversation_id": str(self.match.id)})
+            event = await comm2.receive_json_from(timeout=1)
+            self.assertEqual(event["code"], "NOT_SUBSCRIBED")
+
+            await comm2.send_json_to({"type": "subscribe", "conversation_id": str(self.match.id)})
+            self.assertEqual((await comm2.receive_json_from(timeout=1))["type"], "subscribed")
+            await comm2.send_json_to({"type": "typing.start", "conversation_id": str(self.match.id)})
+
+            event = await comm1.receive_json_from(timeout=1)
+            while event["type"] == "presence.update":
+                event = await comm1.receive_json_from(timeout=1)
+            self.assertEqual(event["type"], "typing.indicator")
+            self.assertEqual(event["conversation_id"], str(self.match.id))
+            self.assertEqual(event["user_id"], str(self.user2.id))
+
+            # Events sent to the user group reach the socket
+            await comm1.send_json_to({"type": "unsubscribe", "conversation_id": str(other_match.id)})
+            self.assertEqual((await comm1.receive_json_from(timeout=1))["type"], "unsubscribed")
+            await get_channel_layer().group_send(
+                f"user_{self.user1.id}",
+                {"type": "new_match", "match_id": str(other_match.id), "matched_user_id": str(self.user3.id)},
+            )
+            event = await comm1.receive_json_from(timeout=1)
+            self.assertEqual(event["type"], "match.new")
+            self.assertEqual(event["match_id"], str(other_match.id))
+
+            await comm1.disconnect()
+            await comm2.disconnect()
+
+        async_to_sync(scenario)()
+
+    @mock.patch("messaging.signals.NotificationDispatcher.enqueue")
+    def test_buffered_message_reaches_unsubscribed_user_socket(self, enqueue):
+        async def scenario():
+            comm1 = WebsocketCommunicator(
+                application, f"/ws/conversations/{self.match.id}/?token={self._access_token(self.user1)}"
+            )
+            comm2 = WebsocketCommunicator(application, f"/ws/?token={self._access_token(self.user2)}")
+            self.assertTrue((await comm2.connect())[0])
+            self.assertTrue((await comm1.connect())[0])
+
+            await comm1.send_json_to({"type": "message.send", "content": "Tu es là ?", "client_message_id": "buf-1"})
+
+            event = await comm2.receive_json_from(timeout=5)
+            while event["type"] == "presence.update":
+                event = await comm2.receive_json_from(timeout=5)
+            self.assertEqual(event["type"], "message.new")
+            self.assertEqual(event["conversation_id"], str(self.match.id))
+            self.assertEqual(event["message"]["content"], "Tu es là ?")
+            self.assertEqual(event["message"]["client_message_id"], "buf-1")
+            self.assertEqual(event["message"]["sender_id"], str(self.user1.id))
+
+            await comm1.disconnect()
+            await comm2.disconnect()
+
+        async_to_sync(scenario)()
+        enqueue.assert_called_once()
+        self.assertEqual(enqueue.call_args.args[0], self.user2.id)
+        self.assertEqual(enqueue.call_args.kwargs["actor_id"], self.user1.id)
+        self.assertEqual(enqueue.call_args.kwargs["data"]["conversation_id"], str(self.match.id))
+
+    def test_binary_subprotocol_interoperates_with_json_clients(self):
+        async def scenario():
+            url = f"/ws/conversations/{self.match.id}/"
+            comm1 = WebsocketCommunicator(
+                application, f"{url}?token={self._access_token(self.user1)}", subprotocols=[BINARY_SUBPROTOCOL],
+            )
+            comm2 = WebsocketCommunicator(application, f"{url}?token={self._access_token(self.user2)}")
+            connected1, subprotocol = await comm1.connect()
+            self.assertTrue(connected1)
+            self.assertEqual(subprotocol, BINARY_SUBPROTOCOL)
+            self.assertTrue((await comm2.connect())[0])
+
+            async def receive_binary(frame_type):
+                while True:
+                    raw = await comm1.receive_from(timeout=2)
+                    self.assertIsInstance(raw, bytes)
+                    frame = decode_binary(raw)
+                    if frame["type"] == frame_type:
+                        return raw, frame
+
+            await comm1.send_to(bytes_data=encode_binary({"type": "typing.start"}))
+            event = await comm2.receive_json_from(timeout=1)
+            if event["type"] == "presence.update":
+                event = await comm2.receive_json_from(timeout=1)
+            self.assertEqual(event["type"], "typing.indicator")
+            self.assertEqual(event["user_id"], str(self.user1.id))
+
+            await comm2.send_json_to({"type": "message.send", "content": "Salut", "client_message_id": "bin-1"})
+            raw, frame = await receive_binary("message.created")
+            self.assertEqual(frame["content"], "Salut")
+            self.assertEqual(frame["sender_id"], str(self.user2.id))
+            # Short codes on the wire
+            self.assertEqual(msgpack.unpackb(raw)["t"], 3)
+
+            await comm1.send_to(bytes_data=b"\xc1")
+            _, error = await receive_binary("error")
+            self.assertEqual(error["code"], "INVALID_FRAME")
+
+            await comm1.disconnect()
+            await comm2.disconnect()
+
+        async_to_sync(scenario)()
+
+    def test_presence_changes_are_sent_to_matches_only(self):
+        async def scenario():
+            comm2 = WebsocketCommunicator(application, f"/ws/?token={self._access_token(self.user2)}")
+            comm3 = WebsocketCommunicator(application, f"/ws/?token={self._access_token(self.user3)}")
+            self.assertTrue((await comm2.connect())[0])
+            self.assertTrue((await comm3.connect())[0])
+
+            comm1 = WebsocketCommunicator(application, f"/ws/?token={self._access_token(self.user1)}")
+            self.assertTrue((await comm1.connect())[0])
+            event = await comm2.receive_json_from(timeout=1)
+            self.assertEqual(event["type"], "presence.update")
+            self.assertEqual(event["status"], "online")
+            self.assertEqual(event["user_id"], str(self.user1.id))
+            self.assertEqual(event["conversation_id"], str(self.match.id))
+
+            # A second device does not change presence, heartbeats keep it alive
+            comm1b = WebsocketCommunicator(application, f"/ws/?token={self._access_token(self.user1)}")
+            self.assertTrue((await comm1b.connect())[0])
+            await comm1b.send_json_to({"type": "ping"})
+            self.assertEqual((await comm1b.receive_json_from(timeout=1))["type"], "pong")
+            await comm1.disconnect()
+            self.assertTrue(await comm2.receive_nothing(timeout=0.2))
+
+            await comm1b.disconnect()
+            event = await comm2.receive_json_from(timeout=1)
+            self.assertEqual(event["status"], "offline")
+            self.assertTrue(await comm3.receive_nothing(timeout=0.2))
+
+            await comm2.disconnect()
+            await comm3.disconnect()
+
+        async_to_sync(scenario)()
+        self.assertFalse(PresenceService.is_online(self.user1.id))
+
+
+class QueryCounter:
+    """
+    Counts the SQL statements run in any thread while active (consumers run
+    queries in executor threads, out of reach of CaptureQueriesContext).
+    """
+
+    def __init__(self):
+        self._counter = itertools.count()
+        self.count = 0
+
+    def _wrap(self, method):
+        counter = self._counter
+
+        def wrapper(cursor, *args, **kwargs):
+            next(counter)
+            return method(cursor, *args, **kwargs)
+
+        return wrapper
+
+    def __enter__(self):
+        self._patches = [
+            mock.patch.object(CursorWrapper, name, self._wrap(getattr(CursorWrapper, name)))
+            for name in ("execute", "executemany")
+        ]
+        for patch in self._patches:
+            patch.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        for patch in self._patches:
+            patch.stop()
+        self.count = next(self._counter)
+
+
+def _percentile(values, percent):
+    """Nearest-rank percentile of a non-empty list."""
+    ordered = sorted(values)
+    rank = max(int(round(percent / 100 * len(ordered) + 0.5)) - 1, 0)
+    return ordered[min(rank, len(ordered) - 1)]
+
+
+class ConversationLoadHarness:
+    """
+    Drives conversations between simulated users over WebsocketCommunicator.
+
+    Each conversation connects both participants and sends `messages`
+    messages, alternating senders, each preceded by KEYSTROKES typing.start
+    frames and a typing.stop, with a heartbeat every HEARTBEAT_EVERY messages. A message is sent
+    once the previous one was delivered to the peer, like a chat, while all
+    conversations run concurrently.
+    """
+
+    KEYSTROKES = 3
+    HEARTBEAT_EVERY = 5
+    DELIVERY_TIMEOUT = 10
+
+    def __init__(self, matches, tokens, messages):
+        self.matches = matches
+        self.tokens = tokens
+        self.messages = messages
+        self.sent_at = {}
+        self.delivered = {}
+        self.latencies = []
+        self.frames = {}
+
+    async def _read(self, communicator, user_id):
+        """Collect the frames of a socket, timing deliveries to the peer."""
+        while True:
+            frame = await communicator.receive_json_from(timeout=3600)
+            self.frames[frame["type"]] = self.frames.get(frame["type"], 0) + 1
+            if frame["type"] == "message.created" and frame["sender_id"] != user_id:
+                client_message_id = frame["client_message_id"]
+                self.latencies.append(time.perf_counter() - self.sent_at[client_message_id])
+                self.delivered[client_message_id].set()
+
+    async def _converse(self, match):
+        participants = []
+        for user_id in (match.user1_id, match.user2_id):
+            communicator = WebsocketCommunicator(
+                application,
+                f"/ws/conversations/{match.id}/",
+                headers=[(b"authorization", f"Bearer {self.tokens[user_id]}".encode())],
+            )
+            connected, _ = await communicator.connect()
+            if not connected:
+                raise AssertionError(f"User {user_id} could not connect to {match.id}")
+            reader = asyncio.ensure_future(self._read(communicator, str(user_id)))
+            participants.append((communicator, reader))
+
+        try:
+            for index in range(self.messages):
+                communicator, _ = participants[index % 2]
+                client_message_id = str(uuid.uuid4())
+                self.delivered[client_message_id] = asyncio.Event()
+
+                for _ in range(self.KEYSTROKES):
+                    await communicator.send_json_to({"type": "typing.start"})
+                await communicator.send_json_to({"type": "typing.stop"})
+                self.sent_at[client_message_id] = time.perf_counter()
+                await communicator.send_json_to({
+                    "type": "message.send",
+                    "content": f"Load message {index}",
+                    "client_message_id": client_message_id,
+                })
+                await asyncio.wait_for(self.delivered[client_message_id].wait(), self.DELIVERY_TIMEOUT)
+                if index % self.HEARTBEAT_EVERY == self.HEARTBEAT_EVERY - 1:
+                    await communicator.send_json_to({"type": "ping"})
+        finally:
+            for communicator, reader in participants:
+                reader.cancel()
+                try:
+                    await communicator.disconnect()
+                except BaseException:
+                    pass
+
+    async def run(self) -> dict:
+        started = time.perf_counter()
+        await asyncio.gather(*(self._converse(match) for match in self.matches))
+        elapsed = time.perf_counter() - started
+
+        return {
+            "conversations": len(self.matches),
+            "users": len(self.tokens),
+            "messages": len(self.latencies),
+            "duration_seconds": round(elapsed, 3),
+            "messages_per_second": round(len(self.latencies) / elapsed, 1),
+            "latency_ms": {
+                "p50": round(_percentile(self.latencies, 50) * 1000, 2),
+                "p99": round(_percentile(self.latencies, 99) * 1000, 2),
+                "max": round(max(self.latencies) * 1000, 2),
+            },
+            "frames": self.frames,
+        }
+
+
+class WebSocketLoadTests(TransactionTestCase):
+    """Load scenario for ConversationConsumer, reported as JSON."""
+
+    # Regression bound for the default run
+    MAX_QUERIES_PER_MESSAGE = 10
+
+    def setUp(self):
+        PresenceService.clear()
+        self.conversations = int(os.environ.get("WS_LOAD_CONVERSATIONS", 10))
+        self.messages = int(os.environ.get("WS_LOAD_MESSAGES", 20))
+
+        users = [
+            User.objects.create_user(
+                email=f"ws_load{index}@example.com",
+                password="testpass123",
+                display_name=f"WS Load {index}",
+                birth_date=timezone.datetime(1995, 1, 1).date(),
+                email_verified=True,
+            )
+            for index in range(self.conversations * 2)
+        ]
+        self.matches = [
+            Match.objects.create(user1=users[index], user2=users[index + 1], status=Match.ACTIVE)
+            for index in range(0, len(users), 2)
+        ]
+        self.tokens = {user.id: str(RefreshToken.for_user(user).access_token) for user in users}
+
+    def _channel_layers(self):
+        redis_url = os.environ.get("WS_LOAD_REDIS_URL")
+        if redis_url:
+            return {
+                "default": {
+                    "BACKEND": "channels_redis.core.RedisChannelLayer",
+                    "CONFIG": {"hosts": [redis_url]},
+                }
+            }
+        return {"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}}
+
+    def test_conversation_load_report(self):
+        channel_layers = self._channel_layers()
+        harness = ConversationLoadHarness(self.matches, self.tokens, self.messages)
+
+        with override_settings(CHANNEL_LAYERS=channel_layers), QueryCounter() as queries:
+            report = async_to_sync(harness.run)()
+
+        total = self.conversations * self.messages
+        report["channel_layer"] = channel_layers["default"]["BACKEND"].rsplit(".", 1)[-1]
+        report["db_queries"] = queries.count
+        report["db_queries_per_message"] = round(queries.count / total, 2)
+
+        report_path = os.environ.get("WS_LOAD_REPORT")
+        if report_path == "-":
+            print(json.dumps(report, indent=2))
+        elif report_path:
+            with open(report_path, "w") as report_file:
+                report_file.write(json.dumps(report, indent=2))
+
+        # Every message delivered exactly once and stored
+        self.assertEqual(report["messages"], total)
+        self.assertEqual(Message.objects.filter(match__in=self.matches).count(), total)
+        self.assertGreater(report["frames"].get("typing.indicator", 0), 0)
+        self.assertLessEqual(report["db_queries_per_message"], self.MAX_QUERIES_PER_MESSAGE)